@@ -0,0 +1,146 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("FLUX_ANSWER_CACHE", "1") == "1"
+MAX_ENTRIES = int(os.environ.get("FLUX_ANSWER_CACHE_SIZE", "1000"))
+TTL_SECONDS = float(os.environ.get("FLUX_ANSWER_CACHE_TTL", "3600"))
+# Cosine similarity of query embeddings above which a paraphrase reuses an answer; 0 disables the tier
+SIMILARITY_THRESHOLD = float(os.environ.get("FLUX_ANSWER_CACHE_THRESHOLD", "0.95"))
+
+def normalize(question):
+    # Case, whitespace and trailing punctuation do not change the question
+    return " ".join(question.lower().split()).rstrip(" ?!.")
+
+class AnswerCache:
+    """Two-tier cache of /ask responses.
+
+    Exact tier: normalized question -> response. Semantic tier: a matrix of
+    query embeddings, one row per entry, searched with one matmul. Entries
+    only match requests with the same retrieval parameters and are dropped
+    as a whole when the index generation changes.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS, threshold=SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._entries = OrderedDict()  # (question, params) -> (response, slot, expires)
+        self._vectors = None
+        self._slot_keys = [None] * max_entries
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+                logger.info(f"Index generation changed, dropping {len(self._entries)} cached answers")
+            self._clear()
+            self._generation = generation
+
+    def _clear(self):
+        self._entries.clear()
+        self._slot_keys = [None] * self.max_entries
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def _drop(self, key):
+        _, slot, _ = self._entries.pop(key)
+        if slot is not None:
+            self._slot_keys[slot] = None
+            self._free.append(slot)
+
+    def _fresh(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= now:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, question, params, generation):
+        if not ENABLED:
+            return None
+        with self._lock:
+            self._check_generation(generation)
+            response = self._fresh((normalize(question), params), time.monotonic())
+            if response is not None:
+                self.hits += 1
+            return response
+
+    def get_similar(self, query_vector, params, generation):
+        # Called after an exact miss; counts the miss when nothing is close enough
+        if not ENABLED:
+            return None
+        with self._lock:
+            self._check_generation(generation)
+            response = None
+            if self.threshold > 0 and self._vectors is not None and self._entries:
+                q = np.asarray(query_vector, dtype=np.float32)
+                sims = self._vectors @ (q / (np.linalg.norm(q) or 1.0))
+                now = time.monotonic()
+                for slot in np.argsort(-sims).tolist():
+                    key = self._slot_keys[slot]
+                    if sims[slot] < self.threshold:
+                        break
+                    if key is not None and key[1] == params:
+                        response = self._fresh(key, now)
+                        if response is not None:
+                            break
+            if response is not None:
+                self.semantic_hits += 1
+            else:
+                self.misses += 1
+            return response
+
+    def put(self, question, query_vector, params, generation, response):
+        if not ENABLED or self.max_entries == 0:
+            return
+        key = (normalize(question), params)
+        with self._lock:
+            if self._generation is not None and generation < self._generation:
+                # The index changed while this answer was being generated
+                return
+            self._check_generation(generation)
+            if key in self._entries:
+                self._drop(key)
+            while len(self._entries) >= self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            slot = None
+            if query_vector is not None:
+                q = np.asarray(query_vector, dtype=np.float32)
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, len(q)), dtype=np.float32)
+                slot = self._free.pop()
+                self._vectors[slot] = q / (np.linalg.norm(q) or 1.0)
+                self._slot_keys[slot] = key
+            self._entries[key] = (response, slot, time.monotonic() + self.ttl_seconds)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+cache = AnswerCache()
@@ -0,0 +1,91 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = int(os.environ.get("FLUX_BATCH_MAX_SIZE", "16"))
+MAX_WAIT_MS = float(os.environ.get("FLUX_BATCH_MAX_WAIT_MS", "5"))
+
+class MicroBatcher:
+    """Collects concurrent single-item calls into one batched call.
+
+    `fn` takes a list of items and returns a list of results in the same
+    order. Callers block in `submit` until their item's batch has run.
+    """
+
+    def __init__(self, fn, name, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.fn = fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.total_delay_ms = 0.0
+        self.max_delay_ms = 0.0
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, future, time.perf_counter()))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            with self._stats_lock:
+                self.batch_sizes[len(batch)] += 1
+                for _, _, enqueued in batch:
+                    delay_ms = (started - enqueued) * 1000
+                    self.requests += 1
+                    self.total_delay_ms += delay_ms
+                    self.max_delay_ms = max(self.max_delay_ms, delay_ms)
+
+            try:
+                results = self.fn([item for item, _, _ in batch])
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} in {self.name} failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+    def stats(self):
+        with self._stats_lock:
+            batches = sum(self.batch_sizes.values())
+            return {
+                "batches": batches,
+                "requests": self.requests,
+                "mean_batch_size": self.requests / batches if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "mean_queue_delay_ms": self.total_delay_ms / self.requests if self.requests else 0.0,
+                "max_queue_delay_ms": self.max_delay_ms,
+            }
@@ -1,45 +1,140 @@
-import nltk
+import os
+import re
 import logging
+import threading
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+# Chunks are measured in tokens of the embedding model, so none is silently
+# truncated at embedding time (all-MiniLM-L6-v2 reads at most 256)
+TOKENIZER_NAME = os.environ.get("FLUX_CHUNK_TOKENIZER", "sentence-transformers/all-MiniLM-L6-v2")
+CHUNK_TOKENS = int(os.environ.get("FLUX_CHUNK_TOKENS", "128"))
+CHUNK_OVERLAP = int(os.environ.get("FLUX_CHUNK_OVERLAP", "32"))
+# Word/punctuation split, used when the tokenizer files are not available locally
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
 
-try:
-    nltk.data.find('tokenizers/punkt_tab')
-except LookupError:
-    nltk.download('punkt_tab')
+_punkt_ready = False
+_sentence_tokenizer = None
+_tokenizer = None
+_tokenizer_failed = False
+_load_lock = threading.Lock()
 
-def split_text_into_chunks(text, chunk_size=500, overlap=100):
+def ensure_punkt():
+    # nltk (and the scipy stack it pulls in) is imported and its data checked on
+    # first use rather than at import, so importing never hits the network
+    global _punkt_ready
+    if _punkt_ready:
+        return
+    import nltk
+    for resource in ('punkt', 'punkt_tab'):
+        try:
+            nltk.data.find(f'tokenizers/{resource}')
+        except LookupError:
+            nltk.download(resource)
+    _punkt_ready = True
+
+def is_loaded():
+    return _punkt_ready
+
+def sentence_tokenizer():
+    global _sentence_tokenizer
+    ensure_punkt()
+    with _load_lock:
+        if _sentence_tokenizer is None:
+            from nltk.tokenize import PunktTokenizer
+            _sentence_tokenizer = PunktTokenizer("english")
+    return _sentence_tokenizer
+
+def tokenizer():
+    # Fast (Rust) tokenizer of the embedding model, read from the local cache
+    # only: chunking never waits on the network. None means "approximate".
+    global _tokenizer, _tokenizer_failed
+    with _load_lock:
+        if _tokenizer is None and not _tokenizer_failed:
+            try:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME, local_files_only=True)
+            except Exception as e:
+                _tokenizer_failed = True
+                logger.warning(f"Tokenizer {TOKENIZER_NAME} is not available locally, approximating tokens by words: {e}")
+    return _tokenizer
+
+def token_starts(text):
+    # Character offset of every token in text, from one tokenizer call
+    tok = tokenizer()
+    if tok is not None and tok.is_fast:
+        offsets = tok(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)["offset_mapping"]
+        return np.fromiter((start for start, _ in offsets), dtype=np.int64, count=len(offsets))
+    return np.fromiter((m.start() for m in _WORD_RE.finditer(text)), dtype=np.int64)
+
+def sentence_spans(text):
+    spans = np.fromiter((i for span in sentence_tokenizer().span_tokenize(text) for i in span), dtype=np.int64)
+    if len(spans):
+        # Punkt's first span starts at 0 even after leading whitespace
+        spans[0] = len(text) - len(text.lstrip())
+    return spans[0::2], spans[1::2]
+
+def _split_long(text, starts, ends, counts, tokens, max_tokens):
+    # Sentences longer than a chunk are cut at token boundaries
+    out_starts, out_ends = [], []
+    for s, e, n in zip(starts.tolist(), ends.tolist(), counts.tolist()):
+        if n <= max_tokens:
+            out_starts.append(s)
+            out_ends.append(e)
+            continue
+        first = int(np.searchsorted(tokens, s))
+        cuts = tokens[first + max_tokens:first + n:max_tokens].tolist()
+        out_starts.extend([s] + cuts)
+        out_ends.extend([start + len(text[start:cut].rstrip()) for start, cut in zip([s] + cuts, cuts)] + [e])
+    return np.array(out_starts, dtype=np.int64), np.array(out_ends, dtype=np.int64)
+
+def chunk_spans(text, max_tokens=None, overlap=None):
+    # (starts, ends, token counts) of the chunks of text. A chunk is a run of
+    # whole sentences of at most max_tokens; the next chunk starts with the
+    # trailing sentences of this one that fit in `overlap` tokens.
+    max_tokens = CHUNK_TOKENS if max_tokens is None else max_tokens
+    overlap = CHUNK_OVERLAP if overlap is None else min(overlap, max_tokens - 1)
+    empty = np.zeros(0, dtype=np.int64)
+    if not text or not text.strip():
+        return empty, empty, empty
+
+    tokens = token_starts(text)
+    starts, ends = sentence_spans(text)
+    counts = np.searchsorted(tokens, ends) - np.searchsorted(tokens, starts)
+    if len(counts) and counts.max() > max_tokens:
+        starts, ends = _split_long(text, starts, ends, counts, tokens, max_tokens)
+        counts = np.searchsorted(tokens, ends) - np.searchsorted(tokens, starts)
+    # cum[i] = tokens before sentence i; a chunk of sentences i..j-1 costs cum[j] - cum[i]
+    cum = np.concatenate([[0], np.cumsum(counts)])
+
+    n = len(starts)
+    chunk_starts, chunk_ends = [], []
+    i = 0
+    while i < n:
+        j = max(int(np.searchsorted(cum, cum[i] + max_tokens, side="right")) - 1, i + 1)
+        chunk_starts.append(i)
+        chunk_ends.append(j)
+        if j >= n:
+            break
+        # Overlap: the suffix of this chunk that fits in `overlap` tokens, always moving forward
+        i = max(int(np.searchsorted(cum, cum[j] - overlap, side="left")), i + 1)
+        # ...shrunk until sentence j fits after it, so the next chunk never ends where this one did
+        i = max(i, int(np.searchsorted(cum, cum[j + 1] - max_tokens, side="left")))
+    first = np.array(chunk_starts, dtype=np.int64)
+    last = np.array(chunk_ends, dtype=np.int64)
+    return starts[first], ends[last - 1], cum[last] - cum[first]
+
+def chunk_text(text, max_tokens=None, overlap=None):
+    # [(chunk, char_start, char_end)]; each chunk is one slice of text
+    starts, ends, _ = chunk_spans(text, max_tokens, overlap)
+    chunks = [(text[s:e], s, e) for s, e in zip(starts.tolist(), ends.tolist())]
+    logger.debug(f"Chunked {len(text)} characters into {len(chunks)} chunks")
+    return chunks
+
+def split_text_into_chunks(text, chunk_size=None, overlap=None):
+    # chunk_size and overlap are in tokens
     if not text or not text.strip():
         logger.warning("Empty text provided to chunker")
         return []
-    
-    logger.info(f"Chunking text of length {len(text)}")
-    
-    sentences = nltk.sent_tokenize(text)
-    logger.info(f"Found {len(sentences)} sentences")
-    
-    out = []
-    curr = ""
-    
-    for i, sentence in enumerate(sentences):
-        if len(curr) + len(sentence) <= chunk_size:
-            curr += " " + sentence if curr else sentence
-        else:
-            if curr.strip():
-                out.append(curr.strip())
-                logger.info(f"Created chunk {len(out)} of length {len(curr)}")
-            
-            overlap_start = max(0, i - 2)
-            curr = " ".join(sentences[overlap_start:i+1])
-    
-    if curr.strip():
-        out.append(curr.strip())
-        logger.info(f"Created final chunk {len(out)} of length {len(curr)}")
-    
-    logger.info(f"Total chunks created: {len(out)}")
-    return out
\ No newline at end of file
+    return [chunk for chunk, _, _ in chunk_text(text, chunk_size, overlap)]
@@ -0,0 +1,36 @@
+import numpy as np
+
+class Column:
+    """Append-only numpy column.
+
+    Growth copies into a new buffer instead of resizing in place, so a view
+    taken by a concurrent reader stays valid (and unchanged up to its length)
+    while the writer keeps appending.
+    """
+
+    def __init__(self, dtype, values=(), min_capacity=1024):
+        self._data = np.array(values, dtype=dtype)
+        self.size = len(self._data)
+        self.min_capacity = min_capacity
+
+    def __len__(self):
+        return self.size
+
+    def append(self, value):
+        self.extend((value,))
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        data = self._data
+        if self.size + len(values) > len(data):
+            grown = np.empty(max(2 * len(data), self.size + len(values), self.min_capacity), dtype=data.dtype)
+            grown[:self.size] = data[:self.size]
+            data = grown
+        data[self.size:self.size + len(values)] = values
+        # Publish the buffer before the size so readers never see unwritten rows
+        self._data = data
+        self.size += len(values)
+
+    def view(self):
+        size = self.size
+        return self._data[:size]
@@ -0,0 +1,81 @@
+import os
+import logging
+from . import llm
+
+logger = logging.getLogger(__name__)
+
+# FLAN-T5's encoder input limit; the prompt, question and context must fit in it
+MAX_INPUT_TOKENS = int(os.environ.get("FLUX_MAX_INPUT_TOKENS", "512"))
+SEPARATOR = "\n\n"
+# Joining chunks can add a token at each boundary
+SEPARATOR_TOKENS = 1
+
+def format_chunk(meta):
+    return f"{meta.get('text', '[NO TEXT]')} (Source: {meta.get('source', 'unknown')}, page {meta.get('page', 'N/A')})"
+
+def count_tokens(texts):
+    tok = llm.tokenizer()
+    return [len(ids) for ids in tok(list(texts), add_special_tokens=False)["input_ids"]]
+
+def annotate_tokens(metas):
+    # Ingest time: every chunk carries the token count of its context entry,
+    # so packing never re-tokenizes stored chunks
+    try:
+        counts = count_tokens(format_chunk(m) for m in metas)
+    except Exception as e:
+        logger.warning(f"Could not count chunk tokens, they will be counted at query time: {e}")
+        return
+    for m, n in zip(metas, counts):
+        m["tokens"] = n
+
+def _prompt_tokens(question, context):
+    # Special tokens included, as the encoder sees them
+    return count_tokens([llm.build_prompt(question.strip(), context.strip())])[0] + 1
+
+def _truncate(text, n_tokens):
+    tok = llm.tokenizer()
+    ids = tok(text, add_special_tokens=False)["input_ids"][:n_tokens]
+    return tok.decode(ids, skip_special_tokens=True)
+
+def pack_context(question, hits, budget=None):
+    # Highest-scoring chunks that fit the encoder budget next to the prompt
+    # and the whole question. Returns (context, hits used, report).
+    budget = MAX_INPUT_TOKENS if budget is None else budget
+    report = {"budget": budget, "tokens": 0, "chunks_used": 0, "chunks_dropped": len(hits)}
+    if not hits:
+        return "", [], report
+    try:
+        overhead = _prompt_tokens(question, "")
+        counts = [meta.get("tokens") for _, meta in hits]
+        missing = [i for i, n in enumerate(counts) if n is None]
+        if missing:
+            for i, n in zip(missing, count_tokens(format_chunk(hits[i][1]) for i in missing)):
+                counts[i] = n
+    except Exception as e:
+        logger.error(f"Token counting failed, passing every chunk: {e}")
+        context = SEPARATOR.join(format_chunk(meta) for _, meta in hits)
+        return context, hits, {**report, "tokens": None, "chunks_used": len(hits), "chunks_dropped": 0}
+
+    remaining = budget - overhead
+    used = []
+    for i, n in enumerate(counts):
+        cost = n + (SEPARATOR_TOKENS if used else 0)
+        # Lower-ranked chunks may still fit after a long one is skipped
+        if cost <= remaining:
+            used.append(i)
+            remaining -= cost
+    entries = [format_chunk(hits[i][1]) for i in used]
+    if not used and remaining > 0:
+        # Even the best chunk is too long: keep as much of it as fits
+        used, entries = [0], [_truncate(format_chunk(hits[0][1]), remaining)]
+
+    context = SEPARATOR.join(entries)
+    tokens = _prompt_tokens(question, context)
+    while tokens > budget and len(entries) > 1:
+        # Boundary effects made the estimate short; drop the lowest-ranked chunk
+        used.pop()
+        entries.pop()
+        context = SEPARATOR.join(entries)
+        tokens = _prompt_tokens(question, context)
+    report.update(tokens=tokens, chunks_used=len(used), chunks_dropped=len(hits) - len(used))
+    return context, [hits[i] for i in used], report
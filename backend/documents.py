@@ -0,0 +1,185 @@
+import os
+import logging
+import numpy as np
+from .columns import Column
+
+logger = logging.getLogger(__name__)
+
+class DocumentTable:
+    """Per-row columns that sit next to the vector store.
+
+    Row i is vector id i. Every chunk gets a stable chunk id when it is added;
+    ids only ever increase and survive compaction, so the column stays sorted
+    and chunk id -> row is a binary search. Deleted chunks are tombstoned
+    (live == False) until compaction drops their rows.
+
+    Page and upload time are kept as columns for search filters, and each
+    source keeps its sorted row list so a source filter costs O(its rows).
+    """
+
+    def __init__(self):
+        self.sources = []
+        self._source_codes = {}
+        self._chunk_ids = Column(np.int64)
+        self._codes = Column(np.int32)
+        self._pages = Column(np.int32)
+        self._uploaded_at = Column(np.float64)
+        self._live = Column(np.bool_)
+        self._source_rows = []
+        self.next_chunk_id = 0
+
+    @property
+    def n_rows(self):
+        return self._chunk_ids.size
+
+    @property
+    def n_dead(self):
+        return self.n_rows - int(np.count_nonzero(self.live))
+
+    @property
+    def chunk_ids(self):
+        return self._chunk_ids.view()
+
+    @property
+    def live(self):
+        return self._live.view()
+
+    @property
+    def source_codes(self):
+        # Source code per row, as indexes into self.sources
+        return self._codes.view()
+
+    def code_of(self, source):
+        # -1 for a source with no rows yet
+        return self._source_codes.get(source, -1)
+
+    def _code(self, source):
+        code = self._source_codes.get(source)
+        if code is None:
+            code = self._source_codes[source] = len(self.sources)
+            self.sources.append(source)
+            self._source_rows.append(Column(np.int64, min_capacity=16))
+        return code
+
+    def assign_chunk_ids(self, metadatas):
+        for m in metadatas:
+            m["chunk_id"] = self.next_chunk_id
+            self.next_chunk_id += 1
+
+    def add(self, first_id, metadatas):
+        if first_id != self.n_rows:
+            raise ValueError(f"Rows must be added in order: expected row {self.n_rows}, got {first_id}")
+        # Rows written before chunk ids existed keep their row number as id
+        ids = [m.get("chunk_id", first_id + i) for i, m in enumerate(metadatas)]
+        codes = [self._code(m.get("source")) for m in metadatas]
+        self._chunk_ids.extend(ids)
+        self._codes.extend(codes)
+        # Rows ingested before these fields existed match no page or date filter
+        self._pages.extend([m.get("page", -1) for m in metadatas])
+        self._uploaded_at.extend([m.get("uploaded_at", 0.0) for m in metadatas])
+        self._live.extend(np.ones(len(metadatas), dtype=bool))
+        self._index_sources(first_id, np.asarray(codes, dtype=np.int32))
+        if ids:
+            self.next_chunk_id = max(self.next_chunk_id, int(ids[-1]) + 1)
+
+    def _index_sources(self, first_id, codes):
+        order = np.argsort(codes, kind="stable")
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group):
+                self._source_rows[codes[group[0]]].extend(first_id + group)
+
+    def rows_for_chunks(self, chunk_ids):
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        rows = np.searchsorted(self.chunk_ids, chunk_ids)
+        found = rows < self.n_rows
+        found[found] = self.chunk_ids[rows[found]] == chunk_ids[found]
+        return rows[found]
+
+    def rows_for_source(self, source):
+        code = self._source_codes.get(source)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        rows = self._source_rows[code].view()
+        return rows[self.live[rows]]
+
+    def select_rows(self, source=None, page_from=None, page_to=None, uploaded_after=None):
+        # Sorted live rows matching every given filter; None when there are no filters
+        if source is None and page_from is None and page_to is None and uploaded_after is None:
+            return None
+        rows = self.rows_for_source(source) if source is not None else np.flatnonzero(self.live)
+        if page_from is not None:
+            rows = rows[self._pages.view()[rows] >= page_from]
+        if page_to is not None:
+            rows = rows[self._pages.view()[rows] <= page_to]
+        if uploaded_after is not None:
+            rows = rows[self._uploaded_at.view()[rows] > uploaded_after]
+        return rows
+
+    def tombstone(self, rows):
+        self._live.view()[rows] = False
+
+    def allowed(self, mask=None):
+        # Combined "may be returned" mask for searches; None when nothing is excluded
+        if mask is None:
+            return self.live.copy() if self.n_dead else None
+        mask = np.asarray(mask, dtype=bool)[:self.n_rows]
+        return mask & self.live[:len(mask)]
+
+    def source_counts(self):
+        counts = np.bincount(self._codes.view()[self.live], minlength=len(self.sources))
+        return {s: int(c) for s, c in zip(self.sources, counts) if c}
+
+    def select(self, rows):
+        return DocumentTable._from_columns(
+            self.sources, self.chunk_ids[rows], self._codes.view()[rows], self._pages.view()[rows],
+            self._uploaded_at.view()[rows], self.next_chunk_id)
+
+    @classmethod
+    def _from_columns(cls, sources, chunk_ids, codes, pages, uploaded_at, next_chunk_id):
+        table = cls()
+        for source in sources:
+            table._code(source)
+        table._chunk_ids = Column(np.int64, chunk_ids)
+        table._codes = Column(np.int32, codes)
+        table._pages = Column(np.int32, pages)
+        table._uploaded_at = Column(np.float64, uploaded_at)
+        table._live = Column(np.bool_, np.ones(len(chunk_ids), dtype=bool))
+        table._index_sources(0, np.asarray(codes, dtype=np.int32))
+        table.next_chunk_id = next_chunk_id
+        return table
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            chunk_ids=self.chunk_ids,
+            source_codes=self._codes.view(),
+            pages=self._pages.view(),
+            uploaded_at=self._uploaded_at.view(),
+            sources=np.array(self.sources, dtype=str),
+            next_chunk_id=np.array([self.next_chunk_id]),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, n_rows=None):
+        data = np.load(path)
+        if "pages" not in data.files:
+            # Written before the filter columns existed; rebuilt from metadata by the caller
+            table = cls()
+            table.next_chunk_id = int(data["next_chunk_id"][0])
+            return table
+        # Rows past the metadata file come from an interrupted write
+        n = len(data["chunk_ids"]) if n_rows is None else min(n_rows, len(data["chunk_ids"]))
+        return cls._from_columns(
+            data["sources"].tolist(), data["chunk_ids"][:n], data["source_codes"][:n], data["pages"][:n],
+            data["uploaded_at"][:n], int(data["next_chunk_id"][0]))
+
+    def stats(self):
+        return {
+            "rows": self.n_rows,
+            "live": self.n_rows - self.n_dead,
+            "tombstoned": self.n_dead,
+            "documents": len(self.source_counts()),
+        }
@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: the cache lock is process-local only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get("FLUX_EMBED_CACHE_DIR", "data/cache")
+LRU_SIZE = int(os.environ.get("FLUX_EMBED_CACHE_LRU", "10000"))
+
+KEY_BYTES = 20  # sha1 digest
+
+def text_key(text):
+    normalized = " ".join(text.split())
+    return hashlib.sha1(normalized.encode("utf-8")).digest()
+
+class EmbeddingCache:
+    """Two-tier cache of float32 embeddings for one model.
+
+    Disk tier: <model>.f32 (row-major vectors, read through mmap) and
+    <model>.keys (one sha1 per row). Memory tier: a bounded LRU of vectors.
+    Several processes may share the disk tier: appends and the load-time
+    repair run under an flock on <model>.lock, and each instance picks up
+    rows the others appended from the keys file.
+    """
+
+    def __init__(self, model_name, cache_dir=CACHE_DIR, lru_size=LRU_SIZE):
+        prefix = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        self.model_name = model_name
+        self.vectors_path = prefix + ".f32"
+        self.keys_path = prefix + ".keys"
+        self.meta_path = prefix + ".json"
+        self.lock_path = prefix + ".lock"
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._rows = None
+        self._n_keys = 0  # rows of the keys file read into _rows
+        self._dim = None
+        self._mmap = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _key_rows(self):
+        return os.path.getsize(self.keys_path) // KEY_BYTES if os.path.exists(self.keys_path) else 0
+
+    def _catch_up(self):
+        # Caller holds the file lock. Reads keys appended since the last call,
+        # by this or another process, and drops vectors that never got a key
+        # (vectors are written first; the writer died before the keys).
+        if self._dim is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path) as f:
+                self._dim = json.load(f)["dim"]
+        n_vectors = os.path.getsize(self.vectors_path) // (self._dim * 4) if os.path.exists(self.vectors_path) else 0
+        n = min(self._key_rows(), n_vectors)
+        if n_vectors > n:
+            os.truncate(self.vectors_path, n * self._dim * 4)
+        if n > self._n_keys:
+            with open(self.keys_path, "rb") as f:
+                f.seek(self._n_keys * KEY_BYTES)
+                keys = np.frombuffer(f.read((n - self._n_keys) * KEY_BYTES), dtype=f"S{KEY_BYTES}")
+            for i, k in enumerate(keys, start=self._n_keys):
+                self._rows.setdefault(bytes(k), i)
+            self._n_keys = n
+
+    def _load(self):
+        if self._rows is None:
+            self._rows = {}
+            if os.path.exists(self.meta_path):
+                with self._file_lock():
+                    self._catch_up()
+                logger.info(f"Loaded embedding cache for {self.model_name}: {self._n_keys} entries")
+        elif self._key_rows() > self._n_keys:
+            # Another process appended since; one stat per lookup batch keeps this cheap
+            with self._file_lock():
+                self._catch_up()
+
+    def _disk_vector(self, row):
+        if self._mmap is None or row >= len(self._mmap):
+            self._mmap = np.memmap(self.vectors_path, dtype="float32", mode="r").reshape(-1, self._dim)
+        return np.array(self._mmap[row])
+
+    def _remember(self, key, vec):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, keys):
+        out = []
+        with self._lock:
+            self._load()
+            for key in keys:
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    self.hits += 1
+                elif key in self._rows:
+                    vec = self._disk_vector(self._rows[key])
+                    self._remember(key, vec)
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+                out.append(vec)
+        return out
+
+    def put_many(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._lock:
+            self._load()
+            new = [i for i, k in enumerate(keys) if k not in self._rows]
+            if new:
+                with self._file_lock():
+                    self._catch_up()
+                    new = [i for i in new if keys[i] not in self._rows]
+                    if self._dim is None:
+                        self._dim = vectors.shape[1]
+                        with open(self.meta_path, "w") as f:
+                            json.dump({"model": self.model_name, "dim": self._dim}, f)
+                    start = self._n_keys
+                    with open(self.vectors_path, "ab") as f:
+                        f.write(vectors[new].tobytes())
+                    with open(self.keys_path, "ab") as f:
+                        f.write(b"".join(keys[i] for i in new))
+                    for offset, i in enumerate(new):
+                        self._rows.setdefault(keys[i], start + offset)
+                    self._n_keys = start + len(new)
+            for key, vec in zip(keys, vectors):
+                self._remember(key, vec)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": len(self._rows or {}),
+            "memory_entries": len(self._lru),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
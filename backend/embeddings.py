@@ -1,16 +1,70 @@
-from sentence_transformers import SentenceTransformer
+from .embedding_cache import EmbeddingCache, text_key
+from . import inference
+import os
+import threading
 import numpy as np
 
 MODEL_NAME = "all-MiniLM-L6-v2"
+CACHE_ENABLED = os.environ.get("FLUX_EMBED_CACHE", "1") == "1"
+BACKEND = inference.backend_for("FLUX_EMBED_BACKEND")
 _model = None
+_cache = None
+_load_lock = threading.Lock()
+_cache_lock = threading.Lock()
+
+def load_model(backend="torch"):
+    inference.check_backend(backend)
+    from sentence_transformers import SentenceTransformer
+    if backend == "onnx":
+        inference.require_onnxruntime()
+        return SentenceTransformer(MODEL_NAME, device="cpu", backend="onnx")
+    m = SentenceTransformer(MODEL_NAME, device="cpu" if backend == "int8" else None)
+    if backend == "int8":
+        inference.quantize_int8(m)
+    return m
 
 def model():
     global _model
-    if _model is None:
-        _model = SentenceTransformer(MODEL_NAME)
+    with _load_lock:
+        if _model is None:
+            _model = load_model(BACKEND)
     return _model
 
-def embed_texts(texts):
+def is_loaded():
+    return _model is not None
+
+def cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            # Quantized backends produce slightly different vectors; keep them apart
+            _cache = EmbeddingCache(MODEL_NAME if BACKEND == "torch" else f"{MODEL_NAME}-{BACKEND}")
+    return _cache
+
+def _encode(texts):
     m = model()
     embs = m.encode(texts, show_progress_bar=False, convert_to_numpy=True)
-    return embs.astype("float32") 
\ No newline at end of file
+    return embs.astype("float32")
+
+def embed_texts(texts):
+    if not CACHE_ENABLED:
+        return _encode(texts)
+
+    c = cache()
+    keys = [text_key(t) for t in texts]
+    found = c.get_many(keys)
+
+    # Encode each distinct missing text once
+    missing = {}
+    for key, text, vec in zip(keys, texts, found):
+        if vec is None:
+            missing.setdefault(key, text)
+    if missing:
+        embs = _encode(list(missing.values()))
+        c.put_many(list(missing.keys()), embs)
+        fresh = dict(zip(missing.keys(), embs))
+        found = [fresh[k] if v is None else v for k, v in zip(keys, found)]
+
+    if not found:
+        return np.zeros((0, 0), dtype="float32")
+    return np.stack(found).astype("float32")
@@ -0,0 +1,34 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# CPU inference backends for the embedding model and FLAN-T5:
+#   torch - fp32 PyTorch eager (default)
+#   int8  - PyTorch dynamic int8 quantization of every nn.Linear
+#   onnx  - ONNX Runtime export; needs `pip install optimum[onnxruntime]`
+BACKENDS = ("torch", "int8", "onnx")
+DEFAULT_BACKEND = os.environ.get("FLUX_INFERENCE_BACKEND", "torch")
+
+def backend_for(env_var):
+    backend = os.environ.get(env_var, DEFAULT_BACKEND)
+    check_backend(backend)
+    return backend
+
+def check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+
+def quantize_int8(module):
+    import torch
+    # Weights stored as int8, activations quantized on the fly per batch
+    quantized = torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    logger.info(f"Applied dynamic int8 quantization to {type(module).__name__}")
+    return quantized
+
+def require_onnxruntime():
+    try:
+        import onnxruntime  # noqa: F401
+        import optimum.onnxruntime  # noqa: F401
+    except ImportError as e:
+        raise ImportError("The onnx inference backend needs `pip install optimum[onnxruntime]`") from e
@@ -1,9 +1,21 @@
 import fitz
-from .chunker import split_text_into_chunks
+from .chunker import chunk_text
+import os
+import math
 import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Worker processes used to extract and chunk pages; 1 keeps ingestion in-process
+INGEST_PROCESSES = int(os.environ.get("FLUX_INGEST_PROCESSES", "1"))
+MAX_PAGES_PER_SHARD = 50
+
+# Set once per worker process by _init_worker
+_worker_doc = None
+
 def extract_pages(pdf_bytes):
     logger.info(f"Opening PDF with {len(pdf_bytes)} bytes")
     
@@ -16,49 +28,118 @@ def extract_pages(pdf_bytes):
 
     for page_idx, page in enumerate(doc):
         text = page.get_text("text")
-        logger.info(f"Page {page_idx + 1}: extracted {len(text)} characters")
+        logger.debug(f"Page {page_idx + 1}: extracted {len(text)} characters")
         if text.strip():
-            logger.info(f"Page {page_idx + 1} preview: {text[:100]}...")
+            logger.debug(f"Page {page_idx + 1} preview: {text[:100]}...")
         else:
             logger.warning(f"Page {page_idx + 1} is empty!")
         yield page_idx + 1, text
 
-def process_pdf_bytes(pdf_bytes, filename):
-    logger.info(f"Processing PDF: {filename}")
-    chunks = []
+def page_ranges(n_pages, workers):
+    # Several shards per worker so a slow range does not leave the others idle
+    per_shard = max(1, min(MAX_PAGES_PER_SHARD, math.ceil(n_pages / (workers * 4))))
+    return [(start, min(start + per_shard, n_pages)) for start in range(0, n_pages, per_shard)]
+
+def _init_worker(pdf_bytes):
+    global _worker_doc
+    _worker_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+def _chunk_page_range(start, stop):
+    out = []
+    for page_idx in range(start, stop):
+        text = _worker_doc[page_idx].get_text("text")
+        page_chunks = chunk_text(text) if text.strip() else []
+        out.append((page_idx + 1, page_chunks))
+    return out
+
+def _iter_page_chunks_parallel(pdf_bytes, workers):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        n_pages = len(doc)
+    ranges = page_ranges(n_pages, workers)
+    logger.info(f"Chunking {n_pages} pages in {len(ranges)} shards across {workers} processes")
+
+    # spawn rather than fork: the parent may already hold torch/tokenizer threads
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(pdf_bytes,)) as pool:
+        # Bounded window of in-flight shards, consumed in submission (page) order
+        pending = deque()
+        for start, stop in ranges:
+            pending.append(pool.submit(_chunk_page_range, start, stop))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def _iter_page_chunks(pdf_bytes, workers):
+    if workers > 1:
+        yield from _iter_page_chunks_parallel(pdf_bytes, workers)
+        return
+
+    for page_num, page_text in extract_pages(pdf_bytes=pdf_bytes):
+        if not page_text.strip():
+            yield page_num, []
+            continue
+        yield page_num, chunk_text(page_text)
+
+def iter_chunks(pdf_bytes, filename, progress=None, workers=None):
     seen_chunks = set()  # Track chunks we've already processed
-    
-    try:
-        for page_num, page_text in extract_pages(pdf_bytes=pdf_bytes):
-            if not page_text.strip():
-                logger.warning(f"Page {page_num} has no text content")
+    workers = INGEST_PROCESSES if workers is None else workers
+    n_chunks = 0
+
+    for page_num, page_chunks in _iter_page_chunks(pdf_bytes, workers):
+        if progress:
+            progress(pages_parsed=page_num)
+        if not page_chunks:
+            logger.warning(f"Page {page_num} has no text content")
+            continue
+            
+        logger.debug(f"Page {page_num}: created {len(page_chunks)} chunks")
+        
+        for i, (text, char_start, char_end) in enumerate(page_chunks):
+            if not text.strip():
+                logger.warning(f"Empty chunk {i} on page {page_num}")
                 continue
-                
-            page_chunks = split_text_into_chunks(page_text, chunk_size=500, overlap=100)
-            logger.info(f"Page {page_num}: created {len(page_chunks)} chunks")
             
-            for i, chunk_text in enumerate(page_chunks):
-                if not chunk_text.strip():
-                    logger.warning(f"Empty chunk {i} on page {page_num}")
-                    continue
-                
-                # Check for duplicate chunks (normalize whitespace for comparison)
-                normalized_chunk = ' '.join(chunk_text.split())
-                if normalized_chunk in seen_chunks:
-                    logger.info(f"Skipping duplicate chunk on page {page_num}")
-                    continue
-                
-                seen_chunks.add(normalized_chunk)
-                    
-                metadata = {
-                    "source": filename,
-                    "page": page_num,
-                    "text": chunk_text
-                }
-                chunks.append((chunk_text, metadata))
+            # Check for duplicate chunks (normalize whitespace for comparison)
+            normalized_chunk = ' '.join(text.split())
+            if normalized_chunk in seen_chunks:
+                logger.debug(f"Skipping duplicate chunk on page {page_num}")
+                continue
+            
+            seen_chunks.add(normalized_chunk)
                 
-                if len(chunks) <= 3:  # Log first few chunks
-                    logger.info(f"Chunk {len(chunks)}: {len(chunk_text)} chars, preview: {chunk_text[:50]}...")
+            metadata = {
+                "source": filename,
+                "page": page_num,
+                "text": text,
+                # Offsets of the chunk in the page text
+                "char_start": char_start,
+                "char_end": char_end
+            }
+            n_chunks += 1
+            if n_chunks <= 3:  # Log first few chunks
+                logger.debug(f"Chunk {n_chunks}: {len(text)} chars, preview: {text[:50]}...")
+            yield text, metadata
+
+def iter_batches(items, batch_size):
+    # Bounded buffer between the chunk generator and the embed/add stages
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def process_pdf_bytes(pdf_bytes, filename, progress=None, workers=None):
+    logger.info(f"Processing PDF: {filename}")
+    chunks = []
+    
+    try:
+        for chunk in iter_chunks(pdf_bytes, filename, progress=progress, workers=workers):
+            chunks.append(chunk)
     
     except Exception as e:
         logger.error(f"Error processing PDF: {e}")
@@ -66,4 +147,4 @@ def process_pdf_bytes(pdf_bytes, filename):
         traceback.print_exc()
     
     logger.info(f"Total unique chunks created: {len(chunks)}")
-    return chunks
\ No newline at end of file
+    return chunks
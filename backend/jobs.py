@@ -0,0 +1,73 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.environ.get("FLUX_INGEST_WORKERS", "2"))
+MAX_FINISHED_JOBS = 200
+
+_executor = None
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+    return _executor
+
+def update(job_id, **fields):
+    with _jobs_lock:
+        if job_id in _jobs:
+            _jobs[job_id].update(fields)
+
+def get(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+def list_jobs():
+    with _jobs_lock:
+        return [dict(j) for j in _jobs.values()]
+
+def _prune():
+    finished = [j for j in _jobs.values() if j["status"] in ("completed", "failed")]
+    for job in sorted(finished, key=lambda j: j["finished_at"])[:-MAX_FINISHED_JOBS]:
+        del _jobs[job["id"]]
+
+def _run(job_id, fn, args):
+    update(job_id, status="running", started_at=time.time())
+    try:
+        fn(*args, progress=lambda **fields: update(job_id, **fields))
+        update(job_id, status="completed", finished_at=time.time())
+        logger.info(f"Job {job_id} completed")
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        update(job_id, status="failed", error=str(e), finished_at=time.time())
+    with _jobs_lock:
+        _prune()
+
+def submit(fn, *args, filename=None):
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _jobs[job_id] = {
+            "id": job_id,
+            "filename": filename,
+            "status": "queued",
+            "pages_parsed": 0,
+            "chunks_embedded": 0,
+            "vectors_added": 0,
+            "embeddings_saved": 0,
+            "vectors_saved": 0,
+            "chunks_unchanged": 0,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+    executor().submit(_run, job_id, fn, args)
+    return job_id
@@ -0,0 +1,173 @@
+import os
+import re
+import math
+import logging
+import numpy as np
+from .columns import Column
+
+logger = logging.getLogger(__name__)
+
+# Keeps codes like "CS-101", "B.204" or "x_17" together as one token
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+SEPARATORS_RE = re.compile(r"[-_./]")
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        parts = SEPARATORS_RE.split(token)
+        if len(parts) > 1:
+            # "cs-101" also matches queries for "cs101", "cs" and "101"
+            tokens.append("".join(parts))
+            tokens.extend(parts)
+    return tokens
+
+class BM25Index:
+    """Incremental BM25 inverted index over chunk texts.
+
+    Doc ids are vector ids. Each term keeps two append-only columns (uint32
+    doc ids, uint16 term frequencies) that are scored through zero-copy numpy
+    views; searches can run while a writer adds documents.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._doc_lens = Column(np.uint32)
+        self._total_len = 0
+
+    @property
+    def n_docs(self):
+        return len(self._doc_lens)
+
+    def add(self, first_id, texts):
+        # Ids without text (e.g. rows ingested before the index existed) count as empty docs
+        if self.n_docs < first_id:
+            self._doc_lens.extend(np.zeros(first_id - self.n_docs, dtype=np.uint32))
+        batch = {}
+        lengths = []
+        for doc_id, text in enumerate(texts, start=self.n_docs):
+            counts = {}
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            for term, tf in counts.items():
+                ids, tfs = batch.setdefault(term, ([], []))
+                ids.append(doc_id)
+                tfs.append(min(tf, 65535))
+            lengths.append(sum(counts.values()))
+        for term, (ids, tfs) in batch.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = (Column(np.uint32, min_capacity=4), Column(np.uint16, min_capacity=4))
+            posting[0].extend(ids)
+            posting[1].extend(tfs)
+            self._postings[term] = posting
+        # Document lengths last: a concurrent search only scores docs it can see
+        self._doc_lens.extend(lengths)
+        self._total_len += sum(lengths)
+
+    def _posting(self, term, n_docs):
+        posting = self._postings.get(term)
+        if posting is None:
+            return None
+        # A writer may be extending the lists: keep the docs this search can see
+        ids, tfs = posting[0].view(), posting[1].view()
+        n = min(np.searchsorted(ids, n_docs), len(tfs))
+        return (ids[:n], tfs[:n]) if n else None
+
+    def _bm25(self, tfs, ids, df, n, avgdl):
+        tfs = tfs.astype(np.float32)
+        doc_lens = self._doc_lens.view()
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * doc_lens[ids].astype(np.float32) / np.float32(avgdl))
+        return (np.float32(idf * (self.k1 + 1)) * tfs / (tfs + norm)).astype(np.float32)
+
+    def search(self, query, top_k=10, max_df_ratio=0.5, common_df=10_000, mask=None):
+        n = self.n_docs
+        empty = np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64")
+        if n == 0:
+            return empty
+
+        avgdl = self._total_len / n or 1.0
+        postings = [p for p in (self._posting(t, n) for t in set(tokenize(query))) if p is not None]
+        # Near-stopwords carry almost no idf but have the longest lists
+        postings = [p for p in postings if len(p[0]) <= max_df_ratio * n or n <= 10]
+        postings.sort(key=lambda p: len(p[0]))
+        if not postings:
+            return empty
+
+        # Rare terms (codes, names) pick the candidates by scanning their lists;
+        # common terms only re-score those candidates by binary search, so a
+        # query is never dominated by its longest posting list
+        rare = [p for p in postings if len(p[0]) <= common_df] or postings
+        common = postings[len(rare):]
+
+        ids_parts, score_parts = [], []
+        for ids, tfs in rare:
+            ids_parts.append(ids)
+            score_parts.append(self._bm25(tfs, ids, len(ids), n, avgdl))
+        if len(ids_parts) == 1:
+            ids, scores = ids_parts[0], score_parts[0]
+        else:
+            ids, inverse = np.unique(np.concatenate(ids_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+        if mask is not None:
+            # Docs outside the mask (deleted or filtered out) are never returned
+            keep = ids < len(mask)
+            keep[keep] = mask[ids[keep]]
+            ids, scores = ids[keep], scores[keep]
+            if len(ids) == 0:
+                return empty
+
+        for post_ids, post_tfs in common:
+            # Posting ids are appended in increasing order, so they are sorted
+            pos = np.minimum(np.searchsorted(post_ids, ids), len(post_ids) - 1)
+            hit = post_ids[pos] == ids
+            tfs = post_tfs[pos[hit]]
+            scores[hit] += self._bm25(tfs, ids[hit], len(post_ids), n, avgdl)
+
+        k = min(top_k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return scores[top], ids[top].astype(np.int64)
+
+    def save(self, path):
+        terms = list(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(self._postings[t][0]) for t in terms], out=offsets[1:])
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            terms=np.array(terms, dtype=str),
+            offsets=offsets,
+            ids=np.concatenate([self._postings[t][0].view() for t in terms]) if terms else np.zeros(0, np.uint32),
+            tfs=np.concatenate([self._postings[t][1].view() for t in terms]) if terms else np.zeros(0, np.uint16),
+            doc_lens=self._doc_lens.view(),
+            params=np.array([self.k1, self.b]),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        k1, b = data["params"].tolist()
+        index = cls(k1=k1, b=b)
+        offsets, ids, tfs = data["offsets"], data["ids"], data["tfs"]
+        for i, term in enumerate(data["terms"].tolist()):
+            start, stop = offsets[i], offsets[i + 1]
+            index._postings[term] = (Column(np.uint32, ids[start:stop], min_capacity=4),
+                                     Column(np.uint16, tfs[start:stop], min_capacity=4))
+        index._doc_lens = Column(np.uint32, data["doc_lens"])
+        index._total_len = int(data["doc_lens"].sum())
+        return index
+
+    def stats(self):
+        postings = sum(len(p[0]) for p in list(self._postings.values()))
+        return {
+            "docs": self.n_docs,
+            "terms": len(self._postings),
+            "postings": postings,
+            # 4 bytes doc id + 2 bytes tf per posting
+            "posting_bytes": postings * 6,
+        }
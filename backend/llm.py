@@ -1,21 +1,85 @@
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+from .batcher import MicroBatcher
+from . import inference
+import os
+import queue
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
 MODEL_NAME = "google/flan-t5-base"
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
+NO_ANSWER = "I don't know based on the provided materials."
+BACKEND = inference.backend_for("FLUX_LLM_BACKEND")
+# Seconds stream_answer waits for the next piece of text before giving up
+STREAM_TIMEOUT = float(os.environ.get("FLUX_STREAM_TIMEOUT", "60"))
 
+# transformers and the model weights are loaded on first use (or by warm_up),
+# so importing this module stays cheap
+_tokenizer = None
+_model = None
+_load_lock = threading.Lock()
 
-def generate_answer_with_flan(question, context, max_tokens=128):
+def tokenizer():
+    global _tokenizer
+    with _load_lock:
+        if _tokenizer is None:
+            from transformers import AutoTokenizer
+            _tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    return _tokenizer
+
+def load_model(backend="torch"):
+    inference.check_backend(backend)
+    if backend == "onnx":
+        inference.require_onnxruntime()
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        return ORTModelForSeq2SeqLM.from_pretrained(MODEL_NAME, export=True)
+    from transformers import AutoModelForSeq2SeqLM
+    m = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
+    if backend == "int8":
+        inference.quantize_int8(m)
+    return m
+
+def model():
+    global _model
+    with _load_lock:
+        if _model is None:
+            _model = load_model(BACKEND)
+    return _model
+
+def is_loaded():
+    return _tokenizer is not None and _model is not None
+
+
+def build_prompt(question, context):
+    return f"Please answer this question using only the provided information.\n\nInformation:\n{context}\n\nQuestion: {question}\n\nAnswer:"
+
+def clean_answer(generated_text, prompt):
+    # Clean up the response
+    answer = generated_text.strip()
     
-    prompt = f"Please answer this question using only the provided information.\n\nInformation:\n{context}\n\nQuestion: {question}\n\nAnswer:"
+    # If the answer is too short, empty, or just repeats the prompt
+    if (not answer or 
+        len(answer) < 5 or 
+        answer.lower() in ["i don't know", "i don't know.", "no", "yes"] or
+        prompt.lower() in answer.lower()):
+        logger.info("FLAN-T5 gave insufficient answer, using fallback")
+        return None
+        
+    # Format the answer nicely
+    if not answer.startswith("Based on"):
+        answer = f"Based on the provided materials: {answer}"
+        
+    return answer
+
+def generate_answers_with_flan(items, max_tokens=128):
+    # items: list of (question, context); one padded generate call for all of them
+    prompts = [build_prompt(q, c) for q, c in items]
     
     try:
+        tok, m = tokenizer(), model()
         # Tokenize with proper truncation
-        inputs = tokenizer(
-            prompt, 
+        inputs = tok(
+            prompts, 
             return_tensors="pt", 
             max_length=512, 
             truncation=True,
@@ -23,61 +87,105 @@ def generate_answer_with_flan(question, context, max_tokens=128):
         )
         
         # Generate with good parameters for FLAN-T5
-        with tokenizer.as_target_tokenizer():
-            outputs = model.generate(
+        with tok.as_target_tokenizer():
+            outputs = m.generate(
                 input_ids=inputs['input_ids'],
                 attention_mask=inputs['attention_mask'],
                 max_new_tokens=max_tokens,
                 num_beams=2,  # Small beam search for better quality
                 do_sample=False,
                 early_stopping=True,
-                pad_token_id=tokenizer.pad_token_id,
-                eos_token_id=tokenizer.eos_token_id,
+                pad_token_id=tok.pad_token_id,
+                eos_token_id=tok.eos_token_id,
                 no_repeat_ngram_size=3  # Avoid repetitive text
             )
         
-        # Decode the response
-        generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        logger.info(f"FLAN-T5 raw output: {generated_text}")
+        # Decode the responses
+        generated = tok.batch_decode(outputs, skip_special_tokens=True)
+        logger.debug(f"FLAN-T5 raw output: {generated}")
         
-        # Clean up the response
-        answer = generated_text.strip()
-        
-        # If the answer is too short, empty, or just repeats the prompt
-        if (not answer or 
-            len(answer) < 5 or 
-            answer.lower() in ["i don't know", "i don't know.", "no", "yes"] or
-            prompt.lower() in answer.lower()):
-            logger.info("FLAN-T5 gave insufficient answer, using fallback")
-            return None
-            
-        # Format the answer nicely
-        if not answer.startswith("Based on"):
-            answer = f"Based on the provided materials: {answer}"
-            
-        return answer
+        return [clean_answer(text, prompt) for text, prompt in zip(generated, prompts)]
         
     except Exception as e:
         logger.error(f"FLAN-T5 generation failed: {e}")
-        return None
+        return [None] * len(items)
+
+def _generate_batch(requests):
+    # requests: list of (question, context, max_tokens); batch per max_tokens
+    answers = [None] * len(requests)
+    for max_tokens in {r[2] for r in requests}:
+        positions = [i for i, r in enumerate(requests) if r[2] == max_tokens]
+        results = generate_answers_with_flan([requests[i][:2] for i in positions], max_tokens=max_tokens)
+        for i, answer in zip(positions, results):
+            answers[i] = answer
+    return answers
+
+generation_batcher = MicroBatcher(_generate_batch, name="generation")
+
+def generate_answer_with_flan(question, context, max_tokens=128):
+    return generation_batcher.submit((question, context, max_tokens))
+
+def stream_answer(question, context, max_tokens=128):
+    # Yields decoded text pieces as FLAN-T5 produces them. Streaming needs
+    # greedy decoding, so this path does not use beam search.
+    from transformers import TextIteratorStreamer
+    
+    tok, m = tokenizer(), model()
+    prompt = build_prompt(question.strip(), context.strip())
+    inputs = tok(prompt, return_tensors="pt", max_length=512, truncation=True)
+    streamer = TextIteratorStreamer(tok, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_TIMEOUT)
+    errors = []
+
+    def generate():
+        try:
+            m.generate(
+                input_ids=inputs['input_ids'],
+                attention_mask=inputs['attention_mask'],
+                max_new_tokens=max_tokens,
+                do_sample=False,
+                pad_token_id=tok.pad_token_id,
+                eos_token_id=tok.eos_token_id,
+                no_repeat_ngram_size=3,
+                streamer=streamer,
+            )
+        except Exception as e:
+            # Unblocks the iterator below, which re-raises this in the caller
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=generate, daemon=True)
+    thread.start()
+    
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    except queue.Empty:
+        raise TimeoutError(f"FLAN-T5 produced no text for {STREAM_TIMEOUT}s") from None
+    thread.join()
+    if errors:
+        raise errors[0]
+
+def finalize_streamed_answer(question, context, generated_text):
+    answer = clean_answer(generated_text, build_prompt(question.strip(), context.strip()))
+    return answer or NO_ANSWER
 
 def generate_answer(question, context, max_tokens=256):
     
     context = context.strip()
     question = question.strip()
     
-    logger.info(f"Generating answer for question: {question}")
-    logger.info(f"Context length: {len(context)} chars")
+    logger.debug(f"Generating answer for question: {question}")
+    logger.debug(f"Context length: {len(context)} chars")
     
     if not context or context == "[NO TEXT]":
-        return "I don't know based on the provided materials."
+        return NO_ANSWER
 
-    logger.info("Attempting FLAN-T5 generation...")
+    logger.debug("Attempting FLAN-T5 generation...")
     flan_answer = generate_answer_with_flan(question, context, max_tokens=128)
     
     if flan_answer:
-        logger.info(f"FLAN-T5 succeeded: {flan_answer[:100]}...")
+        logger.debug(f"FLAN-T5 succeeded: {flan_answer[:100]}...")
         return flan_answer
     
-    return "I don't know based on the provided materials."
\ No newline at end of file
+    return NO_ANSWER
\ No newline at end of file
@@ -1,95 +1,490 @@
-from fastapi import FastAPI, UploadFile
-from .ingestion import process_pdf_bytes
-from .vector_store import load_index, add, save_index
-from .embeddings import embed_texts
-from .retrieval import get_relevant_chunks
-from .llm import generate_answer
+from fastapi import FastAPI, UploadFile, HTTPException, Request
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from . import jobs, chunker, embeddings, llm, near_dup, answer_cache, shards, reranker, metrics
+from .ingestion import iter_chunks, iter_batches
+from .metrics import span
+from .vector_store import (load_index, add, save_index, index_stats, lexical_index, near_dup_index, snapshot,
+                           writer, migrate, check, generation, documents, delete_rows, delete_source, compact, fetch_metadata)
+from .embedding_cache import text_key
+from .context import pack_context, annotate_tokens
+from .embeddings import embed_texts, cache as embedding_cache
+from .retrieval import get_relevant_chunks, query_batcher
+from .llm import generate_answer, generation_batcher, stream_answer, finalize_streamed_answer, NO_ANSWER
+import os
+import json
+import numpy as np
+from typing import Literal
+from datetime import datetime
+import time
 import logging
+import threading
 
-logging.basicConfig(level=logging.INFO)
+metrics.configure_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Set FLUX_WARMUP=1 in production to load models at startup instead of on the first request
+WARMUP = os.environ.get("FLUX_WARMUP", "0") == "1"
+_warmup_done = threading.Event()
+
+def warm_snapshot():
+    # Runs in each shard worker; returns a row count so the Snapshot itself is never pickled
+    return snapshot(384).n_rows
+
+def warm_up():
+    started = time.perf_counter()
+    try:
+        chunker.ensure_punkt()
+        embeddings.model()
+        llm.tokenizer()
+        llm.model()
+        if reranker.ENABLED:
+            reranker.model()
+        if shards.enabled():
+            shards.call_all(warm_snapshot)
+        else:
+            load_index(384)
+            snapshot(384)
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+        return
+    _warmup_done.set()
+    logger.info(f"Warm-up completed in {time.perf_counter() - started:.1f}s")
+
+@asynccontextmanager
+async def lifespan(app):
+    if shards.enabled():
+        # Fails fast when FLUX_SHARDS does not match the shards on disk
+        shards.workers()
+    else:
+        migrate(384)
+    if WARMUP:
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    yield
+    shards.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def observe(request: Request, call_next):
+    # Latency per route, plus the request's stage timings as Server-Timing when asked for
+    traced = metrics.TRACE_HEADER in request.headers
+    token = metrics.start_trace() if traced else None
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        trace = metrics.end_trace(token) if traced else None
+    route = request.scope.get("route")
+    metrics.requests.observe(time.perf_counter() - started, f"{request.method} {route.path if route else 'unmatched'}")
+    if trace is not None:
+        response.headers["Server-Timing"] = metrics.server_timing(trace)
+    return response
+
+EMBED_BATCH_SIZE = 64
+CHECKPOINT_BATCHES = 16
+# Compact once this share of rows is tombstoned
+COMPACT_RATIO = float(os.environ.get("FLUX_COMPACT_RATIO", "0.2"))
+
+@app.get("/ready")
+def ready():
+    loaded = {
+        "punkt": chunker.is_loaded(),
+        "embeddings": embeddings.is_loaded(),
+        "llm": llm.is_loaded(),
+    }
+    if reranker.ENABLED:
+        loaded["reranker"] = reranker.is_loaded()
+    is_ready = _warmup_done.is_set() or not WARMUP
+    backends = {"embeddings": embeddings.BACKEND, "llm": llm.BACKEND}
+    return JSONResponse({"ready": is_ready, "warmup": WARMUP, "loaded": loaded, "backends": backends},
+                        status_code=200 if is_ready else 503)
 
 @app.post("/upload")
 async def upload(file: UploadFile):
     content = await file.read()
     logger.info(f"Received file: {file.filename}, size: {len(content)} bytes")
     
-    # Do ingestion synchronously for debugging
+    ingest = handle_sharded_ingest if shards.enabled() else handle_ingest
+    job_id = jobs.submit(ingest, content, file.filename, filename=file.filename)
+    return {"status": "queued", "job_id": job_id}
+
+@app.get("/jobs")
+def list_jobs():
+    return jobs.list_jobs()
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def handle_compact(progress=None):
+    # Holds the writer lock so ingestion waits; queries keep their snapshot until the swap
+    with writer():
+        index, dropped = compact(load_index(384))
+    if progress:
+        progress(vectors_removed=dropped)
+
+def schedule_compaction(force=False):
+    docs = documents()
+    if not docs.n_dead or (not force and docs.n_dead < COMPACT_RATIO * docs.n_rows):
+        return None
+    return jobs.submit(handle_compact)
+
+def handle_sharded_ingest(file_bytes, filename, progress=None):
+    # The shard that owns the source runs the whole ingest, including re-upload diffing
     try:
-        result = handle_ingest(content, file.filename)
-        return {"status": "completed", "message": "File processed successfully"}
-    except Exception as e:
-        logger.error(f"Upload failed: {e}")
-        import traceback
-        traceback.print_exc()
-        return {"status": "error", "message": str(e)}
+        shards.call(shards.shard_of(filename), handle_ingest, file_bytes, filename, progress=progress)
+    finally:
+        shards.bump()
 
-def handle_ingest(file_bytes, filename):
+def _previous_version(filename):
+    # Chunk ids of the live chunks of an already ingested source, and
+    # (page, text) -> chunk id to recognise the ones a re-upload leaves unchanged
+    docs = documents()
+    rows = docs.rows_for_source(filename)
+    chunk_ids = docs.chunk_ids[rows]
+    by_content = {(m.get("page"), text_key(m.get("text", ""))): chunk_id
+                  for m, chunk_id in zip(fetch_metadata(rows), chunk_ids.tolist())}
+    return chunk_ids, by_content
+
+def handle_ingest(file_bytes, filename, progress=None):
+    chunks_embedded = 0
+    vectors_added = 0
+    duplicates = 0
+    unchanged = 0
+    batches = 0
+    uploaded_at = time.time()
+    new_chunk_ids = []
+    kept_chunk_ids = []
+    old_chunk_ids = []
+    completed = False
     try:
         logger.info(f"Starting ingestion for {filename}")
-        chunks = process_pdf_bytes(file_bytes, filename)
-        logger.info(f"Generated {len(chunks)} chunks")
-        
-        if not chunks:
-            logger.error("No chunks generated from PDF!")
-            return
-        
-        if chunks:
-            logger.info(f"First chunk preview: {chunks[0][0][:100]}...")
-            logger.info(f"First chunk metadata: {chunks[0][1]}")
-        
-        texts = [c for c, _ in chunks]
-        metas = [m for _, m in chunks]
+
+        # Re-upload of a known source: unchanged chunks keep their vectors, and
+        # the rest of the old version is tombstoned once the new one is in
+        old_chunk_ids, previous = _previous_version(filename)
+        if previous:
+            logger.info(f"{filename} is already indexed with {len(previous)} chunks, replacing changed chunks")
         
-        logger.info(f"Extracted {len(texts)} texts and {len(metas)} metadata entries")
+        # extract -> chunk -> embed -> add in bounded batches; memory stays flat
+        # and each committed batch is searchable straight away
+        chunks = iter_chunks(file_bytes, filename, progress=progress)
+        for batch in metrics.timed("ingest_parse", iter_batches(chunks, EMBED_BATCH_SIZE)):
+            texts = [c for c, _ in batch]
+            metas = [m for _, m in batch]
+
+            for m in metas:
+                m["uploaded_at"] = uploaded_at
+
+            if previous:
+                fresh = []
+                for i, (t, m) in enumerate(batch):
+                    chunk_id = previous.pop((m["page"], text_key(t)), None)
+                    if chunk_id is None:
+                        fresh.append(i)
+                    else:
+                        kept_chunk_ids.append(chunk_id)
+                unchanged += len(texts) - len(fresh)
+                if progress:
+                    progress(chunks_unchanged=unchanged)
+                texts = [texts[i] for i in fresh]
+                metas = [metas[i] for i in fresh]
+                if not texts:
+                    continue
+            with span("ingest_near_dup"):
+                sigs = near_dup.signatures(texts)
+
+            if near_dup.ENABLED:
+                # Boilerplate already in the corpus (headers, disclaimers, templates)
+                # is skipped before it costs an embedding or a vector. Deleted chunks
+                # and the version being replaced do not count. Content found only in
+                # other sources is kept until near_dup.MIN_SOURCES of them hold it.
+                with span("ingest_near_dup"):
+                    docs = documents()
+                    allowed = docs.live.copy()
+                    allowed[docs.rows_for_chunks(old_chunk_ids)] = False
+                    dup_of = near_dup_index().find_duplicates(sigs, near_dup.THRESHOLD, allowed=allowed,
+                                                              groups=docs.source_codes, group=docs.code_of(filename),
+                                                              min_groups=near_dup.MIN_SOURCES)
+                keep = [i for i, d in enumerate(dup_of) if d == -1]
+                for i, d in enumerate(dup_of):
+                    if d != -1:
+                        target = f"vector {d}" if d >= 0 else "an earlier chunk of this batch"
+                        logger.debug(f"Page {metas[i]['page']} of {filename} is a near-duplicate of {target}")
+                if len(keep) < len(texts):
+                    duplicates += len(texts) - len(keep)
+                    if progress:
+                        progress(embeddings_saved=duplicates, vectors_saved=duplicates)
+                    texts = [texts[i] for i in keep]
+                    metas = [metas[i] for i in keep]
+                    sigs = sigs[keep]
+                if not texts:
+                    continue
+            
+            with span("ingest_tokens"):
+                annotate_tokens(metas)
+            with span("ingest_embed"):
+                embs = embed_texts(texts)
+            chunks_embedded += len(texts)
+            if progress:
+                progress(chunks_embedded=chunks_embedded)
+            
+            # Vectors and metadata for a batch are committed together, so a
+            # failure in a later batch leaves both stores aligned
+            with span("ingest_add"), writer():
+                index = load_index(384)
+                index = add(index, embs, metas, sigs=sigs)
+                new_chunk_ids.extend(m["chunk_id"] for m in metas)
+                batches += 1
+                if batches % CHECKPOINT_BATCHES == 0:
+                    save_index(index)
+                    logger.info(f"Checkpoint: index has {index.ntotal} vectors")
+            vectors_added += len(metas)
+            if progress:
+                progress(vectors_added=vectors_added)
         
-        if not texts:
-            logger.error("No texts extracted from chunks!")
+        completed = True
+        if len(old_chunk_ids):
+            # Whatever the new version did not reproduce is gone from the document
+            with writer():
+                stale = np.setdiff1d(old_chunk_ids, kept_chunk_ids)
+                removed = delete_rows(documents().rows_for_chunks(stale))
+            logger.info(f"Re-ingested {filename}: {unchanged} chunks unchanged, {removed} removed")
+            if progress:
+                progress(chunks_unchanged=unchanged, chunks_removed=removed)
+            schedule_compaction()
+
+        if duplicates:
+            logger.info(f"Skipped {duplicates} near-duplicate chunks of {filename}")
+        if not vectors_added:
+            if not duplicates and not unchanged:
+                logger.error("No chunks generated from PDF!")
             return
         
-        embs = embed_texts(texts)
-        logger.info(f"Generated embeddings shape: {embs.shape}")
-        
-        index = load_index(384)
-        logger.info(f"Index before adding: {index.ntotal} vectors")
-        
-        add(index, embs, metas)
-        logger.info(f"Index after adding: {index.ntotal} vectors")
-        
-        save_index(index)
-        logger.info("Ingestion completed successfully")
+        logger.info(f"Ingestion completed successfully: {vectors_added} vectors added")
         
     except Exception as e:
-        logger.error(f"Error during ingestion: {e}")
+        logger.error(f"Error during ingestion after {vectors_added} vectors: {e}")
         import traceback
         traceback.print_exc()
+        raise
+    
+    finally:
+        if not completed and len(old_chunk_ids) and new_chunk_ids:
+            # A failed re-upload leaves the previous version in place
+            with writer():
+                delete_rows(documents().rows_for_chunks(new_chunk_ids))
+        # Persist whatever was committed so faiss.idx matches metadata.jsonl
+        if batches % CHECKPOINT_BATCHES:
+            with writer():
+                save_index(load_index(384))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Prometheus text format; stage histograms include every shard worker's
+    workers = shards.call_all(metrics.state) if shards.enabled() else []
+    return PlainTextResponse(metrics.render(workers), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"embeddings": embedding_cache().stats(), "answers": answer_cache.cache.stats(), "rerank": reranker.stats()}
+
+@app.get("/batching/stats")
+def batching_stats():
+    return {"query_embedding": query_batcher.stats(), "generation": generation_batcher.stats()}
+
+@app.get("/index/stats")
+def stats():
+    if shards.enabled():
+        return {"shards": shards.call_all(local_stats)}
+    return local_stats()
+
+def local_stats():
+    snap = snapshot(384)
+    return {
+        **index_stats(snap.index),
+        "committed_rows": snap.n_rows,
+        "lexical": lexical_index().stats(),
+        "near_dup": near_dup_index().stats(),
+        "documents": documents().stats(),
+    }
+
+@app.get("/index/check")
+def check_index():
+    if shards.enabled():
+        return {"shards": shards.call_all(check, 384)}
+    return check(384)
+
+@app.post("/index/compact")
+def compact_index():
+    if shards.enabled():
+        # Job ids belong to the shard workers; compaction progress shows in /index/stats
+        started = shards.call_all(schedule_compaction, True)
+        shards.bump()
+        return {"job_id": None, "shards_compacting": sum(job is not None for job in started)}
+    return {"job_id": schedule_compaction(force=True)}
+
+@app.get("/documents")
+def list_documents():
+    counts = {}
+    for shard_counts in shards.call_all(source_counts) if shards.enabled() else [source_counts()]:
+        counts.update(shard_counts)
+    return [{"source": source, "chunks": n} for source, n in sorted(counts.items())]
+
+def source_counts():
+    return documents().source_counts()
+
+def delete_local(source):
+    with writer():
+        deleted = delete_source(source)
+    return deleted, schedule_compaction() if deleted else None
+
+@app.delete("/documents/{source}")
+def delete_document(source: str):
+    if shards.enabled():
+        deleted, _ = shards.call(shards.shard_of(source), delete_local, source)
+        shards.bump()
+        compaction_job = None
+    else:
+        deleted, compaction_job = delete_local(source)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"source": source, "chunks_deleted": deleted, "compaction_job": compaction_job}
+
+def search_filters(source=None, page_from=None, page_to=None, uploaded_after=None):
+    filters = {
+        "source": source,
+        "page_from": page_from,
+        "page_to": page_to,
+        "uploaded_after": uploaded_after.timestamp() if uploaded_after else None,
+    }
+    return {k: v for k, v in filters.items() if v is not None}
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+RetrievalMode = Literal["dense", "lexical", "hybrid"]
+
+def retrieve(q, top_k, nprobe, ef_search, mode, filters, q_emb):
+    # Bi-encoder candidates, then the optional cross-encoder pass over them
+    started = time.perf_counter()
+    n_candidates = max(top_k, reranker.CANDIDATES) if reranker.ENABLED else top_k
+    hits = get_relevant_chunks(q, top_k=n_candidates, nprobe=nprobe, ef_search=ef_search, mode=mode, filters=filters,
+                               query_embedding=q_emb)
+    retrieved = time.perf_counter()
+    with span("rerank"):
+        hits, rerank_info = reranker.rerank(q, hits, top_k)
+    timings = {
+        "retrieval_ms": (retrieved - started) * 1000,
+        "rerank_ms": (time.perf_counter() - retrieved) * 1000,
+    }
+    return hits, timings, rerank_info
+
+def cached_answer(q, params):
+    # Exact question first, then a paraphrase by query embedding. The embedding
+    # is returned so a miss does not encode the question twice.
+    index_generation = generation() + shards.generation()
+    with span("cache"):
+        response = answer_cache.cache.get(q, params, index_generation)
+    if response is not None:
+        return response, "exact", None, index_generation
+    q_emb = None
+    if answer_cache.ENABLED:
+        with span("embed"):
+            q_emb = query_batcher.submit(q)
+        with span("cache"):
+            response = answer_cache.cache.get_similar(q_emb, params, index_generation)
+    return response, "semantic" if response is not None else "miss", q_emb, index_generation
 
 @app.get("/ask")
-def ask(q: str, top_k: int = 3):
-    logger.info(f"Question: {q}")
+def ask(q: str, top_k: int = 3, nprobe: int | None = None, ef_search: int | None = None,
+        mode: RetrievalMode | None = None, source: str | None = None, page_from: int | None = None,
+        page_to: int | None = None, uploaded_after: datetime | None = None):
+    logger.debug(f"Question: {q}")
     
-    hits = get_relevant_chunks(q, top_k=top_k)
-    logger.info(f"Retrieved {len(hits)} hits")
+    started = time.perf_counter()
+    filters = search_filters(source, page_from, page_to, uploaded_after)
+    params = (top_k, nprobe, ef_search, mode, tuple(sorted(filters.items())))
+    response, cache_status, q_emb, index_generation = cached_answer(q, params)
+    if response is not None:
+        logger.info(f"Answer cache hit ({cache_status})")
+        return {**response, "debug": {**response["debug"], "cache": cache_status},
+                "timings": {"cache_ms": (time.perf_counter() - started) * 1000}}
     
-    for i, (score, meta) in enumerate(hits):
-        logger.info(f"Hit {i}: score={score}, meta keys={meta.keys()}")
-        if 'text' in meta:
-            logger.info(f"Hit {i} text preview: {meta['text'][:100]}...")
-        else:
-            logger.info(f"Hit {i} has no 'text' key! Available keys: {list(meta.keys())}")
+    hits, timings, rerank_info = retrieve(q, top_k, nprobe, ef_search, mode, filters, q_emb)
+    logger.info(f"Retrieved {len(hits)} hits in {timings['retrieval_ms']:.1f} ms, re-ranked in {timings['rerank_ms']:.1f} ms")
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, (score, meta) in enumerate(hits):
+            logger.debug(f"Hit {i}: score={score}, meta keys={meta.keys()}")
+            if 'text' in meta:
+                logger.debug(f"Hit {i} text preview: {meta['text'][:100]}...")
+            else:
+                logger.debug(f"Hit {i} has no 'text' key! Available keys: {list(meta.keys())}")
     
-    # Build context
-    context = "\n\n".join([
-        f"{h.get('text', '[NO TEXT]')} (Source: {h.get('source', 'unknown')}, page {h.get('page', 'N/A')})"
-        for _, h in hits
-    ])
+    with span("pack"):
+        context, hits, packing = pack_context(q, hits)
     
-    logger.info(f"Context length: {len(context)}")
-    logger.info(f"Context preview: {context[:200]}...")
+    logger.debug(f"Context: {packing['tokens']} of {packing['budget']} tokens, "
+                 f"{packing['chunks_used']} chunks used, {packing['chunks_dropped']} dropped")
+    logger.debug(f"Context preview: {context[:200]}...")
     
-    answer = generate_answer(q, context)
-    logger.info(f"Generated answer: {answer}")
+    generating = time.perf_counter()
+    with span("generate"):
+        answer = generate_answer(q, context)
+    timings["generation_ms"] = (time.perf_counter() - generating) * 1000
+    logger.debug(f"Generated answer: {answer}")
+    
+    response = {"answer": answer, "sources": [h for _, h in hits],
+                "debug": {"context_preview": context[:200], "rerank": rerank_info, "context": packing}}
+    answer_cache.cache.put(q, q_emb, params, index_generation, response)
+    return {**response, "debug": {**response["debug"], "cache": cache_status}, "timings": timings}
+
+@app.get("/ask/stream")
+def ask_stream(q: str, top_k: int = 3, nprobe: int | None = None, ef_search: int | None = None,
+               mode: RetrievalMode | None = None, source: str | None = None, page_from: int | None = None,
+               page_to: int | None = None, uploaded_after: datetime | None = None):
+    filters = search_filters(source, page_from, page_to, uploaded_after)
+    params = (top_k, nprobe, ef_search, mode, tuple(sorted(filters.items())))
+    response, cache_status, q_emb, index_generation = cached_answer(q, params)
+    if response is not None:
+        def cached_events():
+            yield _sse("sources", response["sources"])
+            yield _sse("done", {"answer": response["answer"]})
+        return StreamingResponse(cached_events(), media_type="text/event-stream")
+    
+    hits, timings, rerank_info = retrieve(q, top_k, nprobe, ef_search, mode, filters, q_emb)
+    with span("pack"):
+        context, hits, packing = pack_context(q, hits)
+    
+    def events():
+        # Sources first so the client can render them before the first token
+        yield _sse("sources", [h for _, h in hits])
+        if not context.strip():
+            yield _sse("done", {"answer": NO_ANSWER, "timings": timings, "context": packing})
+            return
+        
+        pieces = []
+        # The response headers are gone by now: this span only reaches /metrics
+        try:
+            with span("generate"):
+                for piece in stream_answer(q, context):
+                    pieces.append(piece)
+                    yield _sse("token", piece)
+        except Exception as e:
+            logger.error(f"Streaming generation failed: {e}")
+            yield _sse("error", {"detail": str(e)})
+            yield _sse("done", {"answer": NO_ANSWER, "timings": timings, "context": packing})
+            return
+        answer = finalize_streamed_answer(q, context, "".join(pieces))
+        # Only complete answers are cached; a client that disconnects mid-stream leaves nothing behind
+        answer_cache.cache.put(q, q_emb, params, index_generation,
+                               {"answer": answer, "sources": [h for _, h in hits],
+                                "debug": {"context_preview": context[:200], "rerank": rerank_info, "context": packing}})
+        yield _sse("done", {"answer": answer, "timings": timings, "context": packing})
     
-    return {"answer": answer, "sources": [h for _, h in hits], "debug": {"context_preview": context[:200]}}
\ No newline at end of file
+    return StreamingResponse(events(), media_type="text/event-stream")
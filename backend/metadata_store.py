@@ -0,0 +1,141 @@
+import json
+import os
+import sys
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# metadata.jsonl stays the source of truth; a sidecar file of int64 byte
+# offsets (one per line, row i == vector id i) gives O(1) random access.
+OFFSET_DTYPE = np.dtype("<i8")
+
+_write_lock = threading.Lock()
+
+def offsets_path(meta_path):
+    return meta_path + ".offsets"
+
+def count(meta_path):
+    try:
+        return os.path.getsize(offsets_path(meta_path)) // OFFSET_DTYPE.itemsize
+    except FileNotFoundError:
+        return 0
+
+def build_offsets(meta_path):
+    offsets = []
+    pos = 0
+    with open(meta_path, "rb") as f:
+        for line in f:
+            offsets.append(pos)
+            pos += len(line)
+    np.asarray(offsets, dtype=OFFSET_DTYPE).tofile(offsets_path(meta_path))
+    logger.info(f"Built offset index for {meta_path}: {len(offsets)} rows")
+    return len(offsets)
+
+def _offsets_in_sync(meta_path):
+    n = count(meta_path)
+    size = os.path.getsize(meta_path)
+    if n == 0:
+        return size == 0
+    last = int(np.fromfile(offsets_path(meta_path), dtype=OFFSET_DTYPE, count=1, offset=(n - 1) * OFFSET_DTYPE.itemsize)[0])
+    with open(meta_path, "rb") as f:
+        f.seek(last)
+        return last + len(f.readline()) == size
+
+def ensure_offsets(meta_path):
+    # Index directories written before the sidecar existed (or appended to by
+    # an older build) are migrated here. Writer only: readers use count().
+    if not os.path.exists(meta_path):
+        return 0
+    if not os.path.exists(offsets_path(meta_path)) or not _offsets_in_sync(meta_path):
+        logger.info(f"Offset index for {meta_path} missing or stale, rebuilding")
+        return build_offsets(meta_path)
+    return count(meta_path)
+
+def append(meta_path, metadatas):
+    with _write_lock:
+        first_id = ensure_offsets(meta_path)
+        offsets = []
+        with open(meta_path, "ab") as f:
+            pos = f.tell()
+            for m in metadatas:
+                line = (json.dumps(m, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                offsets.append(pos)
+                pos += len(line)
+        with open(offsets_path(meta_path), "ab") as f:
+            f.write(np.asarray(offsets, dtype=OFFSET_DTYPE).tobytes())
+    return first_id
+
+def sync(meta_path):
+    for path in (meta_path, offsets_path(meta_path)):
+        with open(path, "rb+") as f:
+            os.fsync(f.fileno())
+
+def truncate(meta_path, n_rows):
+    # Drops rows n_rows.. (an uncommitted batch) from both files
+    with _write_lock:
+        n = ensure_offsets(meta_path)
+        if n <= n_rows:
+            return n
+        end = int(np.fromfile(offsets_path(meta_path), dtype=OFFSET_DTYPE, count=1, offset=n_rows * OFFSET_DTYPE.itemsize)[0])
+        os.truncate(meta_path, end)
+        os.truncate(offsets_path(meta_path), n_rows * OFFSET_DTYPE.itemsize)
+        logger.warning(f"Truncated {meta_path} from {n} to {n_rows} rows")
+        return n_rows
+
+def _read_offsets(f, ids):
+    # Offsets of ids (all valid) with plain reads: one range read when the ids
+    # are dense, one 8-byte read each otherwise. Missing entries come back as -1.
+    lo, hi = min(ids), max(ids) + 1
+    if hi - lo <= 4 * len(ids):
+        f.seek(lo * OFFSET_DTYPE.itemsize)
+        table = np.frombuffer(f.read((hi - lo) * OFFSET_DTYPE.itemsize), dtype=OFFSET_DTYPE)
+        return [int(table[i - lo]) if i - lo < len(table) else -1 for i in ids]
+    out = []
+    for i in ids:
+        f.seek(i * OFFSET_DTYPE.itemsize)
+        raw = f.read(OFFSET_DTYPE.itemsize)
+        out.append(int(np.frombuffer(raw, dtype=OFFSET_DTYPE)[0]) if len(raw) == OFFSET_DTYPE.itemsize else -1)
+    return out
+
+def lookup(meta_path, ids, n_rows=None):
+    # Read-only, so it is safe next to a live writer: rows are bounded by
+    # n_rows (the caller's committed rows, by default every row with an
+    # offset) and neither file is rebuilt or memory-mapped, since the writer
+    # appends to and truncates both.
+    ids = [int(i) for i in ids]
+    n = count(meta_path) if n_rows is None else n_rows
+    valid = [i for i in ids if 0 <= i < n]
+    if len(valid) < len(ids):
+        logger.warning(f"{len(ids) - len(valid)} ids are out of range for metadata (have {n} rows)")
+    if not valid:
+        return [{} for _ in ids]
+
+    try:
+        with open(offsets_path(meta_path), "rb") as f:
+            offsets = dict(zip(valid, _read_offsets(f, valid)))
+        f = open(meta_path, "rb")
+    except FileNotFoundError:
+        return [{} for _ in ids]
+    metas = []
+    with f:
+        for idx in ids:
+            pos = offsets.get(idx, -1)
+            if pos < 0:
+                metas.append({})
+                continue
+            f.seek(pos)
+            try:
+                metas.append(json.loads(f.readline()))
+            except json.JSONDecodeError as e:
+                logger.error(f"Error parsing metadata row {idx}: {e}")
+                metas.append({})
+    return metas
+
+if __name__ == "__main__":
+    # python -m backend.metadata_store [index_dir] -- build offsets for an existing index directory
+    index_dir = sys.argv[1] if len(sys.argv) > 1 else "data/index"
+    logging.basicConfig(level=logging.INFO)
+    build_offsets(os.path.join(index_dir, "metadata.jsonl"))
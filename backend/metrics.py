@@ -0,0 +1,119 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# FLUX_DEBUG=1 turns on the per-hit, per-page and preview logs; they cost real time on the hot path
+DEBUG = os.environ.get("FLUX_DEBUG", "0") == "1"
+# Requests carrying this header get their stage timings back in a Server-Timing header
+TRACE_HEADER = "X-Flux-Trace"
+# Seconds; covers a cached lookup (~100 us) up to a long generation or ingest batch
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_trace = contextvars.ContextVar("flux_trace", default=None)
+
+def configure_logging():
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("backend").setLevel(logging.DEBUG if DEBUG else logging.INFO)
+
+class Histogram:
+    """Prometheus-style histogram with one label.
+
+    Each label value keeps per-bucket counts and a sum; the text exposition
+    makes the counts cumulative. States from other processes can be merged in.
+    """
+
+    def __init__(self, name, help, label, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = np.asarray(buckets, dtype=np.float64)
+        self._series = {}  # label value -> [counts per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value):
+        i = int(np.searchsorted(self.buckets, value, side="left"))
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [np.zeros(len(self.buckets) + 1, dtype=np.int64), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def state(self):
+        with self._lock:
+            return {k: (counts.copy(), total) for k, (counts, total) in self._series.items()}
+
+    def render(self, extra_states=()):
+        merged = self.state()
+        for state in extra_states:
+            for k, (counts, total) in state.items():
+                mine = merged.get(k)
+                merged[k] = (counts, total) if mine is None else (mine[0] + counts, mine[1] + total)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        bounds = [f"{b:g}" for b in self.buckets] + ["+Inf"]
+        for k in sorted(merged):
+            counts, total = merged[k]
+            label = f'{self.label}="{k}"'
+            for bound, n in zip(bounds, np.cumsum(counts).tolist()):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {n}')
+            lines.append(f"{self.name}_sum{{{label}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {int(counts.sum())}")
+        return lines
+
+stages = Histogram("flux_stage_seconds", "Time spent in each query and ingest stage.", "stage")
+requests = Histogram("flux_request_seconds", "HTTP request latency by route.", "route")
+
+def record(stage, seconds):
+    stages.observe(seconds, stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+def timed(stage, items):
+    # Times each step of an iterator (e.g. the parse/chunk generator) as one span
+    items = iter(items)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        record(stage, time.perf_counter() - started)
+        yield item
+
+def start_trace():
+    return _trace.set([])
+
+def end_trace(token):
+    trace = _trace.get()
+    _trace.reset(token)
+    return trace
+
+def server_timing(trace):
+    # Repeated stages (e.g. one embed per ingest batch) are summed
+    totals = {}
+    for stage, seconds in trace:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items())
+
+def state():
+    # Everything a shard worker contributes to the router's /metrics
+    return {"stages": stages.state()}
+
+def render(worker_states=()):
+    lines = stages.render([s["stages"] for s in worker_states]) + requests.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,143 @@
+import os
+import zlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("FLUX_NEAR_DUP", "1") == "1"
+# Estimated Jaccard similarity of word 3-gram sets above which a chunk is skipped
+THRESHOLD = float(os.environ.get("FLUX_NEAR_DUP_THRESHOLD", "0.85"))
+# A chunk that only other sources contain is skipped once this many of them
+# hold it: below that, skipping it would hide it from a filter on its own
+# source and lose it when the one other source is deleted
+MIN_SOURCES = int(os.environ.get("FLUX_NEAR_DUP_MIN_SOURCES", "3"))
+
+NUM_PERM = 64
+BANDS = 16  # 16 bands x 4 rows: pairs above ~0.7 Jaccard almost always share a bucket
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+_PRIME = (1 << 61) - 1
+
+_rng = np.random.default_rng(1729)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+def shingles(text):
+    words = text.lower().split()
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def signature(text):
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64)
+    if len(hashes) == 0:
+        return np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+    # (a * x + b) mod p for every permutation/shingle pair, min over shingles.
+    # uint64 wraps on overflow, which is fine for hashing purposes.
+    permuted = (_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME
+    return (permuted.min(axis=1) & 0xFFFFFFFF).astype(np.uint32)
+
+def signatures(texts):
+    return np.stack([signature(t) for t in texts]) if texts else np.zeros((0, NUM_PERM), dtype=np.uint32)
+
+def _band_keys(sigs):
+    # One 64-bit key per band: a cheap mix of the band's rows
+    bands = sigs.reshape(len(sigs), BANDS, ROWS).astype(np.uint64)
+    keys = np.zeros((len(sigs), BANDS), dtype=np.uint64)
+    for r in range(ROWS):
+        keys = keys * np.uint64(0x100000001B3) ^ bands[:, :, r]
+    return keys
+
+class MinHashLSH:
+    """Corpus-wide LSH over MinHash signatures of chunk texts.
+
+    Row i of the signature file is the signature of vector id i; the band
+    buckets are rebuilt from it on load.
+    """
+
+    def __init__(self, path=None, n_rows=None):
+        # n_rows bounds what is read: rows past it may belong to a batch still being written
+        self.path = path
+        self._sigs = np.zeros((0, NUM_PERM), dtype=np.uint32)
+        self._buckets = [dict() for _ in range(BANDS)]
+        if path and os.path.exists(path):
+            count = -1 if n_rows is None else n_rows * NUM_PERM
+            sigs = np.fromfile(path, dtype=np.uint32, count=count)
+            self._index(sigs[:len(sigs) - len(sigs) % NUM_PERM].reshape(-1, NUM_PERM))
+
+    @property
+    def n_docs(self):
+        return len(self._sigs)
+
+    def _index(self, sigs):
+        first_id = self.n_docs
+        # Signatures first, so a concurrent lookup never meets a bucket id it cannot resolve
+        self._sigs = np.concatenate([self._sigs, sigs])
+        for band, column in enumerate(_band_keys(sigs).T):
+            buckets = self._buckets[band]
+            for offset, key in enumerate(column.tolist()):
+                buckets.setdefault(key, []).append(first_id + offset)
+
+    def add(self, first_id, sigs):
+        if first_id < self.n_docs:
+            # Already indexed (e.g. replayed rows); keep ids aligned with vector ids
+            sigs = sigs[self.n_docs - first_id:]
+        elif first_id > self.n_docs:
+            # Placeholder rows for ids that were never signed never match anything
+            self.add(self.n_docs, np.full((first_id - self.n_docs, NUM_PERM), np.iinfo(np.uint32).max, dtype=np.uint32))
+        if len(sigs) == 0:
+            return
+        sigs = np.ascontiguousarray(sigs, dtype=np.uint32)
+        if self.path:
+            with open(self.path, "ab") as f:
+                f.write(sigs.tobytes())
+        self._index(sigs)
+
+    def get(self, ids):
+        return self._sigs[ids]
+
+    def find_duplicates(self, sigs, threshold, allowed=None, groups=None, group=None, min_groups=1):
+        # For each signature: id of an indexed chunk with estimated Jaccard >=
+        # threshold, or -1. Earlier signatures in the same call count too,
+        # reported as -(position + 2) so callers can tell them apart.
+        # `allowed` (bool per id) limits which indexed chunks may match. With
+        # `groups` (group per id), matches outside the signatures' own `group`
+        # count only when they span at least min_groups groups.
+        out = np.full(len(sigs), -1, dtype=np.int64)
+        keys = _band_keys(sigs) if len(sigs) else np.zeros((0, BANDS), dtype=np.uint64)
+        for i, sig in enumerate(sigs):
+            candidates = set()
+            for band, key in enumerate(keys[i].tolist()):
+                candidates.update(self._buckets[band].get(key, ()))
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            if allowed is not None:
+                ids = ids[ids < len(allowed)]
+                ids = ids[allowed[ids]]
+            if groups is not None:
+                ids = ids[ids < len(groups)]
+            if len(ids):
+                similarity = (self._sigs[ids] == sig).mean(axis=1)
+                match = similarity >= threshold
+                if groups is not None and match.any():
+                    own = match & (groups[ids] == group)
+                    if own.any():
+                        match = own
+                    elif len(np.unique(groups[ids][match])) < min_groups:
+                        match[:] = False
+                if match.any():
+                    out[i] = ids[int(np.argmax(np.where(match, similarity, -1.0)))]
+                    continue
+            if i:
+                earlier = (sigs[:i] == sig).mean(axis=1)
+                best = int(np.argmax(earlier))
+                if earlier[best] >= threshold and out[best] == -1:
+                    out[i] = -(best + 2)
+        return out
+
+    def stats(self):
+        return {
+            "docs": self.n_docs,
+            "buckets": sum(len(b) for b in self._buckets),
+            "signature_bytes": self._sigs.nbytes,
+        }
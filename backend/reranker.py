@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import numpy as np
+from .embedding_cache import text_key
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("FLUX_RERANK", "0") == "1"
+MODEL_NAME = os.environ.get("FLUX_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Dense candidates scored by the cross-encoder per request
+CANDIDATES = int(os.environ.get("FLUX_RERANK_CANDIDATES", "20"))
+# Past this, a request keeps the dense order; the scores still land in the cache
+BUDGET_MS = float(os.environ.get("FLUX_RERANK_BUDGET_MS", "300"))
+CACHE_SIZE = int(os.environ.get("FLUX_RERANK_CACHE_SIZE", "20000"))
+
+_model = None
+_load_lock = threading.Lock()
+_loading = None
+# One scoring call at a time; torch already uses every core within a batch
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+# The scoring call in flight. Requests arriving while it runs skip re-ranking
+# instead of queueing behind it, so timed-out work never piles up.
+_pending = None
+_pending_lock = threading.Lock()
+
+def load_model():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(MODEL_NAME, device="cpu")
+
+def model():
+    global _model
+    with _load_lock:
+        if _model is None:
+            _model = load_model()
+    return _model
+
+def is_loaded():
+    return _model is not None
+
+def _load_in_background():
+    global _loading
+    with _load_lock:
+        if _loading is None:
+            _loading = threading.Thread(target=model, name="rerank-load", daemon=True)
+            _loading.start()
+
+class ScoreCache:
+    """LRU of cross-encoder scores keyed by (query, chunk text) hashes.
+
+    The chunk text hash is the chunk's identity here: it is the same in
+    every shard and survives compaction and re-ingestion.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        out = []
+        with self._lock:
+            for key in keys:
+                score = self._scores.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self._scores.move_to_end(key)
+                    self.hits += 1
+                out.append(score)
+        return out
+
+    def put_many(self, keys, scores):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._scores[key] = float(score)
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._scores), "hits": self.hits, "misses": self.misses}
+
+cache = ScoreCache()
+_stats = {"requests": 0, "reranked": 0, "timeouts": 0, "not_loaded": 0, "busy": 0}
+
+def _score(query, texts, keys):
+    scores = np.asarray(model().predict([(query, t) for t in texts], show_progress_bar=False), dtype=np.float32)
+    cache.put_many(keys, scores)
+    return scores
+
+def _submit(query, texts, keys):
+    # None while an earlier call is still queued or running
+    global _pending
+    with _pending_lock:
+        if _pending is not None and not _pending.done():
+            return None
+        _pending = _executor.submit(_score, query, texts, keys)
+        return _pending
+
+def rerank(query, hits, top_k, budget_ms=None):
+    # hits: (dense score, metadata) best first. Returns the top_k re-ordered
+    # by cross-encoder score, or the dense top_k if the budget runs out.
+    info = {"reranked": False, "candidates": len(hits), "cache_hits": 0, "timed_out": False}
+    if not ENABLED or len(hits) <= 1:
+        return hits[:top_k], info
+    _stats["requests"] += 1
+    deadline = time.perf_counter() + (BUDGET_MS if budget_ms is None else budget_ms) / 1000
+
+    query_key = text_key(query)
+    keys = [(query_key, text_key(meta.get("text", ""))) for _, meta in hits]
+    scores = cache.get_many(keys)
+    missing = [i for i, s in enumerate(scores) if s is None]
+    info["cache_hits"] = len(hits) - len(missing)
+    if missing:
+        if not is_loaded():
+            # Loading takes seconds: never on a request's clock
+            _load_in_background()
+            _stats["not_loaded"] += 1
+            info["timed_out"] = True
+            return hits[:top_k], info
+        future = _submit(query, [hits[i][1].get("text", "") for i in missing], [keys[i] for i in missing])
+        if future is None:
+            _stats["busy"] += 1
+            info["timed_out"] = True
+            return hits[:top_k], info
+        try:
+            fresh = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        except TimeoutError:
+            # Drops the call if it has not started; a running one still fills the cache
+            future.cancel()
+            _stats["timeouts"] += 1
+            info["timed_out"] = True
+            logger.info(f"Re-ranking {len(missing)} candidates exceeded the budget, keeping dense order")
+            return hits[:top_k], info
+        for i, score in zip(missing, fresh):
+            scores[i] = float(score)
+
+    order = np.argsort(-np.asarray(scores, dtype=np.float32), kind="stable")[:top_k]
+    _stats["reranked"] += 1
+    info["reranked"] = True
+    return [(float(scores[i]), hits[i][1]) for i in order], info
+
+def stats():
+    return {"enabled": ENABLED, "model": MODEL_NAME, **_stats, "cache": cache.stats()}
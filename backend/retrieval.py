@@ -1,5 +1,9 @@
 from .embeddings import embed_texts
-from .vector_store import load_index, search
+from .vector_store import snapshot, search_snapshot, fetch_metadata, get_vectors, lexical_search, documents, layout
+from .batcher import MicroBatcher
+from . import shards
+from .metrics import span
+import os
 import numpy as np
 import logging
 
@@ -7,66 +11,167 @@ logger = logging.getLogger(__name__)
 
 INDEX_DIM = 384
 
-def deduplicate_results(results, similarity_threshold=0.9):
-    if not results:
-        return results
-    
-    deduped = []
-    seen_texts = set()
-    
-    for score, meta in results:
-        text = meta.get('text', '')
-        
-        text_words = set(text.lower().split())
-        
-        is_duplicate = False
-        for seen_text in seen_texts:
-            seen_words = set(seen_text.lower().split())
-            
-            # Calculate Jaccard similarity
-            intersection = len(text_words.intersection(seen_words))
-            union = len(text_words.union(seen_words))
-            
-            if union > 0:
-                similarity = intersection / union
-                if similarity > similarity_threshold:
-                    is_duplicate = True
-                    break
-        
-        if not is_duplicate:
-            deduped.append((score, meta))
-            seen_texts.add(text)
-            logger.info(f"Added unique result: score={score:.4f}, source={meta.get('source', 'unknown')}")
-        else:
-            logger.info(f"Skipped duplicate result: score={score:.4f}")
-    
-    return deduped
+MODES = ("dense", "lexical", "hybrid")
+RETRIEVAL_MODE = os.environ.get("FLUX_RETRIEVAL_MODE", "dense")
+# rrf: reciprocal-rank fusion; weighted: HYBRID_ALPHA * cosine + (1 - HYBRID_ALPHA) * scaled BM25
+FUSION = os.environ.get("FLUX_FUSION", "rrf")
+HYBRID_ALPHA = float(os.environ.get("FLUX_HYBRID_ALPHA", "0.5"))
+RRF_K = 60
 
-def get_relevant_chunks(query, top_k=10):
-    logger.info(f"Getting relevant chunks for query: {query[:50]}...")
-    
-    index = load_index(INDEX_DIM)
-    logger.info(f"Loaded index with {index.ntotal} vectors")
+# Candidates fetched per query before near-duplicate removal and MMR
+CANDIDATE_POOL = int(os.environ.get("FLUX_CANDIDATE_POOL", "100"))
+DEDUP_THRESHOLD = float(os.environ.get("FLUX_DEDUP_THRESHOLD", "0.95"))
+MMR_LAMBDA = float(os.environ.get("FLUX_MMR_LAMBDA", "1.0"))
+# Searches of one query before giving up when compactions keep swapping files under it
+LAYOUT_RETRIES = 3
+
+# Concurrent /ask requests share one encode call per batch
+query_batcher = MicroBatcher(lambda queries: embed_texts(queries), name="query_embedding")
+
+def select_diverse(vectors, relevance, top_k, similarity_threshold=None, mmr_lambda=None):
+    # Greedy MMR over one candidate-by-candidate cosine matrix. Candidates at or
+    # above similarity_threshold to an already selected one are dropped as
+    # near-duplicates; mmr_lambda=1 keeps pure relevance order.
+    similarity_threshold = DEDUP_THRESHOLD if similarity_threshold is None else similarity_threshold
+    mmr_lambda = MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    n = len(vectors)
+    if n == 0:
+        return []
+    sims = vectors @ vectors.T
+    relevance = np.asarray(relevance, dtype=np.float32)
+    span = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / span if span > 0 else np.ones(n, dtype=np.float32)
+
+    available = np.ones(n, dtype=bool)
+    max_sim = np.zeros(n, dtype=np.float32)
+    selected = []
+    while len(selected) < top_k and available.any():
+        mmr = mmr_lambda * relevance - (1 - mmr_lambda) * max_sim
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available &= sims[best] < similarity_threshold
+        available[best] = False
+        max_sim = np.maximum(max_sim, sims[best])
+    return selected
+
+def fuse_rrf(rankings, k=RRF_K):
+    # rankings: id arrays, best first
+    fused = {}
+    for ids in rankings:
+        for rank, doc_id in enumerate(ids):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1.0 / (k + rank + 1)
+    ids = np.array(sorted(fused, key=fused.get, reverse=True), dtype=np.int64)
+    return np.array([fused[i] for i in ids], dtype=np.float32), ids
+
+def _min_max(scores):
+    if len(scores) == 0:
+        return scores
+    span = scores.max() - scores.min()
+    return (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+
+def fuse_weighted(dense, lexical, alpha=HYBRID_ALPHA):
+    fused = {}
+    for weight, (scores, ids) in ((alpha, dense), (1 - alpha, lexical)):
+        for score, doc_id in zip(_min_max(np.asarray(scores, dtype=np.float32)), ids):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + weight * float(score)
+    ids = np.array(sorted(fused, key=fused.get, reverse=True), dtype=np.int64)
+    return np.array([fused[i] for i in ids], dtype=np.float32), ids
+
+def get_relevant_chunks(query, top_k=10, nprobe=None, ef_search=None, mode=None, filters=None, query_embedding=None):
+    mode = mode or RETRIEVAL_MODE
+    if mode not in MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r}, expected one of {MODES}")
+    logger.debug(f"Getting relevant chunks for query: {query[:50]}...")
+    if shards.enabled():
+        return _scatter_gather(query, top_k, nprobe, ef_search, mode, filters, query_embedding)
+    return [(score, meta) for score, meta, _ in
+            local_chunks(query, top_k, nprobe, ef_search, mode, filters, query_embedding)]
+
+def _scatter_gather(query, top_k, nprobe, ef_search, mode, filters, query_embedding):
+    # The query is encoded once here; every shard returns its own diverse
+    # top-k with vectors, and the merge repeats dedup/MMR across shards
+    q_emb = query_embedding
+    if q_emb is None and mode != "lexical":
+        with span("embed"):
+            q_emb = query_batcher.submit(query)
+    with span("shards"):
+        per_shard = shards.call_all(local_chunks, query, top_k, nprobe, ef_search, mode, filters, q_emb)
+    merged = sorted((hit for hits in per_shard for hit in hits), key=lambda hit: hit[0], reverse=True)
+    logger.debug(f"Merged {len(merged)} results from {len(per_shard)} shards")
+    if not merged:
+        return []
+    with span("dedup"):
+        keep = select_diverse(np.stack([v for _, _, v in merged]), [s for s, _, _ in merged], top_k)
+    return [(merged[i][0], merged[i][1]) for i in keep]
+
+def local_chunks(query, top_k, nprobe, ef_search, mode, filters, query_embedding):
+    # (score, metadata, vector) for the best top_k chunks of this process's index.
+    # Lock-free: the last saved index plus the rows committed since. A
+    # compaction renumbers rows, so a query that straddled its swap (old
+    # snapshot, new documents and metadata) is run again.
+    for _ in range(LAYOUT_RETRIES):
+        before = layout()
+        try:
+            results = _local_chunks(query, top_k, nprobe, ef_search, mode, filters, query_embedding)
+        except Exception:
+            if layout() == before:
+                raise
+            results = None
+        if layout() == before:
+            return results
+        logger.info("Index was compacted during the query, searching again")
+    raise RuntimeError(f"Index was compacted {LAYOUT_RETRIES} times during one query")
+
+def _local_chunks(query, top_k, nprobe, ef_search, mode, filters, query_embedding):
+    snap = snapshot(INDEX_DIM)
+    logger.debug(f"Searching snapshot with {snap.n_rows} rows")
     
-    if index.ntotal == 0:
+    if snap.n_rows == 0:
         logger.warning("Index is empty - no documents have been ingested yet")
         return []
     
-    q_emb = embed_texts([query])[0]
-    logger.info(f"Generated query embedding with shape: {q_emb.shape}")
+    # Filters (source, page range, upload date) become a row set that the
+    # searches below are restricted to, instead of filtering their results
+    rows = None
+    if filters:
+        with span("filter"):
+            rows = documents().select_rows(**filters)
+    if rows is not None:
+        logger.debug(f"Filters {filters} match {len(rows)} chunks")
+        if len(rows) == 0:
+            return []
     
-    search_k = min(top_k * 3, index.ntotal)
-    scores, metas = search(index, q_emb, top_k=search_k)
-    results = list(zip(scores, metas))
-    
-    logger.info(f"Retrieved {len(results)} raw results")
+    search_k = min(max(top_k * 3, CANDIDATE_POOL), snap.n_rows if rows is None else len(rows))
+    q_emb = query_embedding
+    if q_emb is None and mode != "lexical":
+        with span("embed"):
+            q_emb = query_batcher.submit(query)
+    with span("search"):
+        if mode == "dense":
+            scores, ids = search_snapshot(snap, q_emb, top_k=search_k, nprobe=nprobe, ef_search=ef_search, rows=rows)
+        else:
+            lexical = lexical_search(query, top_k=search_k, rows=rows)
+            if mode == "lexical":
+                scores, ids = lexical
+            else:
+                dense = search_snapshot(snap, q_emb, top_k=search_k, nprobe=nprobe, ef_search=ef_search, rows=rows)
+                fuse = fuse_rrf([dense[1], lexical[1]]) if FUSION == "rrf" else fuse_weighted(dense, lexical)
+                scores, ids = fuse[0][:search_k], fuse[1][:search_k]
     
-    deduped_results = deduplicate_results(results, similarity_threshold=0.8)
+    logger.debug(f"Retrieved {len(ids)} raw results")
     
-    final_results = deduped_results[:top_k]
+    # Dedup and diversify on the stored vectors, then read metadata only for the survivors
+    with span("dedup"):
+        vectors = get_vectors(snap.index, ids, snap.n_rows)
+        keep = select_diverse(vectors, scores, top_k)
+    with span("metadata"):
+        metas = fetch_metadata([ids[i] for i in keep], snap.n_rows)
+    final_results = [(float(scores[i]), meta, vectors[i]) for i, meta in zip(keep, metas)]
     
-    logger.info(f"After deduplication: {len(final_results)} unique results")
-    for i, (score, meta) in enumerate(final_results):
-        logger.info(f"Result {i}: score={score:.4f}, source={meta.get('source', 'unknown')}")
+    logger.debug(f"After deduplication: {len(final_results)} unique results")
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, (score, meta, _) in enumerate(final_results):
+            logger.debug(f"Result {i}: score={score:.4f}, source={meta.get('source', 'unknown')}")
     
     return final_results
\ No newline at end of file
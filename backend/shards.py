@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import zlib
+import queue
+import pickle
+import time
+import shutil
+import logging
+import argparse
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+import numpy as np
+from . import metadata_store, vector_store, metrics
+
+logger = logging.getLogger(__name__)
+
+# 0 keeps the single in-process index in data/index. N > 0 splits the corpus
+# into N shard directories by source, each served by its own worker process.
+SHARDS = int(os.environ.get("FLUX_SHARDS", "0"))
+SHARD_DIR = os.environ.get("FLUX_SHARD_DIR", "data/shards")
+# Requests a worker runs concurrently; writes inside a shard still serialize on its writer lock
+WORKER_THREADS = int(os.environ.get("FLUX_SHARD_THREADS", "4"))
+# Seconds call_all waits for every shard to answer
+CALL_TIMEOUT = float(os.environ.get("FLUX_SHARD_TIMEOUT", "300"))
+# How often a worker's result reader checks that the process is still alive
+LIVENESS_POLL = 1.0
+REBALANCE_BATCH = 4096
+
+_workers = None
+_workers_lock = threading.Lock()
+_in_worker = False
+_writes = 0
+
+def enabled():
+    return SHARDS > 0 and not _in_worker
+
+def shard_of(source, n_shards=None):
+    # Every chunk of a source lives in one shard, so re-ingestion and deletion stay local
+    return zlib.crc32((source or "").encode("utf-8")) % (n_shards or SHARDS)
+
+def shard_dir(i, root=None):
+    return os.path.join(root or SHARD_DIR, f"shard-{i}")
+
+def manifest_path(root=None):
+    return os.path.join(root or SHARD_DIR, "shards.json")
+
+def read_manifest(root=None):
+    try:
+        with open(manifest_path(root)) as f:
+            return json.load(f)["shards"]
+    except FileNotFoundError:
+        return None
+
+def write_manifest(n_shards, root=None):
+    os.makedirs(root or SHARD_DIR, exist_ok=True)
+    tmp = manifest_path(root) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"shards": n_shards}, f)
+    os.replace(tmp, manifest_path(root))
+
+def generation():
+    # Bumped by the router after every write it sends to a shard
+    return _writes
+
+def bump():
+    global _writes
+    _writes += 1
+
+def _serve(index_dir, requests, responses, threads):
+    # Worker process main loop: one shard directory, requests run on a thread
+    # pool so queries never queue behind an ingest running in the same shard
+    global _in_worker
+    _in_worker = True
+    metrics.configure_logging()
+    vector_store.set_index_dir(index_dir)
+    vector_store.migrate()
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="shard")
+
+    def run(request_id, fn, args, wants_progress):
+        kwargs = {"progress": lambda **fields: responses.put((request_id, "progress", fields))} if wants_progress else {}
+        try:
+            kind, value = "ok", fn(*args, **kwargs)
+        except Exception as e:
+            kind, value = "error", e
+        try:
+            # Queue.put pickles in a background thread; fail here instead, where the caller hears about it
+            pickle.dumps(value)
+        except Exception as e:
+            kind, value = "error", RuntimeError(f"Unpicklable result from {fn.__name__}: {e!r}")
+        responses.put((request_id, kind, value))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        pool.submit(run, *request)
+    pool.shutdown(wait=True)
+
+class ShardWorker:
+    """One shard directory served by a spawned worker process.
+
+    Calls are pickled by reference (module-level functions only) and run on
+    the worker's thread pool; results come back as Futures. A progress
+    callback, if given, receives the worker's progress updates. If the
+    process dies, pending and later calls fail instead of waiting forever.
+    """
+
+    def __init__(self, index_dir, threads=WORKER_THREADS):
+        self.index_dir = index_dir
+        ctx = multiprocessing.get_context("spawn")
+        self._requests = ctx.Queue()
+        self._responses = ctx.Queue()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._dead = None  # error for calls once the process has exited
+        self._process = ctx.Process(target=_serve, args=(index_dir, self._requests, self._responses, threads),
+                                    name=f"flux-{os.path.basename(index_dir)}", daemon=True)
+        self._process.start()
+        self._reader = threading.Thread(target=self._read, name=f"{self._process.name}-results", daemon=True)
+        self._reader.start()
+
+    def alive(self):
+        return self._dead is None
+
+    def _fail_pending(self, error):
+        with self._lock:
+            self._dead = error
+            pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            future.set_exception(error)
+
+    def _read(self):
+        while True:
+            try:
+                message = self._responses.get(timeout=LIVENESS_POLL)
+            except queue.Empty:
+                if self._process.is_alive():
+                    continue
+                logger.error(f"Shard worker for {self.index_dir} exited with code {self._process.exitcode}")
+                self._fail_pending(RuntimeError(f"Shard worker for {self.index_dir} exited "
+                                                f"with code {self._process.exitcode}"))
+                break
+            if message is None:
+                break
+            request_id, kind, value = message
+            with self._lock:
+                future, progress = self._pending.get(request_id, (None, None))
+                if kind != "progress":
+                    self._pending.pop(request_id, None)
+            if kind == "progress":
+                if progress:
+                    progress(**value)
+            elif future is None:
+                continue
+            elif kind == "ok":
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def submit(self, fn, *args, progress=None):
+        future = Future()
+        with self._lock:
+            if self._dead is not None:
+                future.set_exception(self._dead)
+                return future
+            request_id = next(self._ids)
+            self._pending[request_id] = (future, progress)
+        self._requests.put((request_id, fn, args, progress is not None))
+        return future
+
+    def close(self):
+        self._requests.put(None)
+        self._process.join(timeout=30)
+        self._responses.put(None)
+        self._fail_pending(RuntimeError(f"Shard worker for {self.index_dir} stopped"))
+
+def workers():
+    global _workers
+    with _workers_lock:
+        if _workers is None:
+            existing = read_manifest()
+            if existing is not None and existing != SHARDS:
+                raise RuntimeError(f"{SHARD_DIR} holds {existing} shards but FLUX_SHARDS={SHARDS}; "
+                                   f"run 'python -m backend.shards rebalance --shards {SHARDS}'")
+            if existing is None:
+                if os.path.exists(vector_store.META_PATH):
+                    logger.warning(f"An unsharded index exists in {vector_store.INDEX_DIR}; run "
+                                   f"'python -m backend.shards rebalance --shards {SHARDS}' to serve it from shards")
+                write_manifest(SHARDS)
+            logger.info(f"Starting {SHARDS} shard workers over {SHARD_DIR}")
+            _workers = [ShardWorker(shard_dir(i)) for i in range(SHARDS)]
+        for i, worker in enumerate(_workers):
+            if not worker.alive():
+                # Its calls have failed; the replacement recovers the shard before serving
+                logger.warning(f"Restarting the worker for {worker.index_dir}")
+                _workers[i] = ShardWorker(shard_dir(i))
+        return _workers
+
+def call(shard, fn, *args, progress=None):
+    return workers()[shard].submit(fn, *args, progress=progress).result()
+
+def call_all(fn, *args):
+    # Scatter to every shard in parallel, gather in shard order
+    futures = [w.submit(fn, *args) for w in workers()]
+    deadline = time.monotonic() + CALL_TIMEOUT
+    results = []
+    for i, f in enumerate(futures):
+        try:
+            results.append(f.result(timeout=max(0.0, deadline - time.monotonic())))
+        except TimeoutError:
+            raise TimeoutError(f"Shard {i} did not answer {fn.__name__} within {CALL_TIMEOUT}s") from None
+    return results
+
+def shutdown():
+    global _workers
+    with _workers_lock:
+        for worker in _workers or []:
+            worker.close()
+        _workers = None
+
+def _live_rows(index_dir, dim):
+    # Committed, non-tombstoned rows of an index directory, read straight from its files
+    meta_path = os.path.join(index_dir, "metadata.jsonl")
+    vectors_path = os.path.join(index_dir, "vectors.f32")
+    n_meta = metadata_store.ensure_offsets(meta_path)
+    n_vectors = os.path.getsize(vectors_path) // (dim * 4) if os.path.exists(vectors_path) else 0
+    if n_vectors < n_meta:
+        raise RuntimeError(f"{vectors_path} covers {n_vectors} of {n_meta} rows; run 'python -m backend.vector_store check'")
+    tombstones_path = os.path.join(index_dir, "tombstones.i8")
+    tombstones = np.fromfile(tombstones_path, dtype="<i8") if os.path.exists(tombstones_path) else np.zeros(0, "<i8")
+    sources = []
+    live = np.ones(n_meta, dtype=bool)
+    for start in range(0, n_meta, REBALANCE_BATCH):
+        rows = range(start, min(start + REBALANCE_BATCH, n_meta))
+        metas = metadata_store.lookup(meta_path, rows)
+        sources.extend(m.get("source") for m in metas)
+        chunk_ids = np.array([m.get("chunk_id", row) for m, row in zip(metas, rows)], dtype=np.int64)
+        live[start:start + len(metas)] = ~np.isin(chunk_ids, tombstones)
+    return sources, live
+
+def rebalance(n_shards, dim=384):
+    # Offline: redistributes every live chunk of the current layout (the
+    # shards in SHARD_DIR, or the unsharded index) over n_shards new shards.
+    # New shards are built next to SHARD_DIR and swapped in at the end.
+    current = read_manifest()
+    sources = [shard_dir(i) for i in range(current)] if current else [vector_store.INDEX_DIR]
+    staging = SHARD_DIR.rstrip("/") + ".rebalance"
+    shutil.rmtree(staging, ignore_errors=True)
+
+    plans = []
+    for source_dir in sources:
+        names, live = _live_rows(source_dir, dim)
+        targets = np.array([shard_of(name, n_shards) for name in names], dtype=np.int64)
+        targets[~live] = -1
+        plans.append((source_dir, targets))
+    logger.info(f"Rebalancing {sum(int((t >= 0).sum()) for _, t in plans)} chunks from "
+                f"{len(sources)} to {n_shards} shards")
+
+    previous_dir = vector_store.INDEX_DIR
+    counts = []
+    try:
+        for shard in range(n_shards):
+            os.makedirs(shard_dir(shard, staging))
+            vector_store.set_index_dir(shard_dir(shard, staging))
+            index = vector_store.load_index(dim)
+            for source_dir, targets in plans:
+                rows = np.flatnonzero(targets == shard)
+                if len(rows) == 0:
+                    continue
+                stored = np.memmap(os.path.join(source_dir, "vectors.f32"), dtype="float32", mode="r").reshape(-1, dim)
+                minhash_path = os.path.join(source_dir, "minhash.u32")
+                sigs = np.memmap(minhash_path, dtype=np.uint32, mode="r").reshape(-1, vector_store.signatures([]).shape[1]) \
+                    if os.path.exists(minhash_path) and os.path.getsize(minhash_path) else None
+                for start in range(0, len(rows), REBALANCE_BATCH):
+                    batch = rows[start:start + REBALANCE_BATCH]
+                    metas = metadata_store.lookup(os.path.join(source_dir, "metadata.jsonl"), batch)
+                    for m in metas:
+                        # Chunk ids are per shard; the target assigns fresh ones
+                        m.pop("chunk_id", None)
+                    batch_sigs = np.array(sigs[batch]) if sigs is not None and len(sigs) > batch[-1] else None
+                    index = vector_store.add(index, np.array(stored[batch]), metas, sigs=batch_sigs)
+            vector_store.save_index(index)
+            counts.append(index.ntotal)
+    finally:
+        vector_store.set_index_dir(previous_dir)
+
+    write_manifest(n_shards, staging)
+    old = SHARD_DIR.rstrip("/") + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(SHARD_DIR):
+        os.replace(SHARD_DIR, old)
+    os.replace(staging, SHARD_DIR)
+    shutil.rmtree(old, ignore_errors=True)
+    logger.info(f"Rebalanced into {n_shards} shards: {counts} chunks")
+    return counts
+
+if __name__ == "__main__":
+    # Stop the server first: python -m backend.shards rebalance --shards 4
+    parser = argparse.ArgumentParser(description="Manage Flux index shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebalance_cmd = sub.add_parser("rebalance", help="Redistribute the existing index over N shards")
+    rebalance_cmd.add_argument("--shards", type=int, required=True)
+    sub.add_parser("status", help="Print the shard layout")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "rebalance":
+        if args.shards < 1:
+            sys.exit("--shards must be at least 1")
+        counts = rebalance(args.shards)
+        print(f"{SHARD_DIR}: {len(counts)} shards with {counts} chunks; set FLUX_SHARDS={args.shards}")
+    else:
+        print({"shards": read_manifest(), "dir": SHARD_DIR, "configured": SHARDS})
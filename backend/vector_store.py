@@ -1,86 +1,846 @@
 import faiss
-import numpy as np
 import json
+import numpy as np
 import os
+import sys
+import math
+import shutil
+import argparse
 import logging
+import threading
+from typing import NamedTuple
+from contextlib import contextmanager
+from . import metadata_store, wal
+from .documents import DocumentTable
+from .lexical import BM25Index
+from .near_dup import MinHashLSH, signatures
 
 logger = logging.getLogger(__name__)
 
 INDEX_DIR = "data/index"
 INDEX_PATH = os.path.join(INDEX_DIR, "faiss.idx")
 META_PATH = os.path.join(INDEX_DIR, "metadata.jsonl")
+# Exact normalized float32 vectors, row i == vector id i. Lets compressed
+# indexes re-rank candidates exactly and be rebuilt without loss.
+VECTORS_PATH = os.path.join(INDEX_DIR, "vectors.f32")
+LEXICAL_PATH = os.path.join(INDEX_DIR, "lexical.npz")
+# MinHash signatures of chunk texts, one row per vector id
+NEAR_DUP_PATH = os.path.join(INDEX_DIR, "minhash.u32")
+# Stable chunk ids and sources per row, plus the chunk ids deleted since the last compaction
+DOCUMENTS_PATH = os.path.join(INDEX_DIR, "documents.npz")
+TOMBSTONES_PATH = os.path.join(INDEX_DIR, "tombstones.i8")
+# Batches committed since faiss.idx was last written; replayed from vectors.f32 on load
+WAL_PATH = os.path.join(INDEX_DIR, "wal.log")
+WRITER_LOCK_PATH = os.path.join(INDEX_DIR, "writer.lock")
+
+try:
+    import fcntl
+except ImportError:  # Windows: the writer lock is process-local only
+    fcntl = None
+
+# Process-wide resident index, owned by the writer. Queries never touch it:
+# they search an immutable Snapshot of the last faiss.idx plus the rows
+# committed since, so they never wait for or race with ingestion.
+_index = None
+_lexical = None
+_near_dup = None
+_documents = None
+_index_mtime = None
+_generation = 0
+# Even between compaction swaps, odd during one (a seqlock): row numbers read
+# under one value may not be used with stores loaded under another
+_layout = 0
+_index_lock = threading.Lock()
+_snapshot = None
+_writer_lock = threading.RLock()
+_writer_depth = 0
+_recovered = False
+
+class Snapshot(NamedTuple):
+    index: object  # read-only faiss index loaded from faiss.idx
+    n_rows: int    # committed rows; rows past index.ntotal are searched exactly
+    mtime: object
+
+# Index backend, selected with FLUX_INDEX_TYPE. IVF variants need training, so
+# they start out flat and are trained once TRAIN_MIN_VECTORS vectors exist.
+INDEX_TYPE = os.environ.get("FLUX_INDEX_TYPE", "flat")
+INDEX_SPECS = {
+    "flat": "Flat",
+    "ivf": "IVF{nlist},Flat",
+    "hnsw": "HNSW{hnsw_m}",
+    "ivfpq": "IVF{nlist},PQ{pq_m}x{pq_nbits}",
+    # Compressed flat storage: 2x, 4x and (dim*32)/(PQ_M*PQ_NBITS) x smaller than float32
+    "fp16": "SQfp16",
+    "sq8": "SQ8",
+    "pq": "PQ{pq_m}x{pq_nbits}",
+}
+TRAINED_TYPES = {"ivf", "ivfpq", "sq8", "pq"}
+TRAIN_MIN_VECTORS = int(os.environ.get("FLUX_TRAIN_MIN_VECTORS", "10000"))
+IVF_NLIST = int(os.environ.get("FLUX_IVF_NLIST", "4096"))
+IVF_NPROBE = int(os.environ.get("FLUX_IVF_NPROBE", "16"))
+HNSW_M = int(os.environ.get("FLUX_HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.environ.get("FLUX_HNSW_EF_SEARCH", "64"))
+PQ_M = int(os.environ.get("FLUX_PQ_M", "48"))
+PQ_NBITS = int(os.environ.get("FLUX_PQ_NBITS", "8"))
+# Fetch top_k * RERANK_FACTOR candidates and re-score them against the exact
+# vectors on disk; 0 or 1 disables re-ranking
+RERANK_FACTOR = int(os.environ.get("FLUX_RERANK_FACTOR", "0"))
+# Filtered searches matching at most this many rows skip the index and score
+# those rows exactly from vectors.f32
+FILTER_EXACT_MAX = int(os.environ.get("FLUX_FILTER_EXACT_MAX", "50000"))
+
+def make_index(dim, kind, n_train=0):
+    if kind not in INDEX_SPECS:
+        raise ValueError(f"Unknown index type {kind!r}, expected one of {sorted(INDEX_SPECS)}")
+    # ~4*sqrt(n) lists keeps list sizes balanced for the corpus we train on
+    nlist = max(1, min(IVF_NLIST, int(4 * math.sqrt(max(n_train, 1)))))
+    spec = INDEX_SPECS[kind].format(nlist=nlist, hnsw_m=HNSW_M, pq_m=PQ_M, pq_nbits=PQ_NBITS)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = IVF_NPROBE
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    logger.info(f"Created {kind} index ({spec}) with dimension {dim}")
+    return index
 
 def init(dim):
     if not os.path.exists(INDEX_DIR):
         os.makedirs(INDEX_DIR)
         logger.info(f"Created index directory: {INDEX_DIR}")
-    index = faiss.IndexFlatIP(dim)
+    if INDEX_TYPE in TRAINED_TYPES:
+        index = faiss.IndexFlatIP(dim)
+    else:
+        index = make_index(dim, INDEX_TYPE)
     logger.info(f"Initialized new FAISS index with dimension {dim}")
     return index
 
+def exact_vectors(dim, n_rows):
+    # Read-only mmap of the first n_rows (rows the caller knows are committed)
+    # of vectors.f32; None when the file is missing or shorter, since its rows
+    # then do not line up with vector ids until the writer backfills it
+    if n_rows == 0 or _vector_rows(dim) < n_rows:
+        return None
+    return np.memmap(VECTORS_PATH, dtype="float32", mode="r", shape=(n_rows, dim))
+
+def all_vectors(index):
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    stored = exact_vectors(index.d, index.ntotal)
+    if stored is not None:
+        return np.array(stored)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    # Lossy for PQ indexes, exact for everything else
+    return index.reconstruct_n(0, index.ntotal)
+
+def get_vectors(index, ids, n_rows=None):
+    # n_rows: committed rows the ids may reach, e.g. a snapshot's tail past index.ntotal
+    ids = np.asarray(ids, dtype="int64")
+    stored = exact_vectors(index.d, index.ntotal if n_rows is None else n_rows)
+    if stored is not None and (len(ids) == 0 or ids.max() < len(stored)):
+        return np.asarray(stored[ids])
+    # Indexes written before vectors.f32 existed: reconstruct from the index itself
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index.reconstruct_batch(ids)
+
+def rebuild(index, kind):
+    vectors = all_vectors(index)
+    new_index = make_index(index.d, kind, n_train=len(vectors))
+    if not new_index.is_trained:
+        logger.info(f"Training {kind} index on {len(vectors)} vectors")
+        new_index.train(vectors)
+    new_index.add(vectors)
+    return new_index
+
+def _index_bytes(index):
+    # Codes, ids, graph and codebooks, computed from the index's structures:
+    # serializing a memory-mapped multi-GB index would copy all of it
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        transforms = (faiss.downcast_VectorTransform(index.chain.at(i)) for i in range(index.chain.size()))
+        return _index_bytes(index.index) + sum((t.A.size() + t.b.size()) * 4 for t in transforms
+                                               if isinstance(t, faiss.LinearTransform))
+    if isinstance(index, faiss.IndexIVF):
+        codebook = index.pq.centroids.size() * 4 if isinstance(index, faiss.IndexIVFPQ) else 0
+        return _index_bytes(index.quantizer) + index.ntotal * (index.code_size + 8) + codebook
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        return _index_bytes(index.storage) + hnsw.neighbors.size() * 4 + hnsw.offsets.size() * 8 + hnsw.levels.size() * 4
+    if isinstance(index, faiss.IndexFlatCodes):
+        codebook = index.pq.centroids.size() * 4 if isinstance(index, faiss.IndexPQ) else 0
+        trained = index.sq.trained.size() * 4 if isinstance(index, faiss.IndexScalarQuantizer) else 0
+        return index.ntotal * index.code_size + codebook + trained
+    return faiss.serialize_index(index).nbytes
+
+def index_stats(index):
+    memory = _index_bytes(index)
+    return {
+        "type": type(index).__name__,
+        "configured_type": INDEX_TYPE,
+        "ntotal": index.ntotal,
+        "dim": index.d,
+        "is_trained": index.is_trained,
+        "memory_bytes": int(memory),
+        "bytes_per_vector": memory / index.ntotal if index.ntotal else None,
+    }
+
+def set_index_dir(path):
+    global INDEX_DIR, INDEX_PATH, META_PATH, VECTORS_PATH, LEXICAL_PATH, NEAR_DUP_PATH, DOCUMENTS_PATH, TOMBSTONES_PATH
+    global WAL_PATH, WRITER_LOCK_PATH
+    INDEX_DIR = path
+    INDEX_PATH = os.path.join(path, "faiss.idx")
+    META_PATH = os.path.join(path, "metadata.jsonl")
+    VECTORS_PATH = os.path.join(path, "vectors.f32")
+    LEXICAL_PATH = os.path.join(path, "lexical.npz")
+    NEAR_DUP_PATH = os.path.join(path, "minhash.u32")
+    DOCUMENTS_PATH = os.path.join(path, "documents.npz")
+    TOMBSTONES_PATH = os.path.join(path, "tombstones.i8")
+    WAL_PATH = os.path.join(path, "wal.log")
+    WRITER_LOCK_PATH = os.path.join(path, "writer.lock")
+    reset_index()
+
+def _index_file_mtime():
+    try:
+        return os.stat(INDEX_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def layout():
+    current = _layout
+    if current % 2:
+        # The swap holds _index_lock and takes milliseconds; wait it out
+        with _index_lock:
+            current = _layout
+    return current
+
+def generation():
+    # Bumped whenever the resident index changes; lets callers invalidate derived state
+    return _generation
+
+def reset_index():
+    global _index, _lexical, _near_dup, _documents, _snapshot, _index_mtime, _generation, _recovered
+    with _index_lock:
+        _index = None
+        _lexical = None
+        _near_dup = None
+        _documents = None
+        _snapshot = None
+        _index_mtime = None
+        _recovered = False
+        _generation += 1
+
+def _vector_rows(dim):
+    try:
+        return os.path.getsize(VECTORS_PATH) // (dim * 4)
+    except FileNotFoundError:
+        return 0
+
+def committed_rows(snapshot_rows):
+    # Rows whose vectors and metadata are durable: everything in faiss.idx plus
+    # every batch logged in the WAL since
+    return max(snapshot_rows, wal.committed_rows(WAL_PATH))
+
+def _saved_rows():
+    return faiss.read_index(INDEX_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY).ntotal \
+        if os.path.exists(INDEX_PATH) else 0
+
+def _readable_rows():
+    # Rows a reader may load sidecars for: committed, with an offset. Never
+    # past a batch the writer is still appending or may roll back.
+    return min(committed_rows(_saved_rows()), metadata_store.count(META_PATH))
+
+def _recover(dim):
+    # Drops a batch that was being written when the last writer died and
+    # migrates sidecars from older layouts. Only the writer may do either: a
+    # reader could race a live writer's batch.
+    global _lexical, _near_dup, _documents, _snapshot
+    if not os.path.exists(INDEX_DIR):
+        return
+    snapshot_rows = _saved_rows()
+    n_meta = metadata_store.ensure_offsets(META_PATH)
+    n_vectors = _vector_rows(dim)
+    if n_vectors < snapshot_rows:
+        _backfill_vectors(snapshot_rows)
+        n_vectors = snapshot_rows
+    if not os.path.exists(WAL_PATH) and min(n_meta, n_vectors) > snapshot_rows:
+        # Written before the WAL existed: rows present in both files count as committed
+        wal.append(WAL_PATH, snapshot_rows, min(n_meta, n_vectors) - snapshot_rows)
+    committed = committed_rows(snapshot_rows)
+    if n_meta > committed:
+        metadata_store.truncate(META_PATH, committed)
+    if n_vectors > committed:
+        logger.warning(f"Truncating {VECTORS_PATH} from {n_vectors} to {committed} rows")
+        os.truncate(VECTORS_PATH, committed * dim * 4)
+    if min(n_meta, n_vectors) < committed and n_vectors:
+        logger.error(f"Committed rows ({committed}) missing from metadata ({n_meta}) or vectors ({n_vectors}); "
+                     f"run 'python -m backend.vector_store check'")
+    _recover_near_dup(min(n_meta, committed))
+    with _index_lock:
+        # Sidecars a reader loaded before recovery may count rows it just dropped or committed
+        _lexical = _near_dup = _documents = _snapshot = None
+
+def _backfill_vectors(n_rows):
+    # Index directories written before vectors.f32 existed (or with a short
+    # one): rebuild it from faiss.idx so that row i is vector id i again
+    logger.warning(f"Rebuilding {VECTORS_PATH} from the {n_rows} vectors in {INDEX_PATH}")
+    index = faiss.read_index(INDEX_PATH)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    tmp_path = VECTORS_PATH + ".tmp"
+    # Lossy for PQ indexes, exact for everything else
+    with open(tmp_path, "wb") as f:
+        for start in range(0, n_rows, 65536):
+            f.write(np.ascontiguousarray(index.reconstruct_n(start, min(65536, n_rows - start)), dtype="float32").tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, VECTORS_PATH)
+
+def _recover_near_dup(n_rows):
+    # Signatures are appended after the WAL record: drop rows past the
+    # committed ones, and sign rows written before minhash.u32 existed
+    row_bytes = signatures([]).shape[1] * 4
+    if os.path.exists(NEAR_DUP_PATH) and os.path.getsize(NEAR_DUP_PATH) > n_rows * row_bytes:
+        os.truncate(NEAR_DUP_PATH, n_rows * row_bytes)
+    n_signed = os.path.getsize(NEAR_DUP_PATH) // row_bytes if os.path.exists(NEAR_DUP_PATH) else 0
+    if n_signed < n_rows:
+        logger.info(f"Signing {n_rows - n_signed} metadata rows for near-duplicate detection")
+        lsh = MinHashLSH(NEAR_DUP_PATH)
+        for start in range(n_signed, n_rows, 65536):
+            missing = range(start, min(start + 65536, n_rows))
+            lsh.add(start, signatures([m.get("text", "") for m in metadata_store.lookup(META_PATH, missing)]))
+
+def migrate(dim=384):
+    # Recovery and sidecar migration, run once as the writer at startup so
+    # readers of an older index directory see all of it
+    with writer(dim):
+        pass
+
+@contextmanager
+def writer(dim=384):
+    # Single writer: one thread in this process and, through an flock on
+    # writer.lock, one process per index directory. Re-entrant.
+    global _writer_depth, _recovered
+    with _writer_lock:
+        fd = None
+        if _writer_depth == 0:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            fd = os.open(WRITER_LOCK_PATH, os.O_RDWR | os.O_CREAT)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            if not _recovered:
+                _recover(dim)
+                _recovered = True
+        _writer_depth += 1
+        try:
+            yield
+        finally:
+            _writer_depth -= 1
+            if fd is not None:
+                os.close(fd)
+
+def _read_snapshot(dim):
+    mtime = _index_file_mtime()
+    if mtime is not None:
+        # Memory-mapped and never mutated, so any number of queries can share it
+        index = faiss.read_index(INDEX_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    else:
+        index = faiss.IndexFlatIP(dim)
+    # count(), not ensure_offsets(): a reader must never rewrite the writer's files
+    n_rows = min(committed_rows(index.ntotal), metadata_store.count(META_PATH),
+                 max(_vector_rows(index.d), index.ntotal))
+    return Snapshot(index, max(n_rows, index.ntotal), mtime)
+
+def snapshot(dim=384):
+    global _snapshot
+    snap = _snapshot
+    if snap is not None and snap.mtime == _index_file_mtime():
+        return snap
+    with _index_lock:
+        if _snapshot is None or _snapshot.mtime != _index_file_mtime():
+            _snapshot = _read_snapshot(dim)
+        return _snapshot
+
+def _publish(n_rows=None, index=None):
+    # Called by the writer after a commit; readers pick the new snapshot up
+    # on their next query with a single reference read
+    global _snapshot
+    snap = _snapshot
+    if snap is None:
+        return
+    _snapshot = Snapshot(snap.index if index is None else index, snap.n_rows if n_rows is None else n_rows,
+                         snap.mtime if index is None else _index_file_mtime())
+
+def _load_lexical():
+    lexical = BM25Index.load(LEXICAL_PATH) if os.path.exists(LEXICAL_PATH) else BM25Index()
+    # Catch up on rows written before the lexical index existed or after its last save
+    n_rows = _readable_rows()
+    if lexical.n_docs < n_rows:
+        logger.info(f"Indexing {n_rows - lexical.n_docs} metadata rows for lexical search")
+        missing = range(lexical.n_docs, n_rows)
+        lexical.add(lexical.n_docs, [m.get("text", "") for m in metadata_store.lookup(META_PATH, missing, n_rows)])
+    return lexical
+
+def lexical_index():
+    global _lexical
+    current = _lexical
+    if current is not None:
+        return current
+    with _index_lock:
+        if _lexical is None:
+            _lexical = _load_lexical()
+        return _lexical
+
+def _load_near_dup():
+    # Read-only: trimming and signing missing rows is the writer's job (_recover_near_dup)
+    return MinHashLSH(NEAR_DUP_PATH, n_rows=_readable_rows())
+
+def near_dup_index():
+    global _near_dup
+    current = _near_dup
+    if current is not None:
+        return current
+    with _index_lock:
+        if _near_dup is None:
+            _near_dup = _load_near_dup()
+        return _near_dup
+
+def _load_documents():
+    n_rows = _readable_rows()
+    docs = DocumentTable.load(DOCUMENTS_PATH, n_rows) if os.path.exists(DOCUMENTS_PATH) else DocumentTable()
+    if docs.n_rows < n_rows:
+        missing = range(docs.n_rows, n_rows)
+        docs.add(docs.n_rows, metadata_store.lookup(META_PATH, missing, n_rows))
+    if os.path.exists(TOMBSTONES_PATH):
+        docs.tombstone(docs.rows_for_chunks(np.fromfile(TOMBSTONES_PATH, dtype="<i8")))
+    return docs
+
+def documents():
+    global _documents
+    current = _documents
+    if current is not None:
+        return current
+    with _index_lock:
+        if _documents is None:
+            _documents = _load_documents()
+        return _documents
+
+def _write_index_atomic(index, path):
+    tmp = path + ".tmp"
+    faiss.write_index(index, tmp)
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
 def save_index(index):
-    faiss.write_index(index, INDEX_PATH)
+    # Snapshot: faiss.idx is replaced atomically, then the WAL it now covers is
+    # emptied. Call it as the writer (see writer()).
+    global _index, _index_mtime
+    with writer(index.d):
+        _write_index_atomic(index, INDEX_PATH)
+        wal.reset(WAL_PATH)
+        if _lexical is not None:
+            _lexical.save(LEXICAL_PATH)
+        if _documents is not None:
+            _documents.save(DOCUMENTS_PATH)
+        base = faiss.read_index(INDEX_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        with _index_lock:
+            # Adopt the written index as the resident one so the next load does not re-read it
+            _index = index
+            _index_mtime = _index_file_mtime()
+            _publish(index=base, n_rows=index.ntotal)
     logger.info(f"Saved index to {INDEX_PATH}")
 
 def load_index(dim):
-    if os.path.exists(INDEX_PATH):
-        logger.info(f"Loading existing index from {INDEX_PATH}")
-        return faiss.read_index(INDEX_PATH)
-    else:
-        logger.info("No existing index found, creating new one")
-        return init(dim)
+    global _index, _lexical, _near_dup, _documents, _index_mtime, _generation
+    mtime = _index_file_mtime()
+    with _index_lock:
+        if _index is not None and mtime == _index_mtime:
+            return _index
+
+        if mtime is not None:
+            logger.info(f"Loading existing index from {INDEX_PATH}")
+            _index = faiss.read_index(INDEX_PATH)
+        else:
+            logger.info("No existing index found, creating new one")
+            _index = init(dim)
+        _replay(_index)
+        _lexical = None
+        _near_dup = None
+        _documents = None
+        _index_mtime = mtime
+        _generation += 1
+        return _index
+
+def _replay(index):
+    # Rows committed after faiss.idx was written live in vectors.f32 and the WAL
+    n_rows = min(committed_rows(index.ntotal), metadata_store.count(META_PATH), _vector_rows(index.d))
+    if n_rows > index.ntotal:
+        logger.info(f"Replaying {n_rows - index.ntotal} committed rows from the WAL")
+        index.add(np.ascontiguousarray(exact_vectors(index.d, n_rows)[index.ntotal:]))
+
+def add(index, vectors, metadatas, sigs=None):
+    with writer(index.d):
+        return _add(index, vectors, metadatas, sigs)
 
-def add(index, vectors, metadatas):
-    logger.info(f"Adding {len(vectors)} vectors to index")
+def _add(index, vectors, metadatas, sigs):
+    global _index, _generation
+    logger.debug(f"Adding {len(vectors)} vectors to index")
     
     # vectors: numpy array (n,d) float32; normalize for cosine
     vectors_normalized = vectors.copy()
     faiss.normalize_L2(vectors_normalized)
-    index.add(vectors_normalized)
+
+    # Durable part first: vectors, then metadata, then the WAL record that
+    # commits them. A crash before the record leaves a tail that the next
+    # writer truncates; a failure here is rolled back straight away.
+    lexical = lexical_index()
+    near_dup = near_dup_index()
+    docs = documents()
+    first_id = index.ntotal
+    docs.assign_chunk_ids(metadatas)
+    try:
+        if (os.path.getsize(VECTORS_PATH) if os.path.exists(VECTORS_PATH) else 0) != first_id * index.d * 4:
+            raise RuntimeError(f"{VECTORS_PATH} does not end at row {first_id}; "
+                               f"run 'python -m backend.vector_store check'")
+        with open(VECTORS_PATH, "ab") as f:
+            f.write(np.ascontiguousarray(vectors_normalized).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        meta_first_id = metadata_store.append(META_PATH, metadatas)
+        metadata_store.sync(META_PATH)
+        if meta_first_id != first_id:
+            raise RuntimeError(f"Metadata has {meta_first_id} rows but the index has {first_id} vectors; "
+                               f"run 'python -m backend.vector_store check'")
+        wal.append(WAL_PATH, first_id, len(metadatas))
+    except Exception:
+        if _vector_rows(index.d) > first_id:
+            # Never extends the file: zero rows would pass for real vectors
+            os.truncate(VECTORS_PATH, first_id * index.d * 4)
+        metadata_store.truncate(META_PATH, first_id)
+        docs.next_chunk_id -= len(metadatas)
+        raise
+
+    if (isinstance(index, faiss.IndexFlat) and INDEX_TYPE in TRAINED_TYPES
+            and index.ntotal + len(vectors_normalized) >= TRAIN_MIN_VECTORS):
+        # Enough data to train the configured IVF index; ids stay in insertion order
+        trained = rebuild(index, INDEX_TYPE)
+        trained.add(vectors_normalized)
+        if index is _index:
+            _index = trained
+        index = trained
+    else:
+        index.add(vectors_normalized)
+    if index is _index:
+        _generation += 1
     
-    logger.info(f"Index now contains {index.ntotal} vectors")
+    logger.debug(f"Index now contains {index.ntotal} vectors")
+
+    texts = [m.get("text", "") for m in metadatas]
+    lexical.add(first_id, texts)
+    near_dup.add(first_id, signatures(texts) if sigs is None else sigs)
+    docs.add(first_id, metadatas)
+    if index is _index:
+        _publish(n_rows=index.ntotal)
+    if metadatas and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"First metadata entry: {metadatas[0]}")
+    return index
+
+def delete_rows(rows):
+    global _generation
+    docs = documents()
+    rows = np.asarray(rows, dtype="int64")
+    rows = rows[docs.live[rows]]
+    if len(rows) == 0:
+        return 0
+    # Tombstones are keyed by chunk id so they stay valid if rows are renumbered
+    with open(TOMBSTONES_PATH, "ab") as f:
+        f.write(docs.chunk_ids[rows].astype("<i8").tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    docs.tombstone(rows)
+    _generation += 1
+    logger.info(f"Tombstoned {len(rows)} chunks, {docs.n_dead} awaiting compaction")
+    return len(rows)
+
+def delete_source(source):
+    return delete_rows(documents().rows_for_source(source))
+
+def compact(index):
+    with writer(index.d):
+        return _compact(index)
+
+def _compact(index):
+    # Rewrites every store without tombstoned rows into a sibling directory and
+    # swaps the files in. Queries keep using the published snapshot until the swap.
+    global _index, _lexical, _near_dup, _documents, _index_mtime, _generation, _layout
+    docs = documents()
+    lexical = lexical_index()
+    near_dup = near_dup_index()
+    live_rows = np.flatnonzero(docs.live)
+    dropped = docs.n_rows - len(live_rows)
+    if dropped == 0:
+        return index, 0
+    logger.info(f"Compacting index: keeping {len(live_rows)} of {docs.n_rows} rows")
+
+    tmp_dir = INDEX_DIR.rstrip("/") + ".compact"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    new_index = faiss.clone_index(index)
+    new_index.reset()
+    new_lexical = BM25Index(k1=lexical.k1, b=lexical.b)
+    new_docs = docs.select(live_rows)
+    tmp = {name: os.path.join(tmp_dir, name) for name in
+           ("faiss.idx", "metadata.jsonl", "vectors.f32", "lexical.npz", "minhash.u32", "documents.npz")}
+    for name in ("metadata.jsonl", "metadata.jsonl.offsets", "minhash.u32"):
+        open(os.path.join(tmp_dir, name), "wb").close()
+    new_near_dup = MinHashLSH(tmp["minhash.u32"])
+
+    with open(tmp["vectors.f32"], "wb") as vectors_file:
+        for start in range(0, len(live_rows), 65536):
+            rows = live_rows[start:start + 65536]
+            vectors = np.ascontiguousarray(get_vectors(index, rows), dtype="float32")
+            new_index.add(vectors)
+            vectors_file.write(vectors.tobytes())
+            metas = metadata_store.lookup(META_PATH, rows)
+            for m, chunk_id in zip(metas, docs.chunk_ids[rows].tolist()):
+                # Legacy rows took their row number as chunk id; pin it before rows move
+                m.setdefault("chunk_id", chunk_id)
+            first_id = metadata_store.append(tmp["metadata.jsonl"], metas)
+            new_lexical.add(first_id, [m.get("text", "") for m in metas])
+            new_near_dup.add(first_id, near_dup.get(rows))
+    _write_index_atomic(new_index, tmp["faiss.idx"])
+    new_lexical.save(tmp["lexical.npz"])
+    new_docs.save(tmp["documents.npz"])
+
+    with _index_lock:
+        _layout += 1
+        for name, path in ((os.path.basename(p), p) for p in
+                           (META_PATH, metadata_store.offsets_path(META_PATH), VECTORS_PATH, LEXICAL_PATH,
+                            NEAR_DUP_PATH, DOCUMENTS_PATH, INDEX_PATH)):
+            os.replace(os.path.join(tmp_dir, name), path)
+        if os.path.exists(TOMBSTONES_PATH):
+            os.remove(TOMBSTONES_PATH)
+        wal.reset(WAL_PATH)
+        new_near_dup.path = NEAR_DUP_PATH
+        _index, _lexical, _near_dup, _documents = new_index, new_lexical, new_near_dup, new_docs
+        _index_mtime = _index_file_mtime()
+        _publish(index=faiss.read_index(INDEX_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY),
+                 n_rows=new_index.ntotal)
+        _generation += 1
+        _layout += 1
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(f"Compaction dropped {dropped} rows, index now contains {new_index.ntotal} vectors")
+    return new_index, dropped
+
+def _search_params(index, nprobe=None, ef_search=None, allowed=None):
+    kwargs = {}
+    if allowed is not None:
+        # Bitmap of rows a search may return
+        bits = np.packbits(allowed, bitorder="little")
+        kwargs["sel"] = faiss.IDSelectorBitmap(len(bits), faiss.swig_ptr(bits))
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and (nprobe or kwargs):
+        # IndexIVF rejects plain SearchParameters, so a selector alone still needs the IVF type
+        params = faiss.SearchParametersIVF(nprobe=nprobe or ivf.nprobe, **kwargs)
+    elif ef_search and isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(efSearch=ef_search, **kwargs)
+    elif kwargs:
+        params = faiss.SearchParameters(**kwargs)
+    else:
+        return None
+    if allowed is not None:
+        params.referenced_objects = [kwargs["sel"], bits]
+    return params
+
+def rerank(q, ids, top_k, n_rows):
+    stored = exact_vectors(q.shape[0], n_rows)
+    # Sorted ids turn the candidate fetch into forward reads through the mmap
+    ids = np.sort(ids[ids >= 0])
+    if stored is None or len(ids) == 0 or ids[-1] >= len(stored):
+        logger.warning("Exact vectors unavailable, skipping re-rank")
+        return None
+    exact = stored[ids] @ q
+    order = np.argsort(-exact)[:top_k]
+    return exact[order], ids[order]
 
-    # Append metadata to file
-    with open(META_PATH, "a", encoding='utf-8') as f:
-        for i, m in enumerate(metadatas):
-            f.write(json.dumps(m, ensure_ascii=False) + "\n")
-            if i == 0: 
-                logger.info(f"First metadata entry: {m}")
+def fetch_metadata(ids, n_rows=None):
+    return metadata_store.lookup(META_PATH, ids, n_rows)
 
-def search(index, qvec, top_k=5):
+def _rows_mask(rows, n):
+    if rows is None:
+        return None
+    mask = np.zeros(n, dtype=bool)
+    mask[rows[rows < n]] = True
+    return mask
+
+def exact_search(q, rows, top_k, dim, n_rows):
+    # Scores only the given rows against vectors.f32; None when the file cannot cover them
+    stored = exact_vectors(dim, n_rows)
+    if stored is None or (len(rows) and rows[-1] >= len(stored)):
+        return None
+    exact = stored[rows] @ q
+    k = min(top_k, len(rows))
+    if k == 0:
+        return np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64")
+    top = np.argpartition(-exact, k - 1)[:k]
+    top = top[np.argsort(-exact[top])]
+    return exact[top], rows[top]
+
+def lexical_search(query, top_k=10, rows=None):
+    lexical = lexical_index()
+    return lexical.search(query, top_k=top_k, mask=documents().allowed(_rows_mask(rows, lexical.n_docs)))
+
+def search_ids(index, qvec, top_k=5, nprobe=None, ef_search=None, rerank_factor=None, rows=None):
     if index.ntotal == 0:
         logger.warning("Index is empty, no vectors to search")
-        return [], []
+        return np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64")
     
     q = qvec.astype("float32").reshape(1, -1)
     faiss.normalize_L2(q)
+    rerank_factor = RERANK_FACTOR if rerank_factor is None else rerank_factor
+    fetch_k = top_k * rerank_factor if rerank_factor > 1 else top_k
+
+    if rows is not None and len(rows) <= FILTER_EXACT_MAX:
+        # A selective filter is cheaper to score exactly than to search the whole index around
+        found = exact_search(q[0], np.asarray(rows, dtype="int64"), top_k, index.d, index.ntotal)
+        if found is not None:
+            return found
 
-    logger.info(f"Searching index with {index.ntotal} vectors for top {top_k} results")
-    D, I = index.search(q, min(top_k, index.ntotal))
+    logger.debug(f"Searching index with {index.ntotal} vectors for top {top_k} results")
+    allowed = documents().allowed(_rows_mask(rows, index.ntotal))
+    if allowed is not None and isinstance(index, faiss.IndexPQ):
+        # IndexPQ cannot take an id selector: over-fetch and filter instead
+        excluded = index.ntotal - int(np.count_nonzero(allowed))
+        D, I = index.search(q, min(fetch_k + excluded, index.ntotal), params=_search_params(index))
+        ok = (I[0] >= 0) & (I[0] < len(allowed))
+        ok[ok] = allowed[I[0][ok]]
+        scores, ids = D[0][ok][:fetch_k], I[0][ok][:fetch_k]
+    else:
+        params = _search_params(index, nprobe=nprobe, ef_search=ef_search, allowed=allowed)
+        D, I = index.search(q, min(fetch_k, index.ntotal), params=params)
+        # Filtered searches pad with -1 when fewer rows qualify
+        scores, ids = D[0][I[0] >= 0], I[0][I[0] >= 0]
     
-    metas = []
-    if os.path.exists(META_PATH):
-        with open(META_PATH, encoding='utf-8') as f:
-            lines = f.readlines()
-            logger.info(f"Loaded {len(lines)} metadata lines")
-        
-        for idx in I[0]:
-            if 0 <= idx < len(lines):
-                try:
-                    meta = json.loads(lines[idx])
-                    metas.append(meta)
-                    logger.info(f"Retrieved metadata for index {idx}: keys={list(meta.keys())}")
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error parsing metadata line {idx}: {e}")
-                    metas.append({})
-            else:
-                logger.warning(f"Index {idx} is out of range for metadata (have {len(lines)} lines)")
-                metas.append({})
+    if fetch_k > top_k:
+        reranked = rerank(q[0], ids, top_k, index.ntotal)
+        if reranked is not None:
+            scores, ids = reranked
+        else:
+            scores, ids = scores[:top_k], ids[:top_k]
+    return scores, ids
+
+def search_snapshot(snap, qvec, top_k=5, nprobe=None, ef_search=None, rerank_factor=None, rows=None):
+    # Searches a reader snapshot: the saved index, plus the rows committed
+    # since it was written, which are scored exactly against vectors.f32
+    base = snap.index
+    if rows is None:
+        base_rows = None
+        tail = np.arange(base.ntotal, snap.n_rows, dtype="int64")
+        live = documents().live
+        tail = tail[tail < len(live)]
+        tail = tail[live[tail]]
     else:
-        logger.warning(f"Metadata file {META_PATH} does not exist")
-        metas = [{}] * len(I[0])
+        rows = np.asarray(rows, dtype="int64")
+        base_rows = rows[rows < base.ntotal]
+        tail = rows[(rows >= base.ntotal) & (rows < snap.n_rows)]
+
+    empty = np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64")
+    found = search_ids(base, qvec, top_k=top_k, nprobe=nprobe, ef_search=ef_search, rerank_factor=rerank_factor,
+                       rows=base_rows) if base.ntotal and (base_rows is None or len(base_rows)) else empty
+    if len(tail) == 0:
+        return found
+    q = qvec.astype("float32").reshape(1, -1)
+    faiss.normalize_L2(q)
+    recent = exact_search(q[0], tail, top_k, base.d, snap.n_rows) or empty
+    scores = np.concatenate([found[0], recent[0]])
+    ids = np.concatenate([found[1], recent[1]])
+    top = np.argsort(-scores, kind="stable")[:top_k]
+    return scores[top], ids[top]
+
+def check(dim=384):
+    # Cross-checks the row counts of every store against the committed rows
+    snapshot_rows = _saved_rows()
+    committed = committed_rows(snapshot_rows)
+    n_meta = metadata_store.count(META_PATH)
+    report = {
+        "snapshot_rows": snapshot_rows,
+        "wal_rows": wal.committed_rows(WAL_PATH),
+        "committed_rows": committed,
+        "metadata_rows": n_meta,
+        "offsets_in_sync": not os.path.exists(META_PATH) or metadata_store._offsets_in_sync(META_PATH),
+        "vector_rows": _vector_rows(dim),
+        "minhash_rows": os.path.getsize(NEAR_DUP_PATH) // (signatures([]).shape[1] * 4)
+        if os.path.exists(NEAR_DUP_PATH) else 0,
+        "document_rows": documents().n_rows,
+    }
+    problems = []
+    if not report["offsets_in_sync"]:
+        problems.append("metadata offsets do not match metadata.jsonl")
+    for name in ("metadata_rows", "vector_rows"):
+        if report[name] < committed:
+            problems.append(f"{name} ({report[name]}) is behind the committed rows ({committed})")
+        elif report[name] > committed:
+            problems.append(f"{name} ({report[name]}) has uncommitted rows past {committed}; the next writer truncates them")
+    for name in ("minhash_rows", "document_rows"):
+        if report[name] > n_meta:
+            problems.append(f"{name} ({report[name]}) is ahead of metadata ({n_meta})")
+    report["problems"] = problems
+    return report
+
+def search(index, qvec, top_k=5, nprobe=None, ef_search=None, rerank_factor=None):
+    if index.ntotal == 0:
+        logger.warning("Index is empty, no vectors to search")
+        return [], []
     
-    scores = D[0].tolist()
-    logger.info(f"Search completed, found {len(metas)} results with scores: {scores}")
+    scores, ids = search_ids(index, qvec, top_k=top_k, nprobe=nprobe, ef_search=ef_search,
+                             rerank_factor=rerank_factor)
+    metas = fetch_metadata(ids)
     
-    return scores, metas
\ No newline at end of file
+    scores = scores.tolist()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Search completed, found {len(metas)} results with scores: {scores}")
+    
+    return scores, metas
+
+if __name__ == "__main__":
+    # python -m backend.vector_store rebuild --type hnsw
+    parser = argparse.ArgumentParser(description="Manage the Flux FAISS index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild_cmd = sub.add_parser("rebuild", help="Convert the existing index to another backend")
+    rebuild_cmd.add_argument("--type", choices=sorted(INDEX_SPECS), default=INDEX_TYPE)
+    sub.add_parser("stats", help="Print index statistics")
+    sub.add_parser("compact", help="Drop tombstoned chunks from every store")
+    sub.add_parser("check", help="Check that every store agrees on the committed rows")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "check":
+        report = check()
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["problems"] else 0)
+
+    if not os.path.exists(INDEX_PATH):
+        sys.exit(f"No index found at {INDEX_PATH}")
+    index = faiss.read_index(INDEX_PATH)
+    if args.command == "rebuild":
+        before = index_stats(index)
+        index = rebuild(index, args.type)
+        save_index(index)
+        after = index_stats(index)
+        print(f"{before['type']} ({before['memory_bytes']} bytes) -> {after['type']} ({after['memory_bytes']} bytes)")
+    elif args.command == "compact":
+        index, dropped = compact(load_index(index.d))
+        print(f"Dropped {dropped} tombstoned rows, {index.ntotal} vectors remain")
+    else:
+        print(index_stats(index))
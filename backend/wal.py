@@ -0,0 +1,43 @@
+import os
+import zlib
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# One record per committed batch: first row, row count, crc32 of the two.
+# A record is written (and fsynced) only after the batch's vectors and
+# metadata are durable, so the last valid record marks the committed rows.
+RECORD = struct.Struct("<qqI")
+
+def _pack(first_row, n_rows):
+    body = struct.pack("<qq", first_row, n_rows)
+    return body + struct.pack("<I", zlib.crc32(body))
+
+def append(path, first_row, n_rows):
+    with open(path, "ab") as f:
+        f.write(_pack(first_row, n_rows))
+        f.flush()
+        os.fsync(f.fileno())
+
+def committed_rows(path):
+    # End of the last valid record; stops at a torn or corrupt one. 0 when empty.
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return 0
+    end = 0
+    for pos in range(0, len(data) - RECORD.size + 1, RECORD.size):
+        first_row, n_rows, crc = RECORD.unpack_from(data, pos)
+        if crc != zlib.crc32(data[pos:pos + 16]) or (end and first_row != end):
+            logger.warning(f"Ignoring WAL records from byte {pos} of {path}")
+            break
+        end = first_row + n_rows
+    return end
+
+def reset(path):
+    # Called after a snapshot covers every logged batch
+    with open(path, "wb") as f:
+        f.flush()
+        os.fsync(f.fileno())
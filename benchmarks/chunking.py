@@ -0,0 +1,104 @@
+"""Chunking throughput on large documents.
+
+    python -m benchmarks.chunking --chars 100000 1000000 10000000 --out chunking.json
+
+Chunks synthetic prose (sentences of varied length, with the odd run-on
+sentence) with the token-aware chunker and with the previous character-based
+one, and reports MB/s, chunk counts and the token sizes of the chunks. Token
+counts come from the embedding model's tokenizer when it is cached locally,
+word/punctuation tokens otherwise ("tokenizer" in the output says which).
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from backend import chunker
+
+WORDS = ("the index stores every chunk with its source page and a vector that the retriever compares "
+         "against questions asked by users of documents reports manuals papers tables results").split()
+
+def synthetic_document(n_chars, seed=0):
+    rng = np.random.default_rng(seed)
+    sentences, size = [], 0
+    while size < n_chars:
+        # Mostly 5-30 words; 1 in 50 is a run-on of several hundred
+        n_words = int(rng.integers(300, 600)) if rng.random() < 0.02 else int(rng.integers(5, 30))
+        words = [WORDS[i] for i in rng.integers(0, len(WORDS), n_words)]
+        sentence = " ".join(words).capitalize() + "."
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    return " ".join(sentences)[:n_chars]
+
+def legacy_chunks(sentences, chunk_size=500):
+    # The character-budget chunker this one replaced, minus its sentence split
+    out, curr = [], ""
+    for i, sentence in enumerate(sentences):
+        if len(curr) + len(sentence) <= chunk_size:
+            curr += " " + sentence if curr else sentence
+        else:
+            if curr.strip():
+                out.append(curr.strip())
+            curr = " ".join(sentences[max(0, i - 2):i + 1])
+    if curr.strip():
+        out.append(curr.strip())
+    return out
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chars", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--max-tokens", type=int, default=chunker.CHUNK_TOKENS)
+    parser.add_argument("--overlap", type=int, default=chunker.CHUNK_OVERLAP)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    tokenizer = "fast" if chunker.tokenizer() is not None else "words"
+    chunker.sentence_tokenizer()
+    results = {}
+    for n_chars in args.chars:
+        text = synthetic_document(n_chars)
+        mb = len(text.encode("utf-8")) / 1e6
+
+        (starts, ends, counts), spans_s = timed(lambda: chunker.chunk_spans(text, args.max_tokens, args.overlap), args.repeat)
+        _, text_s = timed(lambda: chunker.chunk_text(text, args.max_tokens, args.overlap), args.repeat)
+        _, tokens_s = timed(lambda: chunker.token_starts(text), args.repeat)
+        _, sentences_s = timed(lambda: chunker.sentence_spans(text), args.repeat)
+        legacy, legacy_s = timed(lambda: legacy_chunks(chunker.sentence_tokenizer().tokenize(text)), args.repeat)
+        legacy_tokens = [len(chunker.token_starts(c)) for c in legacy]
+
+        results[n_chars] = {
+            "mb": mb,
+            "chunks": len(starts),
+            "mb_per_s": mb / text_s,
+            "chunk_text_seconds": text_s,
+            "chunk_spans_seconds": spans_s,
+            "tokenize_seconds": tokens_s,
+            "sentence_split_seconds": sentences_s,
+            "tokens_mean": float(counts.mean()),
+            "tokens_max": int(counts.max()),
+            "over_budget": int((counts > args.max_tokens).sum()),
+            "legacy_chunks": len(legacy),
+            "legacy_mb_per_s": mb / legacy_s,
+            "legacy_tokens_mean": float(np.mean(legacy_tokens)),
+            "legacy_tokens_max": int(max(legacy_tokens)),
+            "legacy_over_budget": sum(n > args.max_tokens for n in legacy_tokens),
+        }
+        print(n_chars, json.dumps(results[n_chars], indent=2))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"tokenizer": tokenizer, "max_tokens": args.max_tokens, "overlap": args.overlap,
+                       "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
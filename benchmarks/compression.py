@@ -0,0 +1,83 @@
+"""Recall@k and bytes per vector for the compressed index types.
+
+    python -m benchmarks.compression --n 100000 --out compression.json
+
+Builds every index type from the same reference corpus (clustered synthetic
+384-d vectors, normalized like real embeddings) and compares its top-k with
+exact search, with and without re-ranking from the exact vectors on disk.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from backend import vector_store
+
+KINDS = ["flat", "fp16", "sq8", "pq", "ivfpq", "hnsw"]
+
+def reference_corpus(n, dim, n_clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    labels = rng.integers(0, n_clusters, n)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def recall_at_k(index, queries, truth, k, rerank_factor):
+    hits = 0
+    started = time.perf_counter()
+    for q, expected in zip(queries, truth):
+        _, metas = vector_store.search(index, q, top_k=k, rerank_factor=rerank_factor)
+        hits += len({m["i"] for m in metas} & set(expected))
+    elapsed = time.perf_counter() - started
+    return hits / (len(queries) * k), elapsed / len(queries) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    parser.add_argument("--kinds", nargs="+", default=KINDS, choices=sorted(vector_store.INDEX_SPECS))
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    vectors = reference_corpus(args.n, args.dim)
+    queries = vectors[np.random.default_rng(1).choice(args.n, args.queries, replace=False)] + 0.05
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vector_store.set_index_dir(tmp)
+        flat = vector_store.load_index(args.dim)
+        vector_store.add(flat, vectors, [{"i": i} for i in range(args.n)])
+        truth = []
+        for q in queries:
+            _, metas = vector_store.search(flat, q, top_k=args.k, rerank_factor=0)
+            truth.append([m["i"] for m in metas])
+
+        results = {}
+        for kind in args.kinds:
+            started = time.perf_counter()
+            index = flat if kind == "flat" else vector_store.rebuild(flat, kind)
+            build_s = time.perf_counter() - started
+            stats = vector_store.index_stats(index)
+            recall, latency = recall_at_k(index, queries, truth, args.k, rerank_factor=0)
+            rr_recall, rr_latency = recall_at_k(index, queries, truth, args.k, rerank_factor=args.rerank_factor)
+            results[kind] = {
+                "bytes_per_vector": stats["bytes_per_vector"],
+                "compression_vs_float32": args.dim * 4 / stats["bytes_per_vector"],
+                "build_seconds": build_s,
+                f"recall@{args.k}": recall,
+                "query_ms": latency,
+                f"recall@{args.k}_reranked": rr_recall,
+                "query_ms_reranked": rr_latency,
+            }
+            print(kind, json.dumps(results[kind], indent=2))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"n": args.n, "dim": args.dim, "k": args.k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compare CPU inference backends against the fp32 PyTorch baseline.
+
+    python -m benchmarks.inference_backends --backends torch int8 onnx --out inference.json
+
+Embeddings: latency per batch, throughput, and drift as cosine agreement
+with the fp32 vectors on a fixed corpus. Generation: latency per answer and
+the share of answers identical to fp32.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from backend import embeddings, inference, llm
+
+SUBJECTS = ["The library", "The registrar", "Course CS101", "The exam board", "Lab B-204", "The syllabus"]
+VERBS = ["opens at", "requires", "is scheduled for", "was moved to", "lists", "must approve"]
+OBJECTS = ["9 am on weekdays", "two prerequisites", "the spring term", "the north campus", "weekly readings", "late submissions"]
+
+QA = [
+    ("When does the library open?", "The library opens at 9 am on weekdays and closes at 8 pm."),
+    ("What does CS101 require?", "Course CS101 requires two prerequisites: MATH100 and CS100."),
+    ("Where was the lab moved?", "Lab B-204 was moved to the north campus in 2023."),
+    ("Who approves late submissions?", "The exam board must approve late submissions in writing."),
+]
+
+def corpus():
+    return [f"{s} {v} {o}." for s in SUBJECTS for v in VERBS for o in OBJECTS]
+
+def bench_embeddings(backend, texts, batch_size):
+    m = embeddings.load_model(backend)
+    m.encode(texts[:batch_size], show_progress_bar=False)  # warm-up
+    latencies = []
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        started = time.perf_counter()
+        vectors.append(m.encode(texts[i:i + batch_size], show_progress_bar=False, convert_to_numpy=True))
+        latencies.append(time.perf_counter() - started)
+    vectors = np.concatenate(vectors).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, {
+        "batch_latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+        "batch_latency_ms_p95": float(np.percentile(latencies, 95) * 1000),
+        "texts_per_second": len(texts) / sum(latencies),
+    }
+
+def bench_generation(backend):
+    llm._model = llm.load_model(backend)
+    answers = []
+    latencies = []
+    for question, context in QA:
+        started = time.perf_counter()
+        answers.extend(llm.generate_answers_with_flan([(question, context)]))
+        latencies.append(time.perf_counter() - started)
+    return answers, {
+        "answer_latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+        "answer_latency_ms_max": float(max(latencies) * 1000),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(inference.BACKENDS), choices=inference.BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--skip-generation", action="store_true")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    texts = corpus()
+    baseline_vecs, baseline_answers = None, None
+    results = {}
+    for backend in ["torch"] + [b for b in args.backends if b != "torch"]:
+        try:
+            vecs, report = bench_embeddings(backend, texts, args.batch_size)
+            if not args.skip_generation:
+                answers, gen_report = bench_generation(backend)
+                report.update(gen_report)
+        except ImportError as e:
+            results[backend] = {"error": str(e)}
+            continue
+
+        if baseline_vecs is None:
+            baseline_vecs = vecs
+            baseline_answers = None if args.skip_generation else answers
+        cosine = np.sum(vecs * baseline_vecs, axis=1)
+        report["embedding_cosine_mean"] = float(cosine.mean())
+        report["embedding_cosine_min"] = float(cosine.min())
+        if not args.skip_generation:
+            report["answers_identical"] = sum(a == b for a, b in zip(answers, baseline_answers)) / len(QA)
+        results[backend] = report
+        print(backend, json.dumps(report, indent=2))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"corpus_size": len(texts), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
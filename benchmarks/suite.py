@@ -0,0 +1,266 @@
+"""End-to-end performance suite: ingestion, query latency, recall and memory.
+
+    python -m benchmarks.suite --scales 1000 10000 100000 1000000 --out bench.json
+    python -m benchmarks.suite --out new.json --compare bench.json
+
+Ingestion: a synthetic PDF goes through extraction and chunking, embedding and
+index writes, each timed on its own (pages/s, chunks/s). With --no-embed the
+vectors are random and no model is loaded. With --ask N, N questions also go
+through /ask end to end (embedding, retrieval, packing, generation).
+
+Scales: for each corpus size, an index of clustered synthetic vectors with
+synthetic chunk text is built in a temporary directory, then queried through
+retrieval in dense and hybrid mode. Reports build throughput, p50/p95/p99
+latency, recall@k of the dense results against exact search, and peak RSS.
+
+--compare prints every metric next to a previous run and exits with status 1
+when one regressed by more than --tolerance.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from backend import chunker, embeddings, ingestion, retrieval, vector_store
+from benchmarks.chunking import WORDS, synthetic_document
+from benchmarks.compression import reference_corpus
+
+DIM = 384
+BATCH = 10_000
+# Metric name suffixes where a larger value is better; everything else is a cost
+HIGHER_IS_BETTER = ("_per_s", "recall")
+
+def peak_rss_mb():
+    # High-water marks since start (Linux reports KiB); children are the chunking workers
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {"peak_rss_mb": own, "peak_rss_children_mb": children}
+
+def percentiles(latencies_s):
+    ms = np.asarray(latencies_s) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)), "mean_ms": float(ms.mean())}
+
+def synthetic_pdf(n_pages, chars_per_page=3000):
+    import fitz
+    doc = fitz.open()
+    text = synthetic_document(n_pages * chars_per_page)
+    for i in range(n_pages):
+        page = doc.new_page()
+        page.insert_textbox(page.rect + (36, 36, -36, -36), text[i * chars_per_page:(i + 1) * chars_per_page], fontsize=7)
+    return doc.tobytes()
+
+def synthetic_texts(start, n, rng):
+    lengths = rng.integers(20, 60, n)
+    words = rng.integers(0, len(WORDS), int(lengths.sum()))
+    out, pos = [], 0
+    for i, length in enumerate(lengths.tolist()):
+        out.append(f"Chunk {start + i}: " + " ".join(WORDS[w] for w in words[pos:pos + length].tolist()) + ".")
+        pos += length
+    return out
+
+def bench_ingest(args):
+    pdf = synthetic_pdf(args.pages)
+    # One-time tokenizer loads are not throughput
+    chunker.chunk_text("Warm up the chunker. It loads its tokenizers once.")
+    with tempfile.TemporaryDirectory() as tmp:
+        vector_store.set_index_dir(tmp)
+        started = time.perf_counter()
+        chunks = ingestion.process_pdf_bytes(pdf, "bench.pdf", workers=args.workers)
+        chunk_s = time.perf_counter() - started
+        texts = [c for c, _ in chunks]
+        metas = [m for _, m in chunks]
+
+        embed_s = None
+        if args.no_embed:
+            vectors = reference_corpus(len(texts), DIM)
+        else:
+            embeddings.model()
+            started = time.perf_counter()
+            # The model itself, not the embedding cache
+            vectors = np.concatenate([embeddings._encode(texts[i:i + 64]) for i in range(0, len(texts), 64)])
+            embed_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = vector_store.load_index(DIM)
+        for i in range(0, len(texts), 64):
+            index = vector_store.add(index, vectors[i:i + 64], metas[i:i + 64])
+        vector_store.save_index(index)
+        add_s = time.perf_counter() - started
+
+        total_s = chunk_s + (embed_s or 0) + add_s
+        result = {
+            "pages": args.pages,
+            "chunks": len(texts),
+            "pdf_mb": len(pdf) / 1e6,
+            "extract_chunk_pages_per_s": args.pages / chunk_s,
+            "extract_chunk_chunks_per_s": len(texts) / chunk_s,
+            "embed_chunks_per_s": len(texts) / embed_s if embed_s else None,
+            "index_add_chunks_per_s": len(texts) / add_s,
+            "ingest_chunks_per_s": len(texts) / total_s,
+            "ingest_pages_per_s": args.pages / total_s,
+        }
+        if args.ask and not args.no_embed:
+            result["ask"] = bench_ask(texts, args)
+        result.update(peak_rss_mb())
+    return result
+
+def bench_ask(texts, args):
+    from backend import answer_cache, main
+    answer_cache.ENABLED = False
+    rng = np.random.default_rng(2)
+    questions = [f"What does the document say about {' '.join(texts[i].split()[3:8])}?"
+                 for i in rng.integers(0, len(texts), args.ask)]
+    main.ask(q=questions[0], top_k=args.k)  # loads the generator
+    latencies, stages = [], {}
+    for q in questions:
+        started = time.perf_counter()
+        response = main.ask(q=q, top_k=args.k)
+        latencies.append(time.perf_counter() - started)
+        for stage, ms in response["timings"].items():
+            stages.setdefault(stage, []).append(ms)
+    return {"questions": len(questions), **percentiles(latencies),
+            **{f"{stage}_p50": float(np.percentile(ms, 50)) for stage, ms in stages.items()}}
+
+def exact_top_k(vectors, queries, k):
+    # Brute force in blocks, so 1M x 384 never needs a full score matrix per query batch
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, len(vectors), 100_000):
+        scores = queries @ vectors[start:start + 100_000].T
+        ids = np.arange(start, start + scores.shape[1])
+        scores = np.concatenate([best_scores, scores], axis=1)
+        ids = np.concatenate([best_ids, np.broadcast_to(ids, (len(queries), len(ids)))], axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(ids, top, axis=1)
+    return best_ids
+
+def bench_scale(n, args):
+    rng = np.random.default_rng(n)
+    vectors = reference_corpus(n, DIM)
+    queries = vectors[rng.choice(n, args.queries, replace=n < args.queries)] + 0.05 * rng.standard_normal((args.queries, DIM)).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        vector_store.set_index_dir(tmp)
+        started = time.perf_counter()
+        index = vector_store.load_index(DIM)
+        texts = []
+        for start in range(0, n, BATCH):
+            batch_texts = synthetic_texts(start, min(BATCH, n - start), rng)
+            # Query text for lexical and hybrid mode
+            texts.extend(batch_texts[:args.queries - len(texts)])
+            metas = [{"source": f"doc-{(start + i) // 1000}.pdf", "page": (start + i) % 1000 // 10 + 1, "text": t}
+                     for i, t in enumerate(batch_texts)]
+            index = vector_store.add(index, vectors[start:start + len(metas)], metas)
+        vector_store.save_index(index)
+        build_s = time.perf_counter() - started
+        disk_mb = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp)) / 1e6
+
+        truth = exact_top_k(vectors, queries, args.k)
+        result = {"chunks": n, "kind": args.kind, "build_seconds": build_s, "build_chunks_per_s": n / build_s,
+                  "disk_mb": disk_mb}
+        for mode in args.modes:
+            latencies, hits = [], 0
+            for qi, q in enumerate(queries):
+                question = texts[qi % len(texts)]
+                started = time.perf_counter()
+                found = retrieval.get_relevant_chunks(question, top_k=args.k, mode=mode, query_embedding=q)
+                latencies.append(time.perf_counter() - started)
+                hits += len({m["chunk_id"] for _, m in found} & set(truth[qi].tolist()))
+            result[mode] = percentiles(latencies)
+            if mode == "dense":
+                result[mode][f"recall@{args.k}"] = hits / (len(queries) * args.k)
+        result.update(peak_rss_mb())
+    return result
+
+def flatten(results, prefix=""):
+    out = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[name] = value
+    return out
+
+def compare(current, baseline, tolerance):
+    # Relative change of every shared metric; returns the ones worse than tolerance
+    now, before = flatten(current["results"]), flatten(baseline["results"])
+    regressions = []
+    for name in sorted(now.keys() & before.keys()):
+        old, new = before[name], now[name]
+        if not old:
+            continue
+        change = (new - old) / abs(old)
+        better_high = any(part in name.rsplit(".", 1)[-1] for part in HIGHER_IS_BETTER)
+        worse = -change if better_high else change
+        flag = ""
+        if worse > tolerance and not name.endswith(("chunks", "pages", "questions")):
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:60s} {old:14.4f} -> {new:14.4f} ({change:+.1%}){flag}")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="*", default=[1000, 10_000, 100_000])
+    parser.add_argument("--pages", type=int, default=100, help="Pages of the synthetic PDF; 0 skips ingestion")
+    parser.add_argument("--workers", type=int, default=ingestion.INGEST_PROCESSES)
+    parser.add_argument("--no-embed", action="store_true", help="Random vectors instead of the embedding model")
+    parser.add_argument("--ask", type=int, default=0, help="Questions sent through /ask after ingestion")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--kind", default=vector_store.INDEX_TYPE, choices=sorted(vector_store.INDEX_SPECS))
+    parser.add_argument("--modes", nargs="+", default=["dense", "hybrid"], choices=retrieval.MODES)
+    parser.add_argument("--out")
+    parser.add_argument("--compare", help="Previous --out file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+    # Trained types start flat and are trained once FLUX_TRAIN_MIN_VECTORS rows exist, as in the server
+    vector_store.INDEX_TYPE = args.kind
+
+    results = {}
+    if args.pages:
+        results["ingest"] = bench_ingest(args)
+        print("ingest", json.dumps(results["ingest"], indent=2))
+    results["scales"] = {}
+    for n in sorted(args.scales):
+        results["scales"][str(n)] = bench_scale(n, args)
+        print(n, json.dumps(results["scales"][str(n)], indent=2))
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import json
+import time
 import streamlit as st
 import requests
 
@@ -7,19 +9,53 @@ st.title("Flux")
 
 uploaded = st.file_uploader("Upload PDF", type="pdf")
 if uploaded:
-    resp = requests.post(f"{BACKEND}/upload", files={"file": uploaded})
-    st.write(resp.json())
+    # Streamlit reruns the script on every interaction; submit each file once
+    if st.session_state.get("uploaded_file_id") != uploaded.file_id:
+        resp = requests.post(f"{BACKEND}/upload", files={"file": uploaded})
+        st.session_state["uploaded_file_id"] = uploaded.file_id
+        st.session_state["job_id"] = resp.json().get("job_id")
+
+    job_id = st.session_state.get("job_id")
+    if job_id:
+        status = st.empty()
+        while True:
+            job = requests.get(f"{BACKEND}/jobs/{job_id}").json()
+            status.write(
+                f"{job.get('status')}: {job.get('pages_parsed', 0)} pages parsed, "
+                f"{job.get('chunks_embedded', 0)} chunks embedded, "
+                f"{job.get('vectors_added', 0)} vectors added"
+            )
+            if job.get("status") not in ("queued", "running"):
+                if job.get("error"):
+                    st.error(job["error"])
+                break
+            time.sleep(1)
+
+def sse_events(resp):
+    event = None
+    for line in resp.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[len("data: "):])
 
 q = st.text_input("Ask a question")
 if st.button("Ask") and q:
-    r = requests.get(f"{BACKEND}/ask", params={"q": q})
-
-    try:
-        data = r.json()
+    with requests.get(f"{BACKEND}/ask/stream", params={"q": q}, stream=True) as r:
         st.subheader("Answer")
-        st.write(data.get("answer", "No answer key in response"))
+        answer_box = st.empty()
         st.subheader("Sources")
-        st.write(data.get("sources", "No sources key in response"))
-    except requests.exceptions.JSONDecodeError:
-        st.error("Failed to parse JSON from backend response.")
+        sources_box = st.empty()
+        answer = ""
 
+        try:
+            for event, data in sse_events(r):
+                if event == "sources":
+                    sources_box.write(data)
+                elif event == "token":
+                    answer += data
+                    answer_box.markdown(answer + "▌")
+                elif event == "done":
+                    answer_box.markdown(data.get("answer", answer))
+        except (requests.exceptions.RequestException, json.JSONDecodeError):
+            st.error("Failed to read the streamed answer from the backend.")
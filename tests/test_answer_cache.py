@@ -0,0 +1,52 @@
+import numpy as np
+
+from backend import answer_cache
+from backend.answer_cache import AnswerCache
+
+PARAMS = (3, None, None, None, ())
+
+
+def test_exact_tier_ignores_case_and_punctuation():
+    cache = AnswerCache(max_entries=4)
+    cache.put("When does the library open?", None, PARAMS, 1, {"answer": "9 am"})
+    assert cache.get("  when does the LIBRARY open ", PARAMS, 1) == {"answer": "9 am"}
+    assert cache.get("When does the library open?", (5, None, None, None, ()), 1) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_semantic_tier_matches_close_embeddings_only():
+    cache = AnswerCache(max_entries=4, threshold=0.9)
+    cache.put("library hours", np.array([1.0, 0.0, 0.0]), PARAMS, 1, {"answer": "9 am"})
+    assert cache.get_similar(np.array([0.99, 0.1, 0.0]), PARAMS, 1) == {"answer": "9 am"}
+    assert cache.get_similar(np.array([0.0, 1.0, 0.0]), PARAMS, 1) is None
+    assert cache.get_similar(np.array([1.0, 0.0, 0.0]), (1, None, None, None, ()), 1) is None
+    stats = cache.stats()
+    assert (stats["semantic_hits"], stats["misses"]) == (1, 2)
+
+
+def test_generation_change_drops_every_entry():
+    cache = AnswerCache(max_entries=4)
+    cache.put("q", np.ones(3), PARAMS, 1, {"answer": "a"})
+    assert cache.get("q", PARAMS, 2) is None
+    assert cache.get_similar(np.ones(3), PARAMS, 2) is None
+    assert cache.stats()["invalidations"] == 1
+    # Answers generated against the old index are not stored
+    cache.put("q", np.ones(3), PARAMS, 1, {"answer": "a"})
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_and_ttl_eviction(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    cache = AnswerCache(max_entries=2, ttl_seconds=10)
+    for i, q in enumerate(["a", "b"]):
+        cache.put(q, np.eye(3)[i], PARAMS, 1, {"answer": q})
+    cache.get("a", PARAMS, 1)
+    cache.put("c", np.eye(3)[2], PARAMS, 1, {"answer": "c"})
+    assert cache.get("b", PARAMS, 1) is None
+    assert cache.get_similar(np.eye(3)[2], PARAMS, 1) == {"answer": "c"}
+    assert cache.stats()["evictions"] == 1
+
+    now[0] += 11
+    assert cache.get("a", PARAMS, 1) is None
+    assert cache.get_similar(np.eye(3)[2], PARAMS, 1) is None
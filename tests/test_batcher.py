@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from backend.batcher import MicroBatcher
+
+
+def test_concurrent_submits_are_batched():
+    calls = []
+
+    def double(items):
+        calls.append(list(items))
+        return [2 * i for i in items]
+
+    batcher = MicroBatcher(double, name="test", max_batch_size=8, max_wait_ms=50)
+    results = {}
+    start = threading.Barrier(8)
+
+    def worker(i):
+        start.wait()
+        results[i] = batcher.submit(i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == {i: 2 * i for i in range(8)}
+    assert len(calls) < 8
+    stats = batcher.stats()
+    assert stats["requests"] == 8
+    assert sum(size * n for size, n in stats["batch_size_histogram"].items()) == 8
+    assert stats["max_queue_delay_ms"] >= 0
+
+
+def test_batch_size_is_capped():
+    batcher = MicroBatcher(lambda items: items, name="test", max_batch_size=2, max_wait_ms=20)
+    threads = [threading.Thread(target=batcher.submit, args=(i,)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert max(batcher.stats()["batch_size_histogram"]) <= 2
+
+
+def test_errors_reach_every_caller():
+    def broken(items):
+        raise ValueError("model exploded")
+
+    batcher = MicroBatcher(broken, name="test", max_wait_ms=0)
+    with pytest.raises(ValueError, match="model exploded"):
+        batcher.submit("q")
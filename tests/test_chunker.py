@@ -1,16 +1,24 @@
 import os
 import sys
-from unittest.mock import patch
-from backend.chunker import split_text_into_chunks
+import pytest
+from backend import chunker
+from backend.chunker import split_text_into_chunks, chunk_text, chunk_spans
 
 # # Add the project root to sys.path
 # sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # Word/punctuation tokens: deterministic, and no tokenizer download
+    monkeypatch.setattr(chunker, "_tokenizer", None)
+    monkeypatch.setattr(chunker, "_tokenizer_failed", True)
+
+
 def test_split_text_into_chunks_basic():
     text = "This is sentence one. This is sentence two. This is sentence three."
     chunks = split_text_into_chunks(text, chunk_size=40, overlap=10)
-    
+
     assert isinstance(chunks, list)
     assert all(isinstance(c, str) for c in chunks)
     assert len(chunks) >= 1
@@ -20,15 +28,63 @@ def test_split_text_into_chunks_basic():
 def test_split_text_into_chunks_small_text():
     text = "Short sentence."
     chunks = split_text_into_chunks(text, chunk_size=500, overlap=100)
-    
+
     assert chunks == [text]
 
 
-@patch("nltk.sent_tokenize", return_value=["Sentence one.", "Sentence two.", "Sentence three."])
-def test_split_text_into_chunks_overlap(mock_tokenize):
-    text = "dummy"
-    chunks = split_text_into_chunks(text, chunk_size=20, overlap=5)
-    
-    assert len(chunks) >= 2
-    assert all("Sentence" in chunk for chunk in chunks)
+def test_split_text_into_chunks_overlap():
+    # 3 tokens per sentence
+    text = "Sentence one. Sentence two. Sentence three. Sentence four."
+    chunks = split_text_into_chunks(text, chunk_size=6, overlap=3)
+
+    assert chunks == ["Sentence one. Sentence two.", "Sentence two. Sentence three.",
+                      "Sentence three. Sentence four."]
+
+
+def test_chunks_fit_the_token_budget():
+    text = " ".join(f"Sentence number {i} has {'some ' * (i % 7)}words." for i in range(200))
+    # Sentences are at most 12 tokens, so one always fits in the overlap
+    starts, ends, counts = chunk_spans(text, max_tokens=30, overlap=12)
+
+    assert counts.max() <= 30
+    for s, e, n in zip(starts, ends, counts):
+        assert len(chunker._WORD_RE.findall(text[s:e])) == n
+    # Every sentence is covered, and consecutive chunks overlap
+    assert starts[0] == 0 and ends[-1] == len(text)
+    assert all(starts[1:] < ends[:-1])
+    assert all(starts[1:] > starts[:-1])
+    assert all(ends[1:] > ends[:-1])
+
+
+def test_overlap_shrinks_when_the_next_sentence_does_not_fit():
+    def words(name, n):
+        return " ".join([name] * (n - 1)) + "."
+
+    alpha, beta, gamma, delta = words("alpha", 20), words("beta", 8), words("gamma", 25), words("delta", 5)
+    chunks = split_text_into_chunks(" ".join([alpha, beta, gamma, delta]), chunk_size=30, overlap=10)
+
+    # beta + gamma is 33 tokens: gamma starts a chunk without overlap rather
+    # than leaving a [beta] chunk that repeats the end of the first one
+    assert chunks == [f"{alpha} {beta}", f"{gamma} {delta}"]
+
+
+def test_chunks_carry_character_spans():
+    text = "  First sentence here.\nSecond one follows.   Third and last.  "
+    chunks = chunk_text(text, max_tokens=5, overlap=0)
+
+    assert [c for c, _, _ in chunks] == ["First sentence here.", "Second one follows.", "Third and last."]
+    assert all(text[s:e] == c for c, s, e in chunks)
+
+
+def test_long_sentences_are_split_at_token_boundaries():
+    text = " ".join(f"w{i}" for i in range(25)) + ". Short one."
+    chunks = chunk_text(text, max_tokens=10, overlap=0)
+
+    assert [c for c, _, _ in chunks] == [" ".join(f"w{i}" for i in range(0, 10)), " ".join(f"w{i}" for i in range(10, 20)),
+                                         "w20 w21 w22 w23 w24. Short one."]
+    assert all(text[s:e] == c for c, s, e in chunks)
+
 
+def test_empty_text_has_no_chunks():
+    assert split_text_into_chunks("   ") == []
+    assert chunk_text("") == []
@@ -0,0 +1,56 @@
+import pytest
+
+from backend import context, llm
+
+
+class WordTokenizer:
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, texts, add_special_tokens=True):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        self.texts.extend(texts)
+        ids = [list(range(len(t.split()))) for t in texts]
+        return {"input_ids": ids[0] if single else ids}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(f"w{i}" for i in ids)
+
+
+@pytest.fixture
+def tok(monkeypatch):
+    tok = WordTokenizer()
+    monkeypatch.setattr(llm, "tokenizer", lambda: tok)
+    return tok
+
+
+def _hit(score, words, **meta):
+    return score, {"text": " ".join(["word"] * words), "source": "a.pdf", "page": 1, **meta}
+
+
+def test_pack_keeps_best_chunks_that_fit_and_the_whole_question(tok):
+    question = "when does the library open on weekdays?"
+    hits = [_hit(0.9, 20), _hit(0.8, 200), _hit(0.7, 30), _hit(0.6, 40)]
+    text, used, report = context.pack_context(question, hits, budget=120)
+
+    assert used == [hits[0], hits[2]]
+    assert report["chunks_used"] == 2 and report["chunks_dropped"] == 2
+    assert report["tokens"] <= 120
+    assert report["tokens"] == len(llm.build_prompt(question, text).split()) + 1
+
+
+def test_ingest_counts_are_reused(tok):
+    metas = [{"text": "a b c", "source": "a.pdf", "page": 1}, {"text": "d e", "source": "a.pdf", "page": 2}]
+    context.annotate_tokens(metas)
+    assert [m["tokens"] for m in metas] == [7, 6]
+
+    tok.texts.clear()
+    context.pack_context("q?", [(1.0, metas[0]), (0.5, metas[1])], budget=100)
+    assert not any(context.format_chunk(m) in tok.texts for m in metas)
+
+
+def test_an_oversized_best_chunk_is_truncated_to_fit(tok):
+    text, used, report = context.pack_context("q?", [_hit(0.9, 500)], budget=60)
+    assert len(used) == 1
+    assert 0 < report["tokens"] <= 60
@@ -0,0 +1,49 @@
+import numpy as np
+
+from backend.documents import DocumentTable
+
+
+def _table():
+    table = DocumentTable()
+    metas = [{"source": s} for s in ["a.pdf", "b.pdf", "a.pdf"]]
+    table.assign_chunk_ids(metas)
+    table.add(0, metas)
+    return table
+
+
+def test_rows_by_source_and_chunk_id():
+    table = _table()
+    assert table.rows_for_source("a.pdf").tolist() == [0, 2]
+    assert table.rows_for_source("missing.pdf").tolist() == []
+    assert table.rows_for_chunks([2, 7, 0]).tolist() == [2, 0]
+
+
+def test_tombstones_shape_the_search_mask():
+    table = _table()
+    assert table.allowed() is None
+    table.tombstone(table.rows_for_source("a.pdf"))
+    assert table.allowed().tolist() == [False, True, False]
+    assert table.allowed(np.array([True, False, True])).tolist() == [False, False, False]
+    assert table.source_counts() == {"b.pdf": 1}
+
+
+def test_load_drops_rows_past_the_metadata(tmp_path):
+    path = str(tmp_path / "documents.npz")
+    _table().save(path)
+    table = DocumentTable.load(path, n_rows=2)
+    assert table.chunk_ids.tolist() == [0, 1]
+    assert table.next_chunk_id == 3
+
+
+def test_select_rows_combines_filters():
+    table = DocumentTable()
+    metas = [{"source": "a.pdf", "page": p, "uploaded_at": 100.0 + p} for p in range(1, 6)]
+    metas += [{"source": "b.pdf", "page": 3, "uploaded_at": 500.0}]
+    table.add(0, metas)
+
+    assert table.select_rows() is None
+    assert table.select_rows(source="a.pdf", page_from=2, page_to=4).tolist() == [1, 2, 3]
+    assert table.select_rows(page_from=3, page_to=3).tolist() == [2, 5]
+    assert table.select_rows(uploaded_after=104.0).tolist() == [4, 5]
+    table.tombstone([5])
+    assert table.select_rows(page_from=3, page_to=3).tolist() == [2]
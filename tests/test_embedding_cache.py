@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+import backend.embeddings
+from backend.embedding_cache import EmbeddingCache, text_key
+
+
+def test_cache_roundtrip_and_persistence(tmp_path):
+    cache = EmbeddingCache("some/model", cache_dir=str(tmp_path), lru_size=2)
+    keys = [text_key(t) for t in ["a", "b", "c"]]
+    vecs = np.arange(12, dtype="float32").reshape(3, 4)
+
+    assert cache.get_many(keys) == [None, None, None]
+    cache.put_many(keys, vecs)
+    got = cache.get_many(keys)
+    assert all(np.array_equal(g, v) for g, v in zip(got, vecs))
+
+    # A fresh instance serves the same vectors from disk
+    reopened = EmbeddingCache("some/model", cache_dir=str(tmp_path))
+    got = reopened.get_many([keys[2], keys[0]])
+    assert np.array_equal(got[0], vecs[2])
+    assert np.array_equal(got[1], vecs[0])
+    assert reopened.stats()["disk_hits"] == 2
+
+
+def test_text_key_normalizes_whitespace():
+    assert text_key("hello   world\n") == text_key("hello world")
+    assert text_key("hello world") != text_key("hello there")
+
+
+def test_lru_is_bounded(tmp_path):
+    cache = EmbeddingCache("m", cache_dir=str(tmp_path), lru_size=2)
+    keys = [text_key(str(i)) for i in range(5)]
+    cache.put_many(keys, np.ones((5, 3), dtype="float32"))
+    assert cache.stats()["memory_entries"] == 2
+    assert cache.stats()["entries"] == 5
+
+
+def test_embed_texts_encodes_only_misses(tmp_path, monkeypatch):
+    encoded = []
+
+    def fake_encode(texts):
+        encoded.append(list(texts))
+        return np.array([[len(t), 1.0] for t in texts], dtype="float32")
+
+    monkeypatch.setattr(backend.embeddings, "_encode", fake_encode)
+    monkeypatch.setattr(backend.embeddings, "CACHE_ENABLED", True)
+    monkeypatch.setattr(backend.embeddings, "_cache", EmbeddingCache("m", cache_dir=str(tmp_path)))
+
+    first = backend.embeddings.embed_texts(["one", "three", "one"])
+    second = backend.embeddings.embed_texts(["three", "fifteen"])
+
+    assert encoded == [["one", "three"], ["fifteen"]]
+    assert first.shape == (3, 2)
+    assert np.array_equal(second[0], first[1])
+    stats = backend.embeddings.cache().stats()
+    assert stats["misses"] == 4
+    assert stats["hits"] == 1
+
+
+def test_processes_sharing_the_disk_tier_stay_aligned(tmp_path):
+    first = EmbeddingCache("m", cache_dir=str(tmp_path))
+    second = EmbeddingCache("m", cache_dir=str(tmp_path))
+    keys = [text_key(str(i)) for i in range(6)]
+    vecs = np.arange(24, dtype="float32").reshape(6, 4)
+
+    first.put_many(keys[:2], vecs[:2])
+    second.put_many(keys[1:4], vecs[1:4])
+    # A writer that died between the vectors and the keys leaves an unkeyed row
+    with open(first.vectors_path, "ab") as f:
+        f.write(np.full(4, -1, dtype="float32").tobytes())
+    first.put_many(keys[4:], vecs[4:])
+
+    assert second.get_many(keys[4:5])[0].tolist() == vecs[4].tolist()
+    reopened = EmbeddingCache("m", cache_dir=str(tmp_path))
+    got = reopened.get_many(keys)
+    assert all(np.array_equal(g, v) for g, v in zip(got, vecs))
+    assert reopened.stats()["entries"] == 6
+    assert os.path.getsize(reopened.vectors_path) == 6 * 4 * 4
@@ -0,0 +1,27 @@
+import pytest
+import torch
+
+from backend import inference
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match="Unknown inference backend"):
+        inference.check_backend("tensorrt")
+
+
+def test_backend_for_reads_env(monkeypatch):
+    monkeypatch.setenv("FLUX_EMBED_BACKEND", "int8")
+    assert inference.backend_for("FLUX_EMBED_BACKEND") == "int8"
+
+
+def test_quantize_int8_keeps_outputs_close():
+    torch.manual_seed(0)
+    module = torch.nn.Sequential(torch.nn.Linear(64, 64), torch.nn.ReLU(), torch.nn.Linear(64, 8))
+    x = torch.randn(16, 64)
+    expected = module(x)
+
+    quantized = inference.quantize_int8(module)
+
+    assert "quantized" in type(quantized[0]).__module__
+    cosine = torch.nn.functional.cosine_similarity(quantized(x), expected, dim=1)
+    assert cosine.min() > 0.98
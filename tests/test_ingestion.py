@@ -25,7 +25,7 @@ def test_extract_pages_yields_text():
 
 
 @patch("backend.ingestion.extract_pages", return_value=[(1, "First page text."), (2, "Second page text.")])
-@patch("backend.ingestion.split_text_into_chunks", side_effect=lambda text, **kwargs: [text.upper()])
+@patch("backend.ingestion.chunk_text", side_effect=lambda text, **kwargs: [(text.upper(), 0, len(text))])
 def test_process_pdf_bytes_calls_split_and_returns_chunks(mock_split, mock_extract):
     pdf_bytes = b"dummy"
     filename = "test.pdf"
@@ -39,8 +39,79 @@ def test_process_pdf_bytes_calls_split_and_returns_chunks(mock_split, mock_extra
         assert chunk_text.isupper()
         assert metadata["source"] == filename
         assert "page" in metadata
+        assert (metadata["char_start"], metadata["char_end"]) == (0, len(chunk_text))
 
     mock_extract.assert_called_once_with(pdf_bytes=pdf_bytes)
     assert mock_split.call_count == 2
 
 
+
+
+def test_page_ranges_cover_every_page_once():
+    from backend.ingestion import page_ranges
+
+    ranges = page_ranges(1234, workers=4)
+    pages = [p for start, stop in ranges for p in range(start, stop)]
+
+    assert pages == list(range(1234))
+    assert len(ranges) >= 4
+
+
+def _punkt_available():
+    import nltk
+    try:
+        nltk.data.find("tokenizers/punkt_tab")
+        return True
+    except LookupError:
+        return False
+
+
+def _make_pdf(pages):
+    import fitz
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_text((72, 72), text)
+    return doc.tobytes()
+
+
+def test_parallel_chunking_matches_serial():
+    import pytest
+    if not _punkt_available():
+        pytest.skip("NLTK punkt data not installed")
+
+    pages = [f"Page {i} has its own sentence. Shared footer text." for i in range(12)]
+    pages[5] = pages[4]  # cross-page duplicate must still be dropped
+    pdf_bytes = _make_pdf(pages)
+
+    serial = process_pdf_bytes(pdf_bytes, "doc.pdf", workers=1)
+    parallel = process_pdf_bytes(pdf_bytes, "doc.pdf", workers=3)
+
+    assert parallel == serial
+    assert [m["page"] for _, m in parallel] == sorted(m["page"] for _, m in parallel)
+    assert 6 not in [m["page"] for _, m in parallel]
+
+
+@patch("backend.ingestion.extract_pages")
+@patch("backend.ingestion.chunk_text", side_effect=lambda text, **kwargs: [(text, 0, len(text))])
+def test_iter_chunks_is_lazy(mock_split, mock_extract):
+    from backend.ingestion import iter_chunks, iter_batches
+
+    pages_read = []
+
+    def pages(pdf_bytes):
+        for i in range(1, 101):
+            pages_read.append(i)
+            yield i, f"Text of page {i}."
+
+    mock_extract.side_effect = pages
+
+    batches = iter_batches(iter_chunks(b"dummy", "big.pdf"), batch_size=4)
+    first = next(batches)
+
+    assert [m["page"] for _, m in first] == [1, 2, 3, 4]
+    assert len(pages_read) == 4
+
+    rest = list(batches)
+    assert sum(len(b) for b in rest) == 96
+    assert all(len(b) <= 4 for b in rest)
@@ -0,0 +1,41 @@
+import time
+
+from backend import jobs
+
+
+def _wait(job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = jobs.get(job_id)
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_job_reports_progress():
+    def work(n, progress=None):
+        progress(pages_parsed=n)
+        progress(chunks_embedded=2 * n, vectors_added=2 * n)
+
+    job_id = jobs.submit(work, 3, filename="a.pdf")
+    job = _wait(job_id)
+
+    assert job["status"] == "completed"
+    assert job["filename"] == "a.pdf"
+    assert (job["pages_parsed"], job["chunks_embedded"], job["vectors_added"]) == (3, 6, 6)
+    assert job["error"] is None
+
+
+def test_failed_job_records_error():
+    def work(progress=None):
+        raise RuntimeError("broken pdf")
+
+    job = _wait(jobs.submit(work))
+
+    assert job["status"] == "failed"
+    assert job["error"] == "broken pdf"
+
+
+def test_unknown_job():
+    assert jobs.get("missing") is None
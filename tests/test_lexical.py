@@ -0,0 +1,58 @@
+import numpy as np
+
+from backend.lexical import BM25Index, tokenize
+
+
+def test_tokenize_keeps_codes_together():
+    tokens = tokenize("See CS-101 in room B.204")
+    assert "cs-101" in tokens
+    assert "cs101" in tokens
+    assert "b.204" in tokens
+    assert "204" in tokens
+
+
+def _index():
+    index = BM25Index()
+    index.add(0, [
+        "The syllabus for CS-101 lists weekly readings.",
+        "Part number XK-2291 replaces the old filter.",
+        "Weekly readings are posted on the course page.",
+    ])
+    return index
+
+
+def test_search_ranks_exact_codes_first():
+    scores, ids = _index().search("xk-2291", top_k=3)
+    assert ids.tolist() == [1]
+    assert scores[0] > 0
+
+    scores, ids = _index().search("weekly readings cs101", top_k=3)
+    assert ids.tolist()[0] == 0
+    assert set(ids.tolist()) == {0, 2}
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_unknown_terms_return_nothing():
+    scores, ids = _index().search("quantum chromodynamics")
+    assert len(ids) == 0
+
+
+def test_incremental_add_and_gap_filling():
+    index = _index()
+    index.add(5, ["Late submissions need approval."])
+    assert index.n_docs == 6
+    _, ids = index.search("late submissions")
+    assert ids.tolist() == [5]
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    index = _index()
+    path = str(tmp_path / "lexical.npz")
+    index.save(path)
+    loaded = BM25Index.load(path)
+
+    assert loaded.stats() == index.stats()
+    for query in ["weekly readings", "xk-2291 filter"]:
+        a, b = index.search(query), loaded.search(query)
+        assert np.allclose(a[0], b[0])
+        assert a[1].tolist() == b[1].tolist()
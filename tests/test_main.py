@@ -0,0 +1,247 @@
+import types
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import pytest
+
+import backend.main
+from backend import llm
+
+
+@pytest.fixture(autouse=True)
+def word_token_counts(monkeypatch):
+    # The FLAN tokenizer is not needed to test the endpoints
+    monkeypatch.setattr(backend.context, "count_tokens", lambda texts: [len(t.split()) for t in texts])
+
+
+def test_import_does_not_load_models():
+    assert not llm.is_loaded()
+
+
+def test_ready_reports_loaded_models():
+    client = TestClient(backend.main.app)
+    resp = client.get("/ready")
+
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["ready"] is True
+    assert set(body["loaded"]) == {"punkt", "embeddings", "llm"}
+
+
+def test_ready_waits_for_warmup(monkeypatch):
+    monkeypatch.setattr(backend.main, "WARMUP", True)
+    monkeypatch.setattr(backend.main, "_warmup_done", backend.main.threading.Event())
+    client = TestClient(backend.main.app)
+
+    assert client.get("/ready").status_code == 503
+    backend.main._warmup_done.set()
+    assert client.get("/ready").status_code == 200
+
+
+def test_unknown_job_is_404():
+    client = TestClient(backend.main.app)
+    assert client.get("/jobs/does-not-exist").status_code == 404
+
+
+def test_ask_stream_sends_sources_then_tokens(monkeypatch):
+    hits = [(0.9, {"text": "Flux ingests PDFs.", "source": "a.pdf", "page": 1})]
+    monkeypatch.setattr(backend.main, "get_relevant_chunks", lambda q, **kwargs: hits)
+    monkeypatch.setattr(backend.main, "stream_answer", lambda q, context: iter(["It ", "ingests PDFs."]))
+    monkeypatch.setattr(backend.main.answer_cache, "ENABLED", False)
+
+    client = TestClient(backend.main.app)
+    body = client.get("/ask/stream", params={"q": "what does flux do?"}).text
+    events = [block.split("\n")[0] for block in body.strip().split("\n\n")]
+
+    assert events == ["event: sources", "event: token", "event: token", "event: done"]
+    assert "Based on the provided materials: It ingests PDFs." in body
+
+
+class _FakeTokenizer:
+    pad_token_id = 0
+    eos_token_id = 1
+
+    def __call__(self, text, **kwargs):
+        return {"input_ids": [[2, 3]], "attention_mask": [[1, 1]]}
+
+
+@pytest.mark.parametrize("generate", ["raises", "stalls"])
+def test_ask_stream_ends_when_generation_fails(monkeypatch, generate):
+    import time
+    hits = [(0.9, {"text": "Flux ingests PDFs.", "source": "a.pdf", "page": 1})]
+    monkeypatch.setattr(backend.main, "get_relevant_chunks", lambda q, **kwargs: hits)
+    monkeypatch.setattr(backend.main.answer_cache, "ENABLED", False)
+
+    def fake_generate(**kwargs):
+        if generate == "raises":
+            raise RuntimeError("CUDA out of memory")
+        time.sleep(5)
+
+    monkeypatch.setattr(llm, "STREAM_TIMEOUT", 0.2)
+    monkeypatch.setattr(llm, "tokenizer", lambda: _FakeTokenizer())
+    monkeypatch.setattr(llm, "model", lambda: types.SimpleNamespace(generate=fake_generate))
+
+    client = TestClient(backend.main.app)
+    started = time.perf_counter()
+    body = client.get("/ask/stream", params={"q": "what does flux do?"}).text
+    events = [block.split("\n")[0] for block in body.strip().split("\n\n")]
+
+    assert time.perf_counter() - started < 4
+    assert events == ["event: sources", "event: error", "event: done"]
+    assert ("out of memory" if generate == "raises" else "no text for 0.2s") in body
+    assert llm.NO_ANSWER in body
+
+
+def test_reupload_replaces_only_changed_chunks(tmp_path, monkeypatch):
+    import numpy as np
+    from backend import vector_store
+
+    def fake_chunks(pages):
+        def iter_chunks(file_bytes, filename, progress=None):
+            for page, text in pages.items():
+                yield text, {"source": filename, "page": page, "text": text}
+        return iter_chunks
+
+    embedded = []
+    def fake_embed(texts):
+        embedded.extend(texts)
+        return np.random.default_rng(len(embedded)).standard_normal((len(texts), 384)).astype("float32")
+
+    vector_store.set_index_dir(str(tmp_path))
+    monkeypatch.setattr(backend.main, "embed_texts", fake_embed)
+    monkeypatch.setattr(backend.main, "COMPACT_RATIO", 2.0)
+    try:
+        v1 = {1: "Admissions open in March for all programmes.", 2: "Tuition is due before the term starts.",
+              3: "Scholarships are awarded in June."}
+        monkeypatch.setattr(backend.main, "iter_chunks", fake_chunks(v1))
+        backend.main.handle_ingest(b"", "guide.pdf")
+
+        v2 = {1: v1[1], 2: "Tuition is due within two weeks of enrolment.", 4: "Housing applications close in May."}
+        monkeypatch.setattr(backend.main, "iter_chunks", fake_chunks(v2))
+        embedded.clear()
+        progress = {}
+        backend.main.handle_ingest(b"", "guide.pdf", progress=lambda **fields: progress.update(fields))
+
+        assert embedded == [v2[2], v2[4]]
+        assert progress["chunks_unchanged"] == 1
+        assert progress["chunks_removed"] == 2
+        client = TestClient(backend.main.app)
+        assert client.get("/documents").json() == [{"source": "guide.pdf", "chunks": 3}]
+
+        assert client.delete("/documents/guide.pdf").json()["chunks_deleted"] == 3
+        assert client.delete("/documents/guide.pdf").status_code == 404
+        backend.main.handle_compact()
+        assert vector_store.load_index(384).ntotal == 0
+    finally:
+        vector_store.set_index_dir("data/index")
+
+
+def test_boilerplate_is_kept_until_enough_sources_hold_it(tmp_path, monkeypatch):
+    from backend import vector_store, near_dup
+    disclaimer = ("This document is provided for informational purposes only and does not constitute an offer "
+                  "or contract. The university may change any course or fee described here without notice.")
+
+    def iter_chunks(file_bytes, filename, progress=None):
+        yield disclaimer, {"source": filename, "page": 1, "text": disclaimer}
+        yield f"{filename} has its own content.", {"source": filename, "page": 2, "text": f"{filename} has its own content."}
+
+    vector_store.set_index_dir(str(tmp_path))
+    monkeypatch.setattr(backend.main, "iter_chunks", iter_chunks)
+    monkeypatch.setattr(backend.main, "embed_texts",
+                        lambda texts: np.random.default_rng(0).standard_normal((len(texts), 384)).astype("float32"))
+    monkeypatch.setattr(near_dup, "MIN_SOURCES", 2)
+    monkeypatch.setattr(backend.main, "COMPACT_RATIO", 2.0)
+    try:
+        for name in ("a.pdf", "b.pdf", "c.pdf"):
+            backend.main.handle_ingest(b"", name)
+
+        # b.pdf keeps its copy (only a.pdf had it); c.pdf's is held by two sources already
+        client = TestClient(backend.main.app)
+        counts = {d["source"]: d["chunks"] for d in client.get("/documents").json()}
+        assert counts == {"a.pdf": 2, "b.pdf": 2, "c.pdf": 1}
+
+        # Deleting a.pdf leaves b.pdf's copy behind for its own source filter
+        client.delete("/documents/a.pdf")
+        rows = vector_store.documents().select_rows(source="b.pdf")
+        assert disclaimer in [m["text"] for m in vector_store.fetch_metadata(rows)]
+    finally:
+        vector_store.set_index_dir("data/index")
+
+
+def test_ask_passes_filters_to_retrieval(monkeypatch):
+    seen = {}
+    def fake_chunks(q, **kwargs):
+        seen.update(kwargs)
+        return []
+    monkeypatch.setattr(backend.main, "get_relevant_chunks", fake_chunks)
+    monkeypatch.setattr(backend.main, "generate_answer", lambda q, context: "")
+    monkeypatch.setattr(backend.main.answer_cache, "ENABLED", False)
+
+    client = TestClient(backend.main.app)
+    params = {"q": "fees?", "source": "handbook.pdf", "page_from": 2, "uploaded_after": "2024-05-01T00:00:00Z"}
+    assert client.get("/ask", params=params).status_code == 200
+    assert seen["filters"] == {"source": "handbook.pdf", "page_from": 2, "uploaded_after": 1714521600.0}
+
+
+def test_ask_reuses_answers_for_paraphrases(monkeypatch):
+    from backend.answer_cache import AnswerCache
+    vectors = {"when does the library open?": [1.0, 0.0], "when does the library open today?": [0.99, 0.05],
+               "who runs the lab?": [0.0, 1.0]}
+    monkeypatch.setattr(backend.main.answer_cache, "cache", AnswerCache(max_entries=8, threshold=0.95))
+    monkeypatch.setattr(backend.main.query_batcher, "submit", lambda q: np.array(vectors[q.lower()]))
+    monkeypatch.setattr(backend.main, "generation", lambda: 1)
+    monkeypatch.setattr(backend.main, "get_relevant_chunks", lambda q, **kwargs: [(0.9, {"text": q, "source": "a.pdf"})])
+    answers = []
+    def fake_generate(q, context):
+        answers.append(q)
+        return f"answer {len(answers)}"
+    monkeypatch.setattr(backend.main, "generate_answer", fake_generate)
+
+    client = TestClient(backend.main.app)
+    first = client.get("/ask", params={"q": "When does the library open?"}).json()
+    assert first["debug"]["cache"] == "miss"
+    assert client.get("/ask", params={"q": "when does the library open"}).json()["debug"]["cache"] == "exact"
+    paraphrase = client.get("/ask", params={"q": "When does the library open today?"}).json()
+    assert paraphrase["debug"]["cache"] == "semantic"
+    assert paraphrase["answer"] == first["answer"]
+    assert client.get("/ask", params={"q": "Who runs the lab?"}).json()["answer"] == "answer 2"
+    assert client.get("/ask", params={"q": "Who runs the lab?", "top_k": 5}).json()["answer"] == "answer 3"
+    assert client.get("/cache/stats").json()["answers"]["hits"] == 1
+
+
+def test_ask_reports_retrieval_and_rerank_timings(monkeypatch):
+    from backend import reranker
+    seen = {}
+    def fake_chunks(q, top_k, **kwargs):
+        seen["top_k"] = top_k
+        return [(0.9 - i / 10, {"text": f"chunk {i}"}) for i in range(top_k)]
+    monkeypatch.setattr(backend.main, "get_relevant_chunks", fake_chunks)
+    monkeypatch.setattr(backend.main, "generate_answer", lambda q, context: "answer")
+    monkeypatch.setattr(backend.main.answer_cache, "ENABLED", False)
+    monkeypatch.setattr(reranker, "ENABLED", True)
+    monkeypatch.setattr(reranker, "CANDIDATES", 10)
+    monkeypatch.setattr(reranker, "rerank", lambda q, hits, top_k: (hits[::-1][:top_k], {"reranked": True}))
+
+    body = TestClient(backend.main.app).get("/ask", params={"q": "fees?", "top_k": 2}).json()
+    assert seen["top_k"] == 10
+    assert [s["text"] for s in body["sources"]] == ["chunk 9", "chunk 8"]
+    assert set(body["timings"]) == {"retrieval_ms", "rerank_ms", "generation_ms"}
+
+
+def test_trace_header_returns_stage_timings_and_metrics_count_them(monkeypatch):
+    monkeypatch.setattr(backend.main, "get_relevant_chunks", lambda q, **kwargs: [(0.9, {"text": "chunk"})])
+    monkeypatch.setattr(backend.main, "generate_answer", lambda q, context: "answer")
+    monkeypatch.setattr(backend.main.answer_cache, "ENABLED", False)
+    client = TestClient(backend.main.app)
+
+    plain = client.get("/ask", params={"q": "fees?"})
+    traced = client.get("/ask", params={"q": "fees?"}, headers={"X-Flux-Trace": "1"})
+
+    assert "server-timing" not in plain.headers
+    stages = [part.split(";")[0] for part in traced.headers["server-timing"].split(", ")]
+    assert stages == ["cache", "rerank", "pack", "generate"]
+
+    body = client.get("/metrics").text
+    assert 'flux_stage_seconds_bucket{stage="generate",le="+Inf"}' in body
+    assert 'flux_request_seconds_count{route="GET /ask"}' in body
@@ -0,0 +1,79 @@
+import json
+import random
+import threading
+
+from backend import metadata_store
+
+
+def test_append_and_lookup(tmp_path):
+    meta_path = str(tmp_path / "metadata.jsonl")
+
+    assert metadata_store.append(meta_path, [{"text": "foo"}, {"text": "bär"}]) == 0
+    assert metadata_store.append(meta_path, [{"text": "baz"}]) == 2
+    assert metadata_store.count(meta_path) == 3
+
+    metas = metadata_store.lookup(meta_path, [2, 0, 1, 7, -1])
+    assert metas == [{"text": "baz"}, {"text": "foo"}, {"text": "bär"}, {}, {}]
+
+
+def test_lookup_without_metadata_file(tmp_path):
+    meta_path = str(tmp_path / "metadata.jsonl")
+    assert metadata_store.lookup(meta_path, [0, 1]) == [{}, {}]
+
+
+def test_existing_jsonl_is_migrated(tmp_path):
+    meta_path = tmp_path / "metadata.jsonl"
+    meta_path.write_text("".join(json.dumps({"id": i}) + "\n" for i in range(5)))
+
+    # Readers never build the sidecar; the writer migrates it
+    assert metadata_store.lookup(str(meta_path), [4, 1]) == [{}, {}]
+    assert metadata_store.ensure_offsets(str(meta_path)) == 5
+    assert metadata_store.lookup(str(meta_path), [4, 1]) == [{"id": 4}, {"id": 1}]
+    assert metadata_store.count(str(meta_path)) == 5
+
+
+def test_stale_offsets_are_rebuilt(tmp_path):
+    meta_path = str(tmp_path / "metadata.jsonl")
+    metadata_store.append(meta_path, [{"id": 0}])
+
+    # A writer that does not know about the sidecar appends a row
+    with open(meta_path, "a") as f:
+        f.write(json.dumps({"id": 1}) + "\n")
+
+    assert metadata_store.lookup(meta_path, [1]) == [{}]
+    assert metadata_store.ensure_offsets(meta_path) == 2
+    assert metadata_store.lookup(meta_path, [1]) == [{"id": 1}]
+    assert metadata_store.count(meta_path) == 2
+
+
+def test_lookups_during_appends_never_touch_the_writers_files(tmp_path):
+    meta_path = str(tmp_path / "metadata.jsonl")
+    metadata_store.append(meta_path, [{"id": 0}])
+    done = threading.Event()
+    errors = []
+
+    def read():
+        rng = random.Random()
+        while not done.is_set():
+            try:
+                n = metadata_store.count(meta_path)
+                ids = [rng.randrange(n) for _ in range(8)]
+                for i, m in zip(ids, metadata_store.lookup(meta_path, ids, n)):
+                    assert m == {"id": i}
+            except Exception as e:
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for t in readers:
+        t.start()
+    for i in range(1, 2000):
+        metadata_store.append(meta_path, [{"id": i}])
+    done.set()
+    for t in readers:
+        t.join()
+
+    assert errors == []
+    assert metadata_store.count(meta_path) == 2000
+    assert metadata_store._offsets_in_sync(meta_path)
+    assert metadata_store.lookup(meta_path, [0, 1234, 1999]) == [{"id": 0}, {"id": 1234}, {"id": 1999}]
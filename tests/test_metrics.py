@@ -0,0 +1,50 @@
+from backend import metrics
+from backend.metrics import Histogram
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = Histogram("flux_test_seconds", "Test.", "stage", buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.01, 0.05, 2.0):
+        h.observe(value, "embed")
+
+    lines = h.render()
+
+    assert lines[:2] == ["# HELP flux_test_seconds Test.", "# TYPE flux_test_seconds histogram"]
+    assert 'flux_test_seconds_bucket{stage="embed",le="0.01"} 2' in lines
+    assert 'flux_test_seconds_bucket{stage="embed",le="0.1"} 3' in lines
+    assert 'flux_test_seconds_bucket{stage="embed",le="1"} 3' in lines
+    assert 'flux_test_seconds_bucket{stage="embed",le="+Inf"} 4' in lines
+    assert 'flux_test_seconds_sum{stage="embed"} 2.065000' in lines
+    assert 'flux_test_seconds_count{stage="embed"} 4' in lines
+
+
+def test_histogram_merges_worker_states():
+    router = Histogram("flux_test_seconds", "Test.", "stage", buckets=(1.0,))
+    worker = Histogram("flux_test_seconds", "Test.", "stage", buckets=(1.0,))
+    router.observe(0.5, "search")
+    worker.observe(0.5, "search")
+    worker.observe(2.0, "metadata")
+
+    lines = router.render([worker.state()])
+
+    assert 'flux_test_seconds_count{stage="search"} 2' in lines
+    assert 'flux_test_seconds_count{stage="metadata"} 1' in lines
+    # Merging does not change the router's own series
+    assert 'flux_test_seconds_count{stage="search"} 1' in router.render()
+
+
+def test_spans_are_traced_only_inside_a_trace(monkeypatch):
+    monkeypatch.setattr(metrics, "stages", Histogram("flux_stage_seconds", "Test.", "stage"))
+    with metrics.span("embed"):
+        pass
+
+    token = metrics.start_trace()
+    with metrics.span("search"):
+        pass
+    list(metrics.timed("ingest_parse", iter([1, 2])))
+    trace = metrics.end_trace(token)
+
+    assert [stage for stage, _ in trace] == ["search", "ingest_parse", "ingest_parse"]
+    assert set(metrics.stages.state()) == {"embed", "search", "ingest_parse"}
+    timing = metrics.server_timing(trace)
+    assert timing.startswith("search;dur=") and timing.count("ingest_parse;dur=") == 1
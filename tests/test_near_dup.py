@@ -0,0 +1,56 @@
+import numpy as np
+
+from backend.near_dup import MinHashLSH, signature, signatures
+
+DISCLAIMER = (
+    "This document is provided for informational purposes only and does not constitute "
+    "an offer or contract. The university reserves the right to change any course, fee "
+    "or regulation described here without notice. Contact the registrar for the latest version."
+)
+
+
+def test_signature_is_deterministic_and_similarity_tracks_overlap():
+    a = signature(DISCLAIMER)
+    assert np.array_equal(a, signature(DISCLAIMER.upper()))
+    near = signature(DISCLAIMER.replace("latest version", "current edition"))
+    other = signature("Lab B-204 was moved to the north campus in 2023 after the renovation.")
+    assert (a == near).mean() > 0.6
+    assert (a == other).mean() < 0.2
+
+
+def test_finds_near_duplicates_across_calls(tmp_path):
+    path = str(tmp_path / "minhash.u32")
+    lsh = MinHashLSH(path)
+    lsh.add(0, signatures(["Course CS101 requires two prerequisites.", DISCLAIMER]))
+
+    # Survives a reload: buckets are rebuilt from the signature file
+    lsh = MinHashLSH(path)
+    assert lsh.n_docs == 2
+    query = signatures([DISCLAIMER + " Page 4", "Weekly readings are posted online."])
+    assert lsh.find_duplicates(query, 0.8).tolist() == [1, -1]
+
+
+def test_duplicates_within_one_batch():
+    lsh = MinHashLSH()
+    sigs = signatures([DISCLAIMER, "Weekly readings are posted online.", DISCLAIMER])
+    assert lsh.find_duplicates(sigs, 0.8).tolist() == [-1, -1, -2]
+
+
+def test_add_keeps_rows_aligned_with_vector_ids():
+    lsh = MinHashLSH()
+    lsh.add(2, signatures([DISCLAIMER]))
+    lsh.add(0, signatures(["a b c", "d e f", DISCLAIMER]))
+    assert lsh.n_docs == 3
+    assert lsh.find_duplicates(signatures([DISCLAIMER]), 0.8).tolist() == [2]
+
+
+def test_matches_in_other_groups_need_min_groups():
+    lsh = MinHashLSH()
+    lsh.add(0, signatures([DISCLAIMER, DISCLAIMER, "Weekly readings are posted online."]))
+    query = signatures([DISCLAIMER])
+
+    # Rows 0 and 1 belong to groups 0 and 1; group 2 is the caller's own
+    assert lsh.find_duplicates(query, 0.8, groups=np.array([0, 1, 2]), group=2, min_groups=3).tolist() == [-1]
+    assert lsh.find_duplicates(query, 0.8, groups=np.array([0, 1, 2]), group=2, min_groups=2).tolist() in ([0], [1])
+    # A match in its own group always counts
+    assert lsh.find_duplicates(query, 0.8, groups=np.array([0, 2, 2]), group=2, min_groups=3).tolist() == [1]
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from backend import reranker
+
+HITS = [(0.9, {"text": "dense best"}), (0.8, {"text": "the answer"}), (0.7, {"text": "also relevant"})]
+
+
+class FakeCrossEncoder:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def predict(self, pairs, show_progress_bar=False):
+        self.calls.append(pairs)
+        time.sleep(self.delay)
+        return [{"dense best": 0.1, "the answer": 5.0, "also relevant": 2.0}[text] for _, text in pairs]
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    model = FakeCrossEncoder()
+    monkeypatch.setattr(reranker, "ENABLED", True)
+    monkeypatch.setattr(reranker, "_model", model)
+    monkeypatch.setattr(reranker, "cache", reranker.ScoreCache())
+    monkeypatch.setattr(reranker, "_pending", None)
+    return model
+
+
+def test_rerank_reorders_and_caches_scores(fake_model):
+    hits, info = reranker.rerank("q", HITS, top_k=2)
+    assert [m["text"] for _, m in hits] == ["the answer", "also relevant"]
+    assert info["reranked"] and info["cache_hits"] == 0
+    assert len(fake_model.calls) == 1 and len(fake_model.calls[0]) == 3
+
+    hits, info = reranker.rerank("q", HITS, top_k=2)
+    assert info["cache_hits"] == 3
+    assert len(fake_model.calls) == 1
+
+
+def test_budget_overrun_keeps_dense_order(fake_model):
+    fake_model.delay = 0.2
+    hits, info = reranker.rerank("slow", HITS, top_k=2, budget_ms=10)
+    assert hits == HITS[:2]
+    assert info["timed_out"] and not info["reranked"]
+    # The late scores still serve the next identical request
+    time.sleep(0.3)
+    assert reranker.rerank("slow", HITS, top_k=1, budget_ms=10)[1]["cache_hits"] == 3
+
+
+def test_timeouts_do_not_queue_scoring_work(fake_model):
+    fake_model.delay = 0.2
+    for i in range(6):
+        hits, info = reranker.rerank(f"slow {i}", HITS, top_k=2, budget_ms=10)
+        assert hits == HITS[:2] and info["timed_out"]
+
+    # One call runs; the rest skipped re-ranking instead of queueing behind it
+    assert reranker._executor._work_queue.qsize() == 0
+    assert reranker._stats["busy"] >= 5
+    reranker._pending.result()
+    assert len(fake_model.calls) == 1
+
+
+def test_model_loads_off_the_request_path(monkeypatch):
+    monkeypatch.setattr(reranker, "ENABLED", True)
+    monkeypatch.setattr(reranker, "_model", None)
+    monkeypatch.setattr(reranker, "_loading", None)
+    monkeypatch.setattr(reranker, "cache", reranker.ScoreCache())
+    monkeypatch.setattr(reranker, "load_model", lambda: FakeCrossEncoder())
+    hits, info = reranker.rerank("q", HITS, top_k=2)
+    assert hits == HITS[:2] and info["timed_out"]
+    reranker._loading.join()
+    assert reranker.rerank("q", HITS, top_k=1)[0][0][1]["text"] == "the answer"
@@ -2,31 +2,33 @@ import backend.retrieval
 
 import numpy as np
 
-class FakeIndex:
-    def __init__(self, ntotal):
-        self.ntotal = ntotal
+from backend.vector_store import Snapshot
+
+def FakeSnapshot(n_rows):
+    return Snapshot(index=None, n_rows=n_rows, mtime=None)
+
+def _fake_store(monkeypatch, vectors):
+    monkeypatch.setattr(backend.retrieval, "get_vectors", lambda index, ids, n_rows=None: np.asarray(vectors)[np.asarray(ids)])
+    monkeypatch.setattr(backend.retrieval, "fetch_metadata", lambda ids, n_rows=None: [{"page": int(i) + 1, "text": f"Chunk {int(i) + 1}"} for i in ids])
 
 def test_get_relevant_chunks(monkeypatch):
     def mock_embed_texts(texts):
         assert texts == ["test query"]
         return [np.array([0.1, 0.2, 0.3])]
 
-    def mock_search(index, q_emb, top_k):
+    def mock_search_snapshot(snap, q_emb, top_k, **kwargs):
         assert list(q_emb) == [0.1, 0.2, 0.3]
         assert top_k == 10
-        return [0.9, 0.8, 0.7], [
-            {"page": 1, "text": "Chunk 1"},
-            {"page": 2, "text": "Chunk 2"},
-            {"page": 3, "text": "Chunk 3"},
-        ]
+        return np.array([0.9, 0.8, 0.7]), np.array([0, 1, 2])
 
-    def mock_load_index(dim):
+    def mock_snapshot(dim):
         assert dim == 384
-        return FakeIndex(ntotal=10)
+        return FakeSnapshot(n_rows=10)
 
     monkeypatch.setattr(backend.retrieval, "embed_texts", mock_embed_texts)
-    monkeypatch.setattr(backend.retrieval, "search", mock_search)
-    monkeypatch.setattr(backend.retrieval, "load_index", mock_load_index)
+    monkeypatch.setattr(backend.retrieval, "search_snapshot", mock_search_snapshot)
+    monkeypatch.setattr(backend.retrieval, "snapshot", mock_snapshot)
+    _fake_store(monkeypatch, np.eye(3, dtype="float32"))
 
     result = backend.retrieval.get_relevant_chunks("test query")
 
@@ -35,4 +37,85 @@ def test_get_relevant_chunks(monkeypatch):
         (0.8, {"page": 2, "text": "Chunk 2"}),
         (0.7, {"page": 3, "text": "Chunk 3"}),
     ]
-    assert result == expected
+    assert [(round(s, 4), m) for s, m in result] == expected
+
+
+def test_near_duplicates_are_dropped(monkeypatch):
+    vectors = np.array([[1, 0, 0], [0.999, 0.04, 0], [0, 1, 0]], dtype="float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    monkeypatch.setattr(backend.retrieval, "snapshot", lambda dim: FakeSnapshot(n_rows=3))
+    monkeypatch.setattr(backend.retrieval, "embed_texts", lambda texts: [np.array([1.0, 0.0, 0.0])])
+    monkeypatch.setattr(backend.retrieval, "search_snapshot", lambda snap, q, top_k, **kwargs: (np.array([0.99, 0.98, 0.2]), np.array([0, 1, 2])))
+    _fake_store(monkeypatch, vectors)
+
+    result = backend.retrieval.get_relevant_chunks("q", top_k=3)
+    assert [meta["page"] for _, meta in result] == [1, 3]
+
+
+def test_select_diverse_mmr_prefers_novel_results():
+    vectors = np.array([[1, 0], [0.8, 0.6], [0, 1]], dtype="float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    relevance = [1.0, 0.95, 0.6]
+
+    assert backend.retrieval.select_diverse(vectors, relevance, 2, mmr_lambda=1.0) == [0, 1]
+    assert backend.retrieval.select_diverse(vectors, relevance, 2, mmr_lambda=0.3) == [0, 2]
+
+
+def test_select_diverse_handles_large_pools():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 384)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    keep = backend.retrieval.select_diverse(vectors, np.linspace(1, 0, 300), 10)
+    assert keep == list(range(10))
+
+
+def test_fuse_rrf_rewards_agreement():
+    scores, ids = backend.retrieval.fuse_rrf([np.array([1, 2, 3]), np.array([3, 4])])
+    assert ids.tolist()[0] == 3
+    assert set(ids.tolist()) == {1, 2, 3, 4}
+    assert list(scores) == sorted(scores, reverse=True)
+
+
+def test_hybrid_mode_fuses_dense_and_lexical(monkeypatch):
+    monkeypatch.setattr(backend.retrieval, "snapshot", lambda dim: FakeSnapshot(n_rows=10))
+    monkeypatch.setattr(backend.retrieval, "embed_texts", lambda texts: [np.array([1.0, 0.0])])
+    monkeypatch.setattr(backend.retrieval, "search_snapshot", lambda snap, q, top_k, **kwargs: (np.array([0.9, 0.5]), np.array([2, 3])))
+    monkeypatch.setattr(backend.retrieval, "lexical_search", lambda query, top_k, **kwargs: (np.array([5.0, 1.0]), np.array([7, 2])))
+    _fake_store(monkeypatch, np.eye(10, dtype="float32"))
+
+    result = backend.retrieval.get_relevant_chunks("XK-2291 filter", top_k=3, mode="hybrid")
+    assert [meta["text"] for _, meta in result] == ["Chunk 3", "Chunk 8", "Chunk 4"]
+
+    result = backend.retrieval.get_relevant_chunks("XK-2291 filter", top_k=3, mode="lexical")
+    assert [meta["text"] for _, meta in result] == ["Chunk 8", "Chunk 3"]
+
+
+def test_query_straddling_a_compaction_is_run_again(tmp_path, monkeypatch):
+    from backend import vector_store as vs
+    vs.set_index_dir(str(tmp_path / "index"))
+    try:
+        vectors = np.random.default_rng(0).standard_normal((12, 8)).astype("float32")
+        metas = [{"source": "a.pdf" if i % 2 == 0 else "b.pdf", "page": i, "text": f"chunk {i}"} for i in range(12)]
+        index = vs.add(vs.load_index(8), vectors, metas)
+        vs.save_index(index)
+        vs.delete_source("b.pdf")
+
+        # Compact after the search picked its rows but before their metadata is read
+        real_get_vectors = backend.retrieval.get_vectors
+        calls = []
+
+        def get_vectors_then_compact(index, ids, n_rows=None):
+            calls.append(ids)
+            found = real_get_vectors(index, ids, n_rows)
+            if len(calls) == 1:
+                vs.compact(vs.load_index(8))
+            return found
+
+        monkeypatch.setattr(backend.retrieval, "get_vectors", get_vectors_then_compact)
+        hits = backend.retrieval.get_relevant_chunks("chunk", top_k=1, mode="dense", query_embedding=vectors[8])
+
+        assert len(calls) == 2
+        assert hits[0][1]["page"] == 8
+    finally:
+        vs.set_index_dir("data/index")
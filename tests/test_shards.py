@@ -0,0 +1,98 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from backend import shards, vector_store, retrieval, metadata_store
+
+SOURCES = ["a.pdf", "b.pdf", "c.pdf", "d.pdf", "e.pdf"]
+
+
+@pytest.fixture
+def layout(tmp_path, monkeypatch):
+    monkeypatch.setattr(shards, "SHARD_DIR", str(tmp_path / "shards"))
+    vector_store.set_index_dir(str(tmp_path / "index"))
+    vectors = np.random.default_rng(0).standard_normal((20, 8)).astype("float32")
+    metas = [{"source": SOURCES[i % 5], "page": i, "text": f"chunk {i} of {SOURCES[i % 5]}"} for i in range(20)]
+    index = vector_store.add(vector_store.load_index(8), vectors, metas)
+    vector_store.save_index(index)
+    vector_store.delete_source("e.pdf")
+    yield tmp_path, vectors
+    shards.shutdown()
+    vector_store.set_index_dir("data/index")
+
+
+def _sources(shard_dir):
+    n = metadata_store.count(os.path.join(shard_dir, "metadata.jsonl"))
+    return {m["source"] for m in metadata_store.lookup(os.path.join(shard_dir, "metadata.jsonl"), range(n))}
+
+
+def test_shard_of_is_stable_and_in_range():
+    assert shards.shard_of("a.pdf", 4) == shards.shard_of("a.pdf", 4)
+    assert {shards.shard_of(f"doc-{i}.pdf", 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+def test_rebalance_keeps_live_chunks_and_groups_sources(layout):
+    assert sum(shards.rebalance(2, dim=8)) == 16
+    assert shards.read_manifest() == 2
+    for i in range(2):
+        assert all(shards.shard_of(s, 2) == i for s in _sources(shards.shard_dir(i)))
+
+    # Shards rebalance again from the current layout
+    assert sum(shards.rebalance(3, dim=8)) == 16
+    assert shards.read_manifest() == 3
+    assert set().union(*(_sources(shards.shard_dir(i)) for i in range(3))) == set(SOURCES[:4])
+    assert not os.path.exists(shards.SHARD_DIR + ".rebalance")
+
+
+def test_scatter_gather_merges_shard_results(layout, monkeypatch):
+    _, vectors = layout
+    shards.rebalance(2, dim=8)
+    monkeypatch.setattr(shards, "SHARDS", 2)
+
+    hits = retrieval.get_relevant_chunks("chunk", top_k=3, mode="dense", query_embedding=vectors[7])
+    assert hits[0][1]["page"] == 7
+    assert [s for s, _ in hits] == sorted((s for s, _ in hits), reverse=True)
+
+    hits = retrieval.get_relevant_chunks("chunk", top_k=20, mode="dense", query_embedding=vectors[7],
+                                         filters={"source": "b.pdf"})
+    assert sorted(m["page"] for _, m in hits) == [1, 6, 11, 16]
+
+
+def test_warm_up_reaches_every_shard(layout, monkeypatch):
+    from backend import main
+    shards.rebalance(2, dim=8)
+    monkeypatch.setattr(shards, "SHARDS", 2)
+
+    # Workers send back row counts, not their snapshots
+    assert sum(shards.call_all(main.warm_snapshot)) == 16
+
+
+def _exit_worker(code):
+    os._exit(code)
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def test_dead_worker_fails_calls_and_is_restarted(layout, monkeypatch):
+    shards.rebalance(2, dim=8)
+    monkeypatch.setattr(shards, "SHARDS", 2)
+    monkeypatch.setattr(shards, "LIVENESS_POLL", 0.1)
+
+    with pytest.raises(RuntimeError, match="exited with code 3"):
+        shards.call(0, _exit_worker, 3)
+    # The next call starts a fresh worker for that shard
+    assert shards.call_all(_sleep, 0) == [0, 0]
+
+
+def test_call_all_gives_up_on_a_stuck_shard(layout, monkeypatch):
+    shards.rebalance(2, dim=8)
+    monkeypatch.setattr(shards, "SHARDS", 2)
+    monkeypatch.setattr(shards, "CALL_TIMEOUT", 0.5)
+
+    with pytest.raises(TimeoutError, match="did not answer _sleep"):
+        shards.call_all(_sleep, 2)
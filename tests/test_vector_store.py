@@ -48,3 +48,401 @@ def test_vector_store_meta_loading(monkeypatch):
 
     # Clean up
     os.remove(temp_file.name)
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(backend.vector_store, "INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(backend.vector_store, "INDEX_PATH", str(tmp_path / "faiss.idx"))
+    monkeypatch.setattr(backend.vector_store, "META_PATH", str(tmp_path / "metadata.jsonl"))
+    monkeypatch.setattr(backend.vector_store, "VECTORS_PATH", str(tmp_path / "vectors.f32"))
+    monkeypatch.setattr(backend.vector_store, "LEXICAL_PATH", str(tmp_path / "lexical.npz"))
+    monkeypatch.setattr(backend.vector_store, "NEAR_DUP_PATH", str(tmp_path / "minhash.u32"))
+    monkeypatch.setattr(backend.vector_store, "DOCUMENTS_PATH", str(tmp_path / "documents.npz"))
+    monkeypatch.setattr(backend.vector_store, "TOMBSTONES_PATH", str(tmp_path / "tombstones.i8"))
+    monkeypatch.setattr(backend.vector_store, "WAL_PATH", str(tmp_path / "wal.log"))
+    monkeypatch.setattr(backend.vector_store, "WRITER_LOCK_PATH", str(tmp_path / "writer.lock"))
+    backend.vector_store.reset_index()
+    yield tmp_path
+    backend.vector_store.reset_index()
+
+
+def test_load_index_is_resident(index_dir, monkeypatch):
+    import numpy as np
+    vs = backend.vector_store
+
+    index = vs.load_index(4)
+    vs.add(index, np.ones((2, 4), dtype="float32"), [{"text": "a"}, {"text": "b"}])
+    vs.save_index(index)
+
+    reads = []
+    monkeypatch.setattr(vs.faiss, "read_index", lambda path: reads.append(path))
+
+    assert vs.load_index(4) is index
+    assert vs.load_index(4).ntotal == 2
+    assert reads == []
+
+
+def test_load_index_reloads_when_file_changes(index_dir):
+    import faiss
+    import numpy as np
+    vs = backend.vector_store
+
+    index = vs.load_index(4)
+    vs.save_index(index)
+    gen = vs.generation()
+
+    # Another process writes a newer index file
+    other = faiss.IndexFlatIP(4)
+    other.add(np.ones((3, 4), dtype="float32"))
+    faiss.write_index(other, vs.INDEX_PATH)
+    st = os.stat(vs.INDEX_PATH)
+    os.utime(vs.INDEX_PATH, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    reloaded = vs.load_index(4)
+    assert reloaded is not index
+    assert reloaded.ntotal == 3
+    assert vs.generation() > gen
+
+
+def test_search_returns_metadata_for_hits(index_dir):
+    import numpy as np
+    vs = backend.vector_store
+
+    index = vs.load_index(4)
+    vecs = np.eye(4, dtype="float32")
+    vs.add(index, vecs, [{"text": f"chunk {i}"} for i in range(4)])
+
+    scores, metas = vs.search(index, vecs[2], top_k=1)
+    assert metas == [{"text": "chunk 2", "chunk_id": 2}]
+    assert scores[0] > 0.99
+
+
+def _random_vectors(n, dim, seed=0):
+    import numpy as np
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+
+
+def test_ivf_index_is_trained_once_enough_vectors(index_dir, monkeypatch):
+    import faiss
+    vs = backend.vector_store
+    monkeypatch.setattr(vs, "INDEX_TYPE", "ivf")
+    monkeypatch.setattr(vs, "TRAIN_MIN_VECTORS", 300)
+
+    index = vs.load_index(8)
+    vecs = _random_vectors(400, 8)
+    index = vs.add(index, vecs[:200], [{"i": i} for i in range(200)])
+    assert isinstance(index, faiss.IndexFlat)
+
+    index = vs.add(index, vecs[200:], [{"i": i} for i in range(200, 400)])
+    assert faiss.try_extract_index_ivf(index) is not None
+    assert index.ntotal == 400
+    assert vs.load_index(8) is index
+
+    # Exhaustive probing finds the exact vector and its metadata
+    scores, metas = vs.search(index, vecs[123], top_k=1, nprobe=index.nlist)
+    assert metas == [{"i": 123, "chunk_id": 123}]
+
+
+def test_rebuild_converts_flat_index(index_dir):
+    vs = backend.vector_store
+    vecs = _random_vectors(500, 16)
+
+    index = vs.load_index(16)
+    vs.add(index, vecs, [{"i": i} for i in range(500)])
+
+    hnsw = vs.rebuild(index, "hnsw")
+    assert hnsw.ntotal == 500
+    _, metas = vs.search(hnsw, vecs[42], top_k=1, ef_search=128)
+    assert metas == [{"i": 42, "chunk_id": 42}]
+
+    flat_stats = vs.index_stats(index)
+    hnsw_stats = vs.index_stats(hnsw)
+    assert flat_stats["memory_bytes"] >= 500 * 16 * 4
+    assert hnsw_stats["memory_bytes"] > flat_stats["memory_bytes"]
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf", "ivfpq", "pq"])
+def test_index_stats_do_not_serialize_the_index(index_dir, monkeypatch, kind):
+    import faiss
+    vs = backend.vector_store
+    monkeypatch.setattr(vs, "PQ_M", 4)
+    monkeypatch.setattr(vs, "PQ_NBITS", 4)
+    index = vs.make_index(16, kind, n_train=2000)
+    vecs = _random_vectors(2000, 16)
+    if not index.is_trained:
+        index.train(vecs)
+    index.add(vecs)
+    serialized = faiss.serialize_index(index).nbytes
+
+    def no_serialize(index):
+        raise AssertionError("index_stats serialized the index")
+
+    monkeypatch.setattr(faiss, "serialize_index", no_serialize)
+    # Within the headers and small tables serialization adds
+    assert 0.95 * serialized <= vs.index_stats(index)["memory_bytes"] <= serialized
+
+
+def test_ivfpq_compresses_vectors(index_dir, monkeypatch):
+    vs = backend.vector_store
+    monkeypatch.setattr(vs, "PQ_M", 4)
+    monkeypatch.setattr(vs, "PQ_NBITS", 4)
+    vecs = _random_vectors(2000, 16)
+
+    index = vs.load_index(16)
+    vs.add(index, vecs, [{"i": i} for i in range(2000)])
+    pq = vs.rebuild(index, "ivfpq")
+
+    assert pq.ntotal == 2000
+    assert vs.index_stats(pq)["bytes_per_vector"] < vs.index_stats(index)["bytes_per_vector"]
+
+
+def test_compressed_index_with_exact_rerank(index_dir):
+    import numpy as np
+    vs = backend.vector_store
+    vecs = _random_vectors(2000, 32)
+
+    index = vs.load_index(32)
+    vs.add(index, vecs, [{"i": i} for i in range(2000)])
+    sq8 = vs.rebuild(index, "sq8")
+
+    flat_bpv = vs.index_stats(index)["bytes_per_vector"]
+    assert vs.index_stats(sq8)["bytes_per_vector"] < flat_bpv / 3
+
+    query = vecs[7] + 0.01
+    exact_scores, exact_metas = vs.search(index, query, top_k=5)
+    scores, metas = vs.search(sq8, query, top_k=5, rerank_factor=4)
+    assert metas == exact_metas
+    assert np.allclose(scores, exact_scores, atol=1e-5)
+
+
+def test_rebuild_uses_exact_vectors_from_disk(index_dir, monkeypatch):
+    import numpy as np
+    vs = backend.vector_store
+    monkeypatch.setattr(vs, "PQ_M", 4)
+    monkeypatch.setattr(vs, "PQ_NBITS", 4)
+    vecs = _random_vectors(1000, 16)
+
+    index = vs.load_index(16)
+    vs.add(index, vecs, [{"i": i} for i in range(1000)])
+    pq = vs.rebuild(index, "pq")
+    back = vs.rebuild(pq, "flat")
+
+    assert np.allclose(vs.all_vectors(back), vs.all_vectors(index))
+
+
+def test_lexical_index_follows_adds_and_reloads(index_dir):
+    import numpy as np
+    vs = backend.vector_store
+
+    index = vs.load_index(4)
+    vs.add(index, np.eye(4, dtype="float32")[:2], [{"text": "alpha part AB-12"}, {"text": "beta"}])
+    vs.add(index, np.eye(4, dtype="float32")[2:], [{"text": "gamma"}, {"text": "delta AB-12"}])
+    vs.save_index(index)
+
+    _, ids = vs.lexical_index().search("ab-12")
+    assert sorted(ids.tolist()) == [0, 3]
+
+    vs.reset_index()
+    _, ids = vs.lexical_index().search("gamma")
+    assert ids.tolist() == [2]
+
+
+def test_lexical_index_is_built_for_existing_directories(index_dir):
+    import json
+    import faiss
+    vs = backend.vector_store
+    legacy = faiss.IndexFlatIP(4)
+    legacy.add(_random_vectors(2, 4))
+    faiss.write_index(legacy, vs.INDEX_PATH)
+    with open(vs.META_PATH, "w") as f:
+        for text in ["old chunk one", "old chunk two"]:
+            f.write(json.dumps({"text": text}) + "\n")
+
+    vs.migrate(4)
+    _, ids = vs.lexical_index().search("two")
+    assert ids.tolist() == [1]
+
+
+def test_get_vectors_reads_stored_or_reconstructs(index_dir):
+    import numpy as np
+    vs = backend.vector_store
+    vecs = _random_vectors(50, 8)
+
+    index = vs.load_index(8)
+    vs.add(index, vecs, [{} for _ in range(50)])
+    expected = vecs[[3, 40]] / np.linalg.norm(vecs[[3, 40]], axis=1, keepdims=True)
+    assert np.allclose(vs.get_vectors(index, [3, 40]), expected, atol=1e-6)
+
+    os.remove(vs.VECTORS_PATH)
+    assert np.allclose(vs.get_vectors(index, [3, 40]), expected, atol=1e-6)
+
+
+def test_legacy_directory_gets_vectors_backfilled(index_dir):
+    import json
+    import faiss
+    import numpy as np
+    vs = backend.vector_store
+    old, new = _random_vectors(10, 8), _random_vectors(5, 8, seed=1)
+    faiss.normalize_L2(old)
+    legacy = faiss.IndexFlatIP(8)
+    legacy.add(old)
+    faiss.write_index(legacy, vs.INDEX_PATH)
+    with open(vs.META_PATH, "w") as f:
+        f.writelines(json.dumps({"text": f"old {i}"}) + "\n" for i in range(10))
+
+    # Until the writer backfills vectors.f32, readers reconstruct from the index
+    index = vs.load_index(8)
+    assert vs.exact_vectors(8, index.ntotal) is None
+    assert np.allclose(vs.get_vectors(index, [3]), old[[3]], atol=1e-6)
+
+    # The first add backfills rows 0-9 so the new rows land at their ids
+    index = vs.add(index, new, [{"text": f"new {i}"} for i in range(5)])
+    assert vs.exact_vectors(8, 15).shape == (15, 8)
+    faiss.normalize_L2(new)
+    assert np.allclose(vs.get_vectors(index, [3, 12]), np.stack([old[3], new[2]]), atol=1e-6)
+    assert vs.search_ids(index, new[2], top_k=1, rows=[3, 12])[1].tolist() == [12]
+
+
+def test_near_dup_index_follows_metadata(index_dir):
+    import numpy as np
+    from backend.near_dup import signatures
+    vs = backend.vector_store
+
+    text = "The university reserves the right to change any course or fee without notice."
+    index = vs.load_index(4)
+    vs.add(index, np.ones((2, 4), dtype="float32"), [{"text": text}, {"text": "Weekly readings."}])
+    assert vs.near_dup_index().find_duplicates(signatures([text]), 0.8).tolist() == [0]
+
+    # A signature file lost or cut short is rebuilt from metadata.jsonl by the writer
+    os.remove(index_dir / "minhash.u32")
+    vs.reset_index()
+    assert vs.near_dup_index().n_docs == 0
+    vs.migrate(4)
+    assert vs.near_dup_index().n_docs == 2
+    assert vs.near_dup_index().find_duplicates(signatures([text]), 0.8).tolist() == [0]
+
+
+def _two_documents(vs, n=32, dim=8):
+    vectors = _random_vectors(n, dim)
+    metas = [{"source": "a.pdf" if i % 2 == 0 else "b.pdf", "page": i, "text": f"chunk number {i}"} for i in range(n)]
+    index = vs.add(vs.load_index(dim), vectors, metas)
+    return index, vectors
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "pq", "ivf", "ivfpq"])
+def test_deleted_documents_are_not_returned(index_dir, monkeypatch, kind):
+    import faiss
+    vs = backend.vector_store
+    monkeypatch.setattr(vs, "INDEX_TYPE", kind)
+    monkeypatch.setattr(vs, "PQ_M", 2)
+    monkeypatch.setattr(vs, "PQ_NBITS", 4)
+    monkeypatch.setattr(vs, "TRAIN_MIN_VECTORS", 10_000)
+    index, vectors = _two_documents(vs)
+    if kind in ("pq", "ivf", "ivfpq"):
+        index = vs.rebuild(index, kind)
+    # Every list is probed, so an IVF index must return each live row
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = ivf.nlist
+
+    assert vs.delete_source("a.pdf") == 16
+    assert vs.delete_source("a.pdf") == 0
+    scores, ids = vs.search_ids(index, vectors[0], top_k=32)
+    assert sorted(ids.tolist()) == list(range(1, 32, 2))
+    every_chunk = " ".join(str(i) for i in range(32))
+    assert sorted(vs.lexical_search(every_chunk, top_k=32)[1].tolist()) == list(range(1, 32, 2))
+
+    # Tombstones are durable
+    vs.reset_index()
+    assert vs.documents().n_dead == 16
+
+
+def test_compaction_keeps_chunk_ids(index_dir):
+    vs = backend.vector_store
+    index, vectors = _two_documents(vs, n=6)
+    vs.save_index(index)
+    vs.delete_source("b.pdf")
+
+    index, dropped = vs.compact(index)
+    assert dropped == 3
+    assert index.ntotal == 3
+    assert [m["chunk_id"] for m in vs.fetch_metadata([0, 1, 2])] == [0, 2, 4]
+    assert vs.documents().rows_for_chunks([2]).tolist() == [1]
+    assert vs.search_ids(index, vectors[2], top_k=1)[1].tolist() == [1]
+    assert vs.lexical_search("number 4", top_k=1)[1].tolist() == [2]
+    assert not os.path.exists(index_dir / "tombstones.i8")
+
+    # New chunks never reuse the ids of compacted ones, also after a reload
+    vs.reset_index()
+    vs.add(vs.load_index(8), _random_vectors(1, 8), [{"source": "c.pdf", "page": 1, "text": "new"}])
+    assert vs.documents().chunk_ids.tolist() == [0, 2, 4, 6]
+
+
+@pytest.mark.parametrize("exact_max", [50_000, 0])
+def test_filtered_search_stays_inside_the_filter(index_dir, monkeypatch, exact_max):
+    vs = backend.vector_store
+    monkeypatch.setattr(vs, "FILTER_EXACT_MAX", exact_max)
+    index, vectors = _two_documents(vs)
+
+    rows = vs.documents().select_rows(source="b.pdf", page_from=10, page_to=20)
+    assert rows.tolist() == [11, 13, 15, 17, 19]
+    scores, ids = vs.search_ids(index, vectors[0], top_k=3, rows=rows)
+    assert len(ids) == 3 and set(ids.tolist()) <= set(rows.tolist())
+    assert list(scores) == sorted(scores, reverse=True)
+    assert vs.search_ids(index, vectors[13], top_k=1, rows=rows)[1].tolist() == [13]
+
+    every_chunk = " ".join(str(i) for i in range(32))
+    assert sorted(vs.lexical_search(every_chunk, top_k=32, rows=rows)[1].tolist()) == rows.tolist()
+
+
+def test_crash_recovery_replays_committed_rows(index_dir):
+    import numpy as np
+    vs = backend.vector_store
+    index, vectors = _two_documents(vs, n=6)
+    vs.save_index(index)
+    vs.add(index, vectors[:2], [{"source": "c.pdf", "page": 1, "text": "after the snapshot"}] * 2)
+    # A batch that died between writing its rows and logging them
+    with open(vs.VECTORS_PATH, "ab") as f:
+        f.write(np.ones((3, 8), dtype="float32").tobytes())
+    backend.metadata_store.append(vs.META_PATH, [{"text": "torn"}] * 3)
+
+    vs.reset_index()
+    with vs.writer(8):
+        pass
+    index = vs.load_index(8)
+    assert index.ntotal == 8
+    assert backend.metadata_store.count(vs.META_PATH) == 8
+    assert os.path.getsize(vs.VECTORS_PATH) == 8 * 8 * 4
+    assert vs.check(8)["problems"] == []
+
+
+def test_snapshot_searches_rows_committed_since_the_save(index_dir):
+    vs = backend.vector_store
+    index, vectors = _two_documents(vs, n=6)
+    vs.save_index(index)
+    snap = vs.snapshot(8)
+    assert snap.n_rows == 6
+
+    extra = _random_vectors(2, 8, seed=1)
+    vs.add(index, extra, [{"source": "c.pdf", "page": 1, "text": "new"}] * 2)
+    assert snap.n_rows == 6
+    snap = vs.snapshot(8)
+    assert (snap.index.ntotal, snap.n_rows) == (6, 8)
+    assert vs.search_snapshot(snap, extra[1], top_k=1)[1].tolist() == [7]
+    assert vs.search_snapshot(snap, vectors[3], top_k=1)[1].tolist() == [3]
+    rows = vs.documents().select_rows(source="c.pdf")
+    assert sorted(vs.search_snapshot(snap, vectors[3], top_k=5, rows=rows)[1].tolist()) == [6, 7]
+
+    vs.delete_rows([7])
+    assert 7 not in vs.search_snapshot(snap, extra[1], top_k=8)[1].tolist()
+
+
+def test_check_reports_uncommitted_rows(index_dir):
+    vs = backend.vector_store
+    index, _ = _two_documents(vs, n=6)
+    assert vs.check(8)["committed_rows"] == 6
+    backend.metadata_store.append(vs.META_PATH, [{"text": "torn"}])
+    report = vs.check(8)
+    assert report["metadata_rows"] == 7
+    assert len(report["problems"]) == 1
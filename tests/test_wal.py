@@ -0,0 +1,25 @@
+from backend import wal
+
+
+def test_committed_rows_follow_the_log(tmp_path):
+    path = str(tmp_path / "wal.log")
+    assert wal.committed_rows(path) == 0
+    wal.append(path, 10, 4)
+    wal.append(path, 14, 2)
+    assert wal.committed_rows(path) == 16
+    wal.reset(path)
+    assert wal.committed_rows(path) == 0
+
+
+def test_torn_or_corrupt_records_are_ignored(tmp_path):
+    path = str(tmp_path / "wal.log")
+    wal.append(path, 0, 4)
+    wal.append(path, 4, 4)
+    with open(path, "ab") as f:
+        f.write(wal.RECORD.pack(8, 4, 0)[:10])
+    assert wal.committed_rows(path) == 8
+
+    with open(path, "r+b") as f:
+        f.seek(wal.RECORD.size + 3)
+        f.write(b"\xff")
+    assert wal.committed_rows(path) == 4